@@ -0,0 +1,11 @@
+import nonebot
+
+nonebot.init()
+
+# 只加载 chat 插件，不注册适配器，不连接协议端
+nonebot.load_plugin("rmts.plugins.chat")
+
+from rmts.plugins.chat.replay import main
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,6 @@
 import asyncio
 import httpx
 import random
-import json
 
 try:
     from nonebot.log import logger
@@ -11,6 +10,8 @@ except ImportError:
 
 from typing import Optional
 
+from rmts.utils.codec import loads
+
 
 class LiveRoom:
     """
@@ -99,13 +100,12 @@ async def get_live_status(uid: int) -> Optional[dict]:
         url = f"https://api.live.bilibili.com/room/v1/Room/get_status_info_by_uids?uids[]={uid}"
         try:
             r = await client.get(url, headers=get_header(uid))
-            r.encoding = 'utf-8'
         except Exception as e:
             logger.error(f"请求 {url} 时出错，{e}")
             return None
 
         try:
-            bli_live_data = json.loads(r.text)
+            bli_live_data = loads(r.content)
         except Exception as e:
             logger.error(f"解析 json 数据时出错，{e}")
             return None
@@ -3,19 +3,23 @@ import random
 from nonebot import logger
 from nonebot import get_driver
 from nonebot.rule import is_type
-from nonebot import on_message, on_notice, on_fullmatch
+from nonebot.permission import SUPERUSER
+from nonebot import on_message, on_notice, on_fullmatch, on_startswith
 from nonebot.rule import to_me, Rule
 from nonebot.adapters.onebot.v11 import MessageSegment, Message
 from nonebot.adapters.onebot.v11 import Bot, PokeNotifyEvent
-from nonebot.adapters.onebot.v11 import GroupMessageEvent
+from nonebot.adapters.onebot.v11 import GroupMessageEvent, MessageEvent
 
 from rmts.utils.nonebot import is_poke_me
 from rmts.utils.nonebot import get_nickname
+from rmts.utils import try_acquire_global_token
 from rmts.utils import acquire_global_token_decorator as acquire_token
 
 from .pool import ModelPool
+from .message import USER_TEXT_MARKER, USER_IMAGE_MARKER
 from .clear_history import ClearHistory
 from .function_calling import function_container
+from .usage import usage_ledger
 
 # 初始化聊天池
 model_pool = ModelPool(function_container)
@@ -24,7 +28,6 @@ model_pool = ModelPool(function_container)
 chat = on_message(rule=to_me() & is_type(GroupMessageEvent), priority=5)
 
 @chat.handle()
-@acquire_token()
 async def rmts_chat(bot: Bot, event: GroupMessageEvent):
     # 提取当前消息中的图片
     images = [seg.data.get("url") for seg in event.get_message() if seg.type == "image"]
@@ -48,9 +51,14 @@ async def rmts_chat(bot: Bot, event: GroupMessageEvent):
     user_message = f"博士（TA的名字是：{nickname}，TA的ID是{event.user_id}）"
     if images:
         images_text = "，".join(f"第{i+1}张图片的链接是：{url}" for i, url in enumerate(images))
-        user_message += f"，发送了图片：{images_text}"
-    user_message += f"，对你说：{text}"
-    reply = await model_pool.chat(event.group_id, event.user_id, user_message)
+        user_message += f"{USER_IMAGE_MARKER}{images_text}"
+    user_message += f"{USER_TEXT_MARKER}{text}"
+
+    # 被限流时不调用 LLM，直接使用本地兜底回复
+    if await try_acquire_global_token():
+        reply = await model_pool.chat(event.group_id, event.user_id, user_message)
+    else:
+        reply = model_pool.fallback_chat(event.group_id, user_message)
     if reply:
         await chat.finish(MessageSegment.reply(event.message_id) + f"{reply}")
 
@@ -66,7 +74,6 @@ poke_msgs = ["博士（TA的名字是：{}，TA的ID是{}）戳了戳你",
 poke_handler = on_notice(rule=Rule(is_poke_me), priority=3, block=True)
 
 @poke_handler.handle()
-@acquire_token()
 async def handle_poke(bot: Bot, event: PokeNotifyEvent):
     if event.group_id is None: # 私聊戳一戳不回复
         await poke_handler.finish()
@@ -74,17 +81,27 @@ async def handle_poke(bot: Bot, event: PokeNotifyEvent):
     nickname = await get_nickname(bot, event.group_id, event.user_id)
     text = random.choice(poke_msgs).format(nickname, event.user_id)
 
-    reply = await model_pool.chat(event.group_id, event.user_id, text)
+    if await try_acquire_global_token():
+        reply = await model_pool.chat(event.group_id, event.user_id, text)
+    else:
+        reply = model_pool.fallback_chat(event.group_id, text)
     if reply:
         await poke_handler.finish(MessageSegment.at(event.user_id) + f" {reply}")
 
 
-# 在程序关闭时保存聊天记录
+# 在收到第一条消息前预加载最近活跃的群组的历史记录
 driver = get_driver()
 
+@driver.on_startup
+async def preload_chat_history():
+    await model_pool.preload()
+
+# 在程序关闭时保存聊天记录
+
 @driver.on_shutdown
 async def save_chat_history():
     await model_pool.save_messages()
+    await model_pool.close()
 
 
 # 记忆清除
@@ -98,3 +115,22 @@ clear_history_handler = on_fullmatch("清除记忆", rule=to_me() & is_type(Grou
 async def handle_clear_history(event: GroupMessageEvent): 
     reply = await history_clearer.try_clear(event.group_id, event.user_id)
     await clear_history_handler.finish(MessageSegment.reply(event.message_id) + f"{reply}")
+
+
+# 函数模块重载，例如：重载函数 info，不指定函数模块时重载源文件有改动的函数模块
+reload_functions_handler = on_startswith("重载函数", rule=to_me(), permission=SUPERUSER, priority=2, block=True)
+
+@reload_functions_handler.handle()
+async def handle_reload_functions(event: MessageEvent):
+    packages = event.get_plaintext().strip().removeprefix("重载函数").split()
+    results = function_container.reload(packages)
+    await reload_functions_handler.finish("\n".join(results))
+
+
+# 用量统计，例如：用量统计 30，不指定天数时统计最近 7 天
+usage_report_handler = on_startswith("用量统计", rule=to_me(), permission=SUPERUSER, priority=2, block=True)
+
+@usage_report_handler.handle()
+async def handle_usage_report(event: MessageEvent):
+    days = event.get_plaintext().strip().removeprefix("用量统计").strip()
+    await usage_report_handler.finish(usage_ledger.report(days=int(days) if days.isdigit() and int(days) > 0 else 7))
@@ -0,0 +1,250 @@
+"""
+被截断的聊天记录归档
+历史消息超过 max_history 被截断时，被删除的对话按轮次追加到群组的 gzip 压缩归档中，
+第一次检索时加载归档并建立全文索引（见 rmts.utils.search），模型通过 search_chat_history 函数按需检索较早的对话，
+不需要增大 max_history 也能回忆起较早聊过的具体内容
+"""
+
+import gzip
+import time
+import asyncio
+
+from pathlib import Path
+from datetime import datetime
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from nonebot.log import logger
+
+from rmts.utils.codec import CodecError, dumps, loads, write_atomic
+from rmts.utils.search import BM25Index
+
+from .history import history_dir
+
+# 每个群组的归档默认保留的对话轮数
+DEFAULT_MAX_TURNS = 5000
+# 检索结果中用户消息和回复各自保留的长度
+RESULT_TEXT_LENGTH = 150
+
+@dataclass
+class ArchivedTurn:
+    """
+    一轮被截断的对话
+    """
+    time: float   # 归档时间，对话发生在这之前
+    user: str     # 博士的消息，包含博士身份前缀
+    reply: str    # 迷迭香的回复，多条回复以换行连接，不包括函数调用和函数返回结果
+
+    @property
+    def search_text(self) -> str:
+        """建立索引的文本"""
+        return f"{self.user}\n{self.reply}"
+
+    def to_text(self) -> str:
+        """转换为检索结果中的文本"""
+        def shorten(text: str) -> str:
+            return text if len(text) <= RESULT_TEXT_LENGTH else text[:RESULT_TEXT_LENGTH] + "…"
+
+        lines = [f"（{datetime.fromtimestamp(self.time):%Y-%m-%d %H:%M}之前）"]
+        if self.user:
+            lines.append(shorten(self.user))
+        if self.reply:
+            lines.append(f"迷迭香：{shorten(self.reply)}")
+        return "\n".join(lines)
+
+def turns_from_messages(messages: Sequence[Any], archived_at: float) -> List[ArchivedTurn]:
+    """
+    将被截断的历史消息按用户消息划分为对话轮次，只保留有文本内容的用户消息和回复
+    说明：
+        第一条用户消息之前的回复属于上一次截断时已经归档的对话，会被忽略
+    """
+    turns: List[ArchivedTurn] = []
+    for msg in messages:
+        role = msg["role"]
+        content = msg.get("content")
+        if not isinstance(content, str) or not content:
+            continue
+        if role == "user":
+            turns.append(ArchivedTurn(time=archived_at, user=content, reply=""))
+        elif role == "assistant" and turns:
+            turns[-1].reply = f"{turns[-1].reply}\n{content}" if turns[-1].reply else content
+    return turns
+
+class HistoryArchive:
+    """
+    单个群组的聊天记录归档，方法：
+        add: 添加被截断的历史消息
+        flush: 将新添加的对话追加到归档文件
+        search: 检索与查询最相关的对话
+        delete: 删除归档
+    说明：
+        归档文件由多个 gzip 成员组成，每次 flush 追加一个成员，读取时依次解压；
+        同一群组的 add、flush 调用需持有该群组的锁
+    """
+
+    def __init__(self,
+                 group_id: int,
+                 *,
+                 filename: str = "rosmontis_archive.jsonl.gz",
+                 max_turns: int = DEFAULT_MAX_TURNS,
+                 directory: Optional[Path] = None
+    ) -> None:
+        """
+        参数：
+            group_id: 群号
+            filename: 基础文件名，会自动加上群号后缀
+            max_turns: 最多保留的对话轮数，加载时超出的最旧的对话会从文件中删除
+            directory: 文件所在目录，默认为 history_dir()
+        """
+        base_name = filename.split(".", 1)[0]
+        self.path = (directory or history_dir()) / f"{base_name}_group_{group_id}.jsonl.gz"
+        self.max_turns = max_turns
+        self.turns: List[ArchivedTurn] = []    # 已加载的对话，下标即索引中的键
+        self.pending: List[ArchivedTurn] = []  # 尚未写入文件的对话
+        self.index: BM25Index[int] = BM25Index()
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+
+    def add(self, messages: Sequence[Any]) -> int:
+        """
+        添加被截断的历史消息，返回添加的对话轮数
+        参数：
+            messages: 被截断的消息记录或消息参数字典，最后一轮对话的回复可能仍保留在历史消息中，也应一并传入
+        """
+        turns = turns_from_messages(messages, time.time())
+        self.pending.extend(turns)
+        if self._loaded:
+            self._index(turns)
+        return len(turns)
+
+    async def flush(self) -> bool:
+        """
+        将新添加的对话作为一个 gzip 成员追加到归档文件，成功或没有新对话时返回 True
+        """
+        if not self.pending:
+            return True
+        pending, self.pending = self.pending, []
+        data = b"".join(dumps(asdict(turn)) + b"\n" for turn in pending)
+
+        def write() -> None:
+            self.path.parent.mkdir(exist_ok=True)
+            with open(self.path, "ab") as f:
+                f.write(gzip.compress(data))
+
+        try:
+            await asyncio.to_thread(write)
+        except Exception as e:
+            logger.error(f"写入聊天记录归档失败: {e}")
+            self.pending = pending + self.pending
+            return False
+        return True
+
+    async def search(self, query: str, limit: int = 3) -> List[ArchivedTurn]:
+        """
+        检索与查询最相关的对话，第一次检索时加载归档
+        参数：
+            query: 查询文本
+            limit: 最多返回的对话轮数
+        返回值：
+            按相关性从高到低排列的对话
+        """
+        await self._load()
+        return [self.turns[key] for key, _ in self.index.search(query, limit)]
+
+    def delete(self) -> bool:
+        """
+        删除归档文件和已加载的对话，返回是否删除了文件
+        """
+        self.turns = []
+        self.pending = []
+        self.index.clear()
+        if not self.path.exists():
+            return False
+        self.path.unlink()
+        return True
+
+    def _index(self, turns: Sequence[ArchivedTurn]) -> None:
+        """将对话加入已加载的对话和索引"""
+        for turn in turns:
+            self.index.add(len(self.turns), turn.search_text)
+            self.turns.append(turn)
+
+    async def _load(self) -> None:
+        """在线程中读取归档文件并建立索引，尚未写入文件的对话也会加入索引"""
+        async with self._load_lock:
+            if self._loaded:
+                return
+
+            def read_and_index() -> Tuple[List[ArchivedTurn], BM25Index[int]]:
+                turns = self._read()
+                index: BM25Index[int] = BM25Index()
+                for i, turn in enumerate(turns):
+                    index.add(i, turn.search_text)
+                return turns, index
+
+            start = time.perf_counter()
+            try:
+                self.turns, self.index = await asyncio.to_thread(read_and_index)
+            except Exception as e:
+                logger.error(f"加载聊天记录归档失败: {e}")
+                self.turns, self.index = [], BM25Index()
+            self._index(self.pending)
+            self._loaded = True
+            logger.info(f"已加载{len(self.turns)}轮归档的对话，耗时{(time.perf_counter() - start) * 1000:.1f}毫秒")
+
+    def _read(self) -> List[ArchivedTurn]:
+        """
+        读取归档文件，文件末尾不完整（写入时崩溃）或超过保留轮数时重写文件
+        """
+        if not self.path.exists():
+            return []
+        turns: List[ArchivedTurn] = []
+        damaged = False
+        try:
+            with gzip.open(self.path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        damaged = True
+                        break
+                    data: Dict[str, Any] = loads(line)
+                    turns.append(ArchivedTurn(**data))
+        except (EOFError, OSError, CodecError, TypeError) as e:
+            logger.warning(f"聊天记录归档 {self.path} 末尾有不完整的记录，已截断: {e}")
+            damaged = True
+
+        if damaged or len(turns) > self.max_turns:
+            turns = turns[-self.max_turns:] if self.max_turns > 0 else []
+            content = b"".join(dumps(asdict(turn)) + b"\n" for turn in turns)
+            write_atomic(self.path, gzip.compress(content))
+        return turns
+
+class ArchiveStore:
+    """
+    所有群组的聊天记录归档，Model 和 search_chat_history 函数通过群号获取同一个归档
+    """
+
+    def __init__(self, max_turns: int = DEFAULT_MAX_TURNS) -> None:
+        """
+        参数：
+            max_turns: 每个群组最多保留的对话轮数，为 0 时不归档
+        """
+        self.max_turns = max_turns
+        self.archives: Dict[int, HistoryArchive] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_turns > 0
+
+    def get(self, group_id: int) -> HistoryArchive:
+        """获取群组的归档，不存在时创建"""
+        archive = self.archives.get(group_id)
+        if archive is None:
+            archive = self.archives[group_id] = HistoryArchive(group_id, max_turns=self.max_turns)
+        return archive
+
+    def delete(self, group_id: int) -> bool:
+        """删除群组的归档，返回是否删除了文件"""
+        return self.get(group_id).delete()
+
+# 全局唯一的聊天记录归档
+history_archives = ArchiveStore()
@@ -0,0 +1,207 @@
+"""
+函数调用参数的解析和修复
+模型给出的参数 JSON 偶尔会有格式错误（尾随逗号、单引号、代码块、因 max_tokens 被截断等），
+在本地修复，避免再发起一次请求让模型重新调用；按函数声明检查和转换参数见 validation.py
+"""
+
+import re
+import json
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+# 包裹参数的 markdown 代码块
+CODE_FENCE_PATTERN = re.compile(r"^```[a-zA-Z]*\s*(.*?)\s*(?:```)?$", re.DOTALL)
+# Python 字面量到 JSON 字面量的映射
+PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+class ArgumentError(ValueError):
+    """
+    函数参数无法解析
+    """
+
+def parse_arguments(text: str) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    解析函数参数 JSON，解析失败时尝试修复
+    参数：
+        text: 模型给出的参数字符串
+    返回：
+        (参数字典, 使用的修复方式列表)，参数本身没有错误时修复方式列表为空
+    说明：
+        无法修复或结果不是 JSON 对象时抛出 ArgumentError
+    """
+    repairs: List[str] = []
+    try:
+        value = json.loads(text)
+    except json.JSONDecodeError:
+        value = _repair(text, repairs)
+
+    if value is None:
+        value = {}
+    if not isinstance(value, dict):
+        raise ArgumentError("参数不是 JSON 对象")
+    return value, repairs
+
+def _repair(text: str, repairs: List[str]) -> Any:
+    """依次尝试各种修复方式，返回解析后的值"""
+    text = text.strip()
+    if not text:
+        repairs.append("empty")
+        return {}
+
+    match = CODE_FENCE_PATTERN.match(text)
+    if text.startswith("```") and match:
+        repairs.append("code_fence")
+        text = match.group(1)
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            pass
+
+    normalized = _normalize(text, repairs)
+    try:
+        return json.loads(normalized)
+    except json.JSONDecodeError as e:
+        raise ArgumentError(f"无法修复的参数: {e}") from e
+
+def _normalize(text: str, repairs: List[str]) -> str:
+    """
+    逐字符扫描参数字符串，统一引号、删除尾随逗号、补全未加引号的键和 Python 字面量，
+    最后补全被截断的字符串和括号
+    """
+    found = set()
+    out: List[str] = []
+    stack: List[str] = []
+    i, n = 0, len(text)
+
+    while i < n:
+        ch = text[i]
+        if ch in "\"'":
+            string, i, closed = _read_string(text, i)
+            if ch == "'":
+                found.add("single_quotes")
+            if not closed:
+                found.add("truncated")
+            out.append(string)
+            continue
+
+        if ch in "{[":
+            stack.append(ch)
+            out.append(ch)
+        elif ch in "}]":
+            if _drop_trailing_comma(out):
+                found.add("trailing_comma")
+            if stack:
+                stack.pop()
+            out.append(ch)
+        elif ch.isalpha() or ch == "_":
+            j = i
+            while j < n and (text[j].isalnum() or text[j] == "_"):
+                j += 1
+            word = text[i:j]
+            rest = text[j:].lstrip()
+            if word in PYTHON_LITERALS:
+                found.add("python_literal")
+                out.append(PYTHON_LITERALS[word])
+            elif word not in ("true", "false", "null") and rest.startswith(":"):
+                found.add("unquoted_key")
+                out.append(json.dumps(word))
+            else:
+                out.append(word)
+            i = j
+            continue
+        else:
+            out.append(ch)
+        i += 1
+
+    # 补全被截断的结尾
+    if stack or "truncated" in found:
+        found.add("truncated")
+        while out and out[-1].isspace():
+            out.pop()
+        if out and out[-1] == ",":
+            out.pop()
+        if out and out[-1] == ":":
+            out.append("null")
+        for bracket in reversed(stack):
+            out.append("}" if bracket == "{" else "]")
+
+    repairs.extend(sorted(found))
+    return "".join(out)
+
+def _read_string(text: str, start: int) -> Tuple[str, int, bool]:
+    """
+    读取从 start 开始的字符串（单引号或双引号），返回 (JSON 双引号字符串, 结束位置, 是否有结束引号)
+    """
+    quote = text[start]
+    buf: List[str] = []
+    i, n = start + 1, len(text)
+    while i < n:
+        c = text[i]
+        if c == "\\":
+            if i + 1 >= n:
+                break  # 截断在转义符处，丢弃转义符
+            nxt = text[i + 1]
+            buf.append("'" if quote == "'" and nxt == "'" else c + nxt)
+            i += 2
+            continue
+        if c == quote:
+            return '"' + "".join(buf) + '"', i + 1, True
+        if c == '"':
+            buf.append('\\"')  # 单引号字符串中的双引号
+        elif c == "\n":
+            buf.append("\\n")
+        else:
+            buf.append(c)
+        i += 1
+    return '"' + "".join(buf) + '"', n, False
+
+def _drop_trailing_comma(out: List[str]) -> bool:
+    """删除输出末尾（忽略空白）的逗号，返回是否删除"""
+    j = len(out) - 1
+    while j >= 0 and out[j].isspace():
+        j -= 1
+    if j >= 0 and out[j] == ",":
+        del out[j]
+        return True
+    return False
+
+@dataclass
+class ArgumentCounter:
+    """
+    单个函数的参数解析统计
+    """
+    calls: int = 0     # 解析次数
+    repaired: int = 0  # 修复了格式错误的次数
+    coerced: int = 0   # 转换了参数类型的次数
+    failed: int = 0    # 无法修复的次数
+    invalid: int = 0   # 不符合函数声明（缺少参数、类型或枚举值错误）的次数
+    repairs: Dict[str, int] = field(default_factory=dict)  # 各种修复方式的次数
+
+class ArgumentStats:
+    """
+    参数解析统计，方法：
+        get: 获取函数的参数解析统计
+        report: 生成参数修复统计报告
+    """
+
+    def __init__(self) -> None:
+        self.counters: Dict[str, ArgumentCounter] = {}
+
+    def get(self, name: str) -> ArgumentCounter:
+        if name not in self.counters:
+            self.counters[name] = ArgumentCounter()
+        return self.counters[name]
+
+    def report(self) -> Optional[str]:
+        """
+        生成参数修复统计报告，没有任何修复或失败时返回 None
+        """
+        lines = ["函数参数修复统计："]
+        for name, c in self.counters.items():
+            if not (c.repaired or c.coerced or c.failed or c.invalid):
+                continue
+            repairs = "，".join(f"{kind}{count}次" for kind, count in c.repairs.items())
+            lines.append(f"{name}: 解析{c.calls}次，修复{c.repaired}次（{c.repaired / c.calls:.0%}），"
+                         f"类型转换{c.coerced}次，失败{c.failed}次，参数错误{c.invalid}次" + (f"，{repairs}" if repairs else ""))
+        return "\n".join(lines) if len(lines) > 1 else None
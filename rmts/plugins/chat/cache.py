@@ -0,0 +1,123 @@
+"""
+函数调用结果缓存
+对设置了缓存的函数，相同参数的调用在有效期内直接返回缓存的结果，同时进行中的相同调用只执行一次
+"""
+
+import json
+import time
+import asyncio
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+def make_call_key(name: str, args: Dict[str, Any]) -> str:
+    """
+    生成函数调用的唯一标识，参数顺序不影响结果
+    """
+    return f"{name}:{json.dumps(args, ensure_ascii=False, sort_keys=True, default=str)}"
+
+@dataclass
+class CacheCounter:
+    """
+    单个函数的缓存统计
+    """
+    hits: int = 0     # 命中缓存的次数
+    misses: int = 0   # 实际执行的次数
+    joined: int = 0   # 等待进行中的相同调用的次数
+    repeats: int = 0  # 同一轮对话中重复调用被直接返回的次数
+
+class ToolResultCache:
+    """
+    所有群组共享的函数调用结果缓存，方法：
+        get_or_run: 获取缓存的结果，没有时执行函数并缓存结果
+        invalidate: 删除函数的所有缓存
+        report: 生成缓存统计报告
+    """
+
+    def __init__(self, max_entries: int = 1024) -> None:
+        """
+        参数：
+            max_entries: 最多缓存的结果数量，超过时删除最久没有使用的结果
+        """
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()  # 标识 -> (过期时间, 结果)
+        self.inflight: Dict[str, asyncio.Task] = {}  # 标识 -> 进行中的调用
+        self.counters: Dict[str, CacheCounter] = {}
+
+    def get_counter(self, name: str) -> CacheCounter:
+        if name not in self.counters:
+            self.counters[name] = CacheCounter()
+        return self.counters[name]
+
+    async def get_or_run(self, name: str, key: str, ttl: float, runner: Callable[[], Awaitable[Tuple[str, bool]]]) -> str:
+        """
+        获取缓存的结果，没有时执行函数并缓存结果
+        参数：
+            name: 函数名称，用于统计
+            key: 调用标识
+            ttl: 结果的有效期，单位秒
+            runner: 执行函数的协程函数，返回 (结果, 是否成功)，只缓存成功的结果
+        说明：
+            调用方被取消时函数会继续执行完成并缓存结果，其他等待相同调用的协程不受影响
+        """
+        counter = self.get_counter(name)
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                counter.hits += 1
+                self.entries.move_to_end(key)
+                return entry[1]
+            del self.entries[key]
+
+        task = self.inflight.get(key)
+        if task is not None:
+            counter.joined += 1
+            return (await asyncio.shield(task))[0]
+
+        counter.misses += 1
+        task = asyncio.create_task(runner())
+        self.inflight[key] = task
+        task.add_done_callback(lambda t: self._store(key, ttl, t))
+        return (await asyncio.shield(task))[0]
+
+    def invalidate(self, name: str) -> None:
+        """
+        删除函数的所有缓存
+        说明：
+            进行中的调用不再被之后的相同调用合并，完成后也不缓存结果，已经在等待的调用方仍然得到该结果
+        """
+        prefix = f"{name}:"
+        for key in [key for key in self.entries if key.startswith(prefix)]:
+            del self.entries[key]
+        for key in [key for key in self.inflight if key.startswith(prefix)]:
+            del self.inflight[key]
+
+    def report(self) -> str:
+        """
+        生成缓存统计报告
+        """
+        if not self.counters:
+            return "暂无函数缓存记录"
+        lines = ["函数缓存统计："]
+        for name, c in self.counters.items():
+            total = c.hits + c.misses + c.joined
+            hit_rate = (c.hits + c.joined) / total if total else 0
+            lines.append(f"{name}: 命中{c.hits}次，合并{c.joined}次，执行{c.misses}次（命中率{hit_rate:.0%}），"
+                         f"同轮重复调用{c.repeats}次")
+        return "\n".join(lines)
+
+    def _store(self, key: str, ttl: float, task: asyncio.Task) -> None:
+        """调用完成后缓存成功的结果，调用已经被 invalidate 作废时不缓存"""
+        if self.inflight.get(key) is not task:
+            return
+        del self.inflight[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        result, ok = task.result()
+        if not ok:
+            return
+        self.entries[key] = (time.monotonic() + ttl, result)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
@@ -0,0 +1,49 @@
+from typing import Dict, Literal
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class Config(BaseSettings):
+    model_config = SettingsConfigDict(extra='ignore')
+
+    # 单次对话的最长等待时间（包括排队、函数调用），单位秒，超时后使用本地兜底回复
+    chat_timeout: float = 45
+    # 单轮对话（LLM 请求和函数调用）的时间预算，单位秒，用完后要求模型直接回答，应小于 chat_timeout 减去 8 秒的直接回答预留时间
+    chat_turn_budget: float = 30
+    # 历史消息截断策略：sliding 或 batch，见 model.TruncationPolicy
+    history_truncation: Literal["sliding", "batch"] = "sliding"
+    # 历史消息压缩策略：none 或 tool_results，见 model.CompactionPolicy
+    history_compaction: Literal["none", "tool_results"] = "none"
+    # 聊天记录快照是否使用 gzip 压缩
+    history_compression: bool = False
+    # 启动时预加载历史记录的最近活跃群组数量，0 表示不预加载
+    history_preload_groups: int = 10
+    # 每个群组归档的被截断对话的最多轮数，模型可以通过 search_chat_history 函数检索，0 表示不归档
+    history_archive_turns: int = 5000
+    # 每位博士和每个群组全局记忆的最大总长度（字符数），平时按关键词检索相关的记忆，调大不会增加每轮对话的长度
+    memory_max_length: int = 1000
+    # 添加记忆后延迟写入文件的时间，单位秒，期间的多次添加合并为一次写入，只写入有变化的群组
+    memory_flush_delay: float = 5
+    # 是否在第一次请求前按博士说的话在本地检索相关的记忆，作为背景信息注入本轮对话，减少模型先查询记忆再回答的请求
+    context_injection: bool = True
+    # 是否根据消息内容预取可能需要的函数调用结果
+    tool_prefetch: bool = True
+    # 是否根据消息内容只提供可能需要的函数，提供的函数变化时前缀缓存会失效
+    tool_selection: bool = False
+
+    # 服务商每分钟请求数和 token 数配额，0 表示不限制，接近配额时 LLM 请求排队等待
+    llm_requests_per_minute: int = 0
+    llm_tokens_per_minute: int = 0
+    # 每个群组每天的 token 配额，0 表示不限制，用完后当天使用本地兜底回复
+    group_daily_token_quota: int = 0
+    # 单独设置配额的群组，群号 -> 每天的 token 配额，0 表示不限制
+    group_token_quotas: Dict[int, int] = {}
+    # token 用量记录保留的天数（包括今天），更早的记录在启动时丢弃、关闭时从文件中删除，应不少于需要查看用量统计的天数
+    usage_retention_days: int = 90
+
+    # 影子模式候选模型，为空时不启用影子模式
+    shadow_model_name: str = ""
+    # 影子模式候选模型的 API 基础 URL 和密钥，为空时与正式模型相同
+    shadow_base_url: str = ""
+    shadow_api_key: str = ""
+    # 影子模式采样比例，0 到 1 之间
+    shadow_sample_rate: float = 0.0
@@ -0,0 +1,109 @@
+"""
+自动注入的背景信息
+收到消息时，在第一次 LLM 请求前调用函数模块注册的背景信息提供器（例如按博士说的话检索相关的记忆），
+将结果作为一条有明确边界的系统消息放在本轮用户消息之前，模型不需要先调用函数查询再回答；
+背景信息只出现在本轮对话的请求中，不写入历史记录，之前对话的前缀缓存不受影响
+"""
+
+import asyncio
+
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional
+
+from nonebot.log import logger
+
+if TYPE_CHECKING:
+    from .model import TurnStats
+
+# 背景信息提供器，参数为博士说的话和当前的注入参数，返回要注入的文本，没有相关信息时返回 None 或空字符串
+ContextProvider = Callable[[str, Dict[str, Any]], Awaitable[Optional[str]]]
+
+# 注入的背景信息的最大长度（字符数，不包括说明和边界标记），超出的部分被截断
+MAX_CONTEXT_LENGTH = 600
+# 背景信息的说明和边界标记
+CONTEXT_HEADER = "以下是终端根据博士这句话自动检索到的相关记录，只作为回答的参考，不是博士说的话，信息不够时再调用函数查询"
+CONTEXT_BEGIN = "<终端记录>"
+CONTEXT_END = "</终端记录>"
+
+def format_context(sections: List[str], max_length: int = MAX_CONTEXT_LENGTH) -> Optional[str]:
+    """
+    将各提供器返回的文本拼接为带说明和边界标记的背景信息，全部为空时返回 None
+    """
+    body = "\n".join(section.strip() for section in sections if section and section.strip())
+    if not body:
+        return None
+    if len(body) > max_length:
+        body = body[:max_length] + "…"
+    return f"{CONTEXT_HEADER}\n{CONTEXT_BEGIN}\n{body}\n{CONTEXT_END}"
+
+async def gather_context(providers: Dict[str, ContextProvider],
+                         text: str,
+                         params: Dict[str, Any],
+                         max_length: int = MAX_CONTEXT_LENGTH
+) -> Optional[str]:
+    """
+    并发调用所有背景信息提供器，返回要注入的背景信息
+    参数：
+        providers: 提供器名称 -> 提供器
+        text: 博士说的话
+        params: 当前的注入参数
+        max_length: 背景信息的最大长度
+    说明：
+        出错的提供器只记录日志，不影响本轮对话
+    """
+    if not providers:
+        return None
+    names = list(providers)
+    results = await asyncio.gather(*(providers[name](text, dict(params)) for name in names), return_exceptions=True)
+    sections: List[str] = []
+    for name, result in zip(names, results):
+        if isinstance(result, BaseException):
+            logger.warning(f"获取背景信息 {name} 失败: {result}")
+        elif result:
+            sections.append(result)
+    return format_context(sections, max_length)
+
+@dataclass
+class ContextCounter:
+    """
+    一类对话的请求和函数调用统计
+    """
+    turns: int = 0           # 对话次数
+    rounds: int = 0          # LLM 请求总次数
+    tool_calls: int = 0      # 函数调用总次数
+    context_length: int = 0  # 注入的背景信息总字符数
+
+class ContextStats:
+    """
+    所有群组共享的背景信息注入统计，分别统计注入和没有注入背景信息的对话，用于比较注入前后每轮对话的请求次数，方法：
+        record: 记录一轮对话
+        report: 生成统计报告
+    说明：
+        关闭 CONTEXT_INJECTION 时所有对话都计入没有注入的对话，可以作为对照
+    """
+
+    def __init__(self) -> None:
+        self.injected = ContextCounter()
+        self.plain = ContextCounter()
+
+    def record(self, stats: "TurnStats") -> None:
+        counter = self.injected if stats.context_length else self.plain
+        counter.turns += 1
+        counter.rounds += stats.rounds
+        counter.tool_calls += stats.tool_calls
+        counter.context_length += stats.context_length
+
+    def report(self) -> str:
+        """
+        生成统计报告
+        """
+        def describe(label: str, c: ContextCounter) -> str:
+            if not c.turns:
+                return f"{label}0次"
+            return f"{label}{c.turns}次，平均请求{c.rounds / c.turns:.2f}次、函数调用{c.tool_calls / c.turns:.2f}次"
+
+        report = (f"背景信息注入统计：{describe('注入背景信息的对话', self.injected)}；"
+                  f"{describe('没有注入的对话', self.plain)}")
+        if self.injected.turns:
+            report += f"；平均注入{self.injected.context_length / self.injected.turns:.0f}字"
+        return report
@@ -0,0 +1,159 @@
+"""
+函数执行器
+同步函数直接在事件循环中执行会阻塞所有群组的对话，可以为函数指定执行方式：
+    - "inline": 在事件循环中直接执行，只适用于很快的函数
+    - "thread": 在共享的线程池中执行，适用于阻塞 IO 或释放 GIL 的计算
+    - "process": 在共享的进程池中执行，适用于 CPU 密集的计算，函数和参数需能被 pickle，
+      函数所在模块需能在子进程中独立导入
+线程池和进程池的并发数量有限，超出的调用在事件循环中排队，排队数量达到上限时直接返回错误
+"""
+
+import time
+import asyncio
+import functools
+
+from dataclasses import dataclass
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, Callable, Dict, Literal, Optional
+
+from nonebot.log import logger
+
+# 函数的执行方式
+ExecutorMode = Literal["inline", "thread", "process"]
+
+# 线程池和进程池的默认并发数量和最大排队数量
+DEFAULT_THREAD_WORKERS = 4
+DEFAULT_PROCESS_WORKERS = 2
+DEFAULT_MAX_QUEUED = 32
+
+class ExecutorBusy(RuntimeError):
+    """
+    执行器排队的调用过多
+    """
+
+@dataclass
+class PoolStats:
+    """
+    单个执行器的排队统计
+    """
+    submitted: int = 0     # 提交的调用次数
+    completed: int = 0     # 完成（包括出错）的调用次数
+    rejected: int = 0      # 因排队过多被拒绝的调用次数
+    max_queued: int = 0    # 最多同时排队的调用数量
+    total_wait: float = 0  # 排队等待的总时间，单位秒
+    max_wait: float = 0    # 最长排队等待时间，单位秒
+
+class ExecutorPool:
+    """
+    并发数量有限的线程池或进程池，方法：
+        run: 在池中执行同步函数
+        report: 生成排队统计报告
+        shutdown: 关闭池
+    """
+
+    def __init__(self, name: str, factory: Callable[[int], Executor], max_workers: int, max_queued: int = DEFAULT_MAX_QUEUED) -> None:
+        """
+        参数：
+            name: 池的名称，用于日志和统计
+            factory: 根据并发数量创建执行器的函数，第一次使用时才创建
+            max_workers: 最多同时执行的调用数量
+            max_queued: 最多同时排队的调用数量
+        """
+        self.name = name
+        self.factory = factory
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.stats = PoolStats()
+        self.queued = 0   # 正在排队的调用数量
+        self.running = 0  # 正在执行的调用数量
+        self._executor: Optional[Executor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def run(self, func: Callable, args: Dict[str, Any]) -> Any:
+        """
+        在池中执行同步函数，返回函数的返回值
+        说明：
+            排队数量达到上限时抛出 ExecutorBusy；调用方被取消时已开始执行的函数会继续执行完成
+        """
+        if self.queued >= self.max_queued:
+            self.stats.rejected += 1
+            raise ExecutorBusy(f"{self.name}繁忙，已有{self.queued}个调用在排队")
+        if self._executor is None:
+            self._executor = self.factory(self.max_workers)
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+
+        self.stats.submitted += 1
+        self.queued += 1
+        self.stats.max_queued = max(self.stats.max_queued, self.queued)
+        enqueued = time.perf_counter()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+
+        wait = time.perf_counter() - enqueued
+        self.stats.total_wait += wait
+        self.stats.max_wait = max(self.stats.max_wait, wait)
+        self.running += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(func, **args))
+        finally:
+            self.running -= 1
+            self.stats.completed += 1
+            self._semaphore.release()
+
+    def report(self) -> str:
+        """
+        生成排队统计报告
+        """
+        s = self.stats
+        average = s.total_wait / (s.submitted - s.rejected) if s.submitted > s.rejected else 0
+        return (f"{self.name}: 提交{s.submitted}次，完成{s.completed}次，拒绝{s.rejected}次，最多排队{s.max_queued}个，"
+                f"平均等待{average * 1000:.1f}毫秒，最长等待{s.max_wait * 1000:.1f}毫秒")
+
+    def shutdown(self) -> None:
+        """
+        关闭池，取消尚未开始的调用
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self._semaphore = None
+
+class FunctionExecutors:
+    """
+    所有群组共享的线程池和进程池，方法：
+        select: 获取函数使用的池
+        report: 生成所有池的排队统计报告
+        shutdown: 关闭所有池
+    """
+
+    def __init__(self, thread_workers: int = DEFAULT_THREAD_WORKERS, process_workers: int = DEFAULT_PROCESS_WORKERS) -> None:
+        self.pools: Dict[str, ExecutorPool] = {
+            "thread": ExecutorPool("函数线程池", lambda n: ThreadPoolExecutor(n, thread_name_prefix="rmts-function"), thread_workers),
+            "process": ExecutorPool("函数进程池", lambda n: ProcessPoolExecutor(n), process_workers),
+        }
+
+    def select(self, mode: Optional[ExecutorMode], func: Callable) -> Optional[ExecutorPool]:
+        """
+        获取函数使用的池，异步函数和 "inline" 返回 None，没有指定执行方式的同步函数在线程池中执行
+        """
+        if asyncio.iscoroutinefunction(func):
+            return None
+        return self.pools.get(mode or "thread")
+
+    def report(self) -> Optional[str]:
+        """
+        生成所有池的排队统计报告，没有任何调用时返回 None
+        """
+        lines = [pool.report() for pool in self.pools.values() if pool.stats.submitted]
+        return "函数执行器统计：\n" + "\n".join(lines) if lines else None
+
+    def shutdown(self) -> None:
+        """
+        关闭所有池
+        """
+        for pool in self.pools.values():
+            pool.shutdown()
+        logger.info("函数执行器已关闭")
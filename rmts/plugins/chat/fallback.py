@@ -0,0 +1,85 @@
+"""
+本地兜底回复
+在 LLM 调用失败、超时或被限流时，从本地语料中按意图和关键词选择符合角色设定的回复
+"""
+
+import os
+import random
+
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+from nonebot.log import logger
+
+from rmts.utils.codec import loads
+
+from .message import extract_user_text, has_user_text, has_user_image
+
+class FallbackResponder:
+    """
+    本地兜底回复器，方法：
+        classify: 识别用户消息的意图
+        respond: 生成兜底回复
+    说明：
+        语料文件格式为 {"intents": {意图: {"keywords": [...], "responses": [...]}}, "default": [...]}
+        回复完全在本地生成，不进行任何 IO，保证在限定时间内返回
+    """
+
+    def __init__(self, path: str = "rmts/resources/json/fallback/fallback.json") -> None:
+        """
+        参数：
+            path: 兜底语料文件的路径，相对于 cwd
+        """
+
+        self.path = Path(os.getcwd()) / path
+        self.responses: Dict[str, List[str]] = {}  # 意图 -> 回复列表
+        self.keywords: List[Tuple[str, str]] = []  # (关键词, 意图)，按关键词长度降序排列
+        self.default_responses: List[str] = ["唔……博士，迷迭香刚刚有点走神了……能再说一遍吗？"]
+        self.load_corpus()
+
+    def load_corpus(self) -> None:
+        """
+        加载语料并建立关键词索引，初始化时自动调用
+        """
+
+        try:
+            with open(self.path, "rb") as f:
+                data = loads(f.read())
+        except Exception as e:
+            logger.error(f"加载兜底语料 {self.path} 失败，仅使用默认回复: {e}")
+            return
+
+        for intent, info in data.get("intents", {}).items():
+            self.responses[intent] = info.get("responses", [])
+            for keyword in info.get("keywords", []):
+                self.keywords.append((keyword, intent))
+        # 优先匹配更长的关键词，避免“迷迭香”之类的短词抢先命中
+        self.keywords.sort(key=lambda item: len(item[0]), reverse=True)
+
+        if data.get("default"):
+            self.default_responses = data["default"]
+
+    def classify(self, user_message: str) -> str:
+        """
+        识别用户消息的意图，无法识别时返回 "default"
+        """
+
+        text = extract_user_text(user_message)
+        for keyword, intent in self.keywords:
+            if keyword in text and self.responses.get(intent):
+                # 戳一戳等事件消息的关键词只在事件消息中生效
+                if intent == "poke" and has_user_text(user_message):
+                    continue
+                return intent
+
+        if has_user_image(user_message) and self.responses.get("image"):
+            return "image"
+        return "default"
+
+    def respond(self, user_message: str) -> str:
+        """
+        生成兜底回复
+        """
+
+        intent = self.classify(user_message)
+        return random.choice(self.responses.get(intent) or self.default_responses)
@@ -1,16 +1,101 @@
 import os
+import sys
 import json
+import time
 import asyncio
 
 from pathlib import Path
+from dataclasses import dataclass, field
 from importlib import import_module
-from typing import Dict, Callable, List
-from typing import Literal, TypeVar, Union, Coroutine, Any
+from typing import Dict, Callable, List, Optional, Sequence, Set, Tuple, TYPE_CHECKING
+from typing import Literal, NamedTuple, TypeVar, Union, Coroutine, Any
 
 from nonebot.log import logger
 
+from .cache import ToolResultCache, make_call_key
+from .arguments import ArgumentError, ArgumentStats, parse_arguments
+from .validation import ArgumentValidator, ValidationError
+from .selector import REQUEST_MORE_FUNCTIONS
+from .executor import ExecutorMode, ExecutorPool, FunctionExecutors
+from .context import MAX_CONTEXT_LENGTH, ContextProvider, gather_context
+from .message import extract_user_text, has_user_text
+
+if TYPE_CHECKING:
+    from .prefetch import ToolPrefetcher
+    from .selector import ToolSelector
+
 # 函数类型变量，返回值为 str 或 协程，协程返回 str
 F = TypeVar('F', bound=Callable[..., Union[str, Coroutine[Any, Any, str]]])
+# 预取匹配器，参数为博士说的话和当前的注入参数，返回可能需要预取的函数参数列表
+PrefetchMatcher = Callable[[str, Dict[str, Any]], List[Dict[str, Any]]]
+# 函数选择匹配器，参数为博士说的话，返回本轮是否需要提供该函数
+SelectionMatcher = Callable[[str], bool]
+# 没有设置超时时间的函数使用的默认超时时间，单位秒
+DEFAULT_FUNCTION_TIMEOUT = 15.0
+
+# 结果缓存的共享范围
+CacheScope = Literal["global", "group", "user"]
+# 组合函数步骤的参数，可以是固定的参数字典，或根据组合函数的参数和之前步骤的结果生成参数的函数
+StepArgs = Union[Dict[str, Any], Callable[[Dict[str, Any], Dict[str, str]], Dict[str, Any]]]
+# 组合函数的输出格式化函数，参数为组合函数的参数和所有步骤的结果
+PipelineOutput = Callable[[Dict[str, Any], Dict[str, str]], str]
+
+async def call_function(func: Callable, args: dict, executor: Optional[ExecutorPool] = None) -> Any:
+    """
+    调用同步或异步函数，返回函数的返回值，指定了执行器时同步函数在执行器中执行
+    """
+    # 检测是否为协程函数
+    if asyncio.iscoroutinefunction(func):
+        return await func(**args)
+    if executor is not None:
+        return await executor.run(func, args)
+    return func(**args)
+
+class FunctionError(Exception):
+    """
+    函数预期内的失败（例如外部接口出错），异常信息会作为函数结果返回给模型，结果不会被缓存
+    """
+
+class FunctionResult(NamedTuple):
+    """
+    函数的执行结果
+    """
+    text: str  # 返回给模型的结果
+    ok: bool   # 是否执行成功，只有成功的结果会被缓存
+
+async def run_function(name: str, func: Callable, args: dict, executor: Optional[ExecutorPool] = None) -> FunctionResult:
+    """
+    执行函数并将返回值转换为字符串，函数出错时返回错误信息而不是抛出异常
+    参数：
+        name: 函数名称
+        func: 函数本身
+        args: 函数参数，需已包含注入参数
+        executor: 同步函数使用的执行器，为 None 时在事件循环中直接执行
+    说明：
+        函数抛出 FunctionError 或其他异常、没有返回值时结果标记为失败
+    """
+    logger.info(f"调用函数 {name}，参数: {args}")
+
+    try:
+        retv = await call_function(func, args, executor)
+
+        # 没有返回值
+        if retv is None:
+            logger.warning(f"函数 {name} ，参数 {args} 没有返回值，已自动转换为字符串提示")
+            return FunctionResult("该 function calling 函数没有返回值", False)
+        
+        # 返回值不是字符串
+        if not isinstance(retv, str):
+            logger.warning(f"函数 {name} ，参数 {args} 返回值不是字符串，已自动转换为字符串")
+            return FunctionResult(str(retv), True)
+        
+        return FunctionResult(retv, True)
+    except FunctionError as e:
+        logger.warning(f"函数 {name} 执行失败，参数: {args}，原因: {e}")
+        return FunctionResult(str(e), False)
+    except Exception as e:
+        logger.exception(f"函数 {name} 调用出错，参数: {args}")
+        return FunctionResult(f"函数调用出错: {e}", False)
 
 class FunctionDescription:
     """
@@ -18,6 +103,11 @@ class FunctionDescription:
     add_str_param 方法用于添加字符串参数
     add_enum_param 方法用于添加枚举参数
     add_injection_param 方法用于添加注入参数
+    mark_side_effect 方法用于标记函数会产生副作用
+    mark_paid 方法用于标记函数会调用计费的外部接口
+    set_prefetch 方法用于设置预取匹配器
+    set_cache 方法用于设置结果缓存
+    set_timeout 方法用于设置超时时间
     to_schema 方法用于将函数描述转换为 function calling 所需的格式
     """
 
@@ -35,6 +125,18 @@ class FunctionDescription:
         self.str_parameters = {}
         self.enum_parameters = {}
         self.injection_parameters = {}
+        self.side_effect = False  # 是否会产生副作用（发送消息、修改记忆等）
+        self.paid = False  # 是否会调用计费的外部接口（图片识别等）
+        self.prefetch_matcher: Optional[PrefetchMatcher] = None  # 预取匹配器
+        self.cache_ttl: Optional[float] = None  # 结果缓存的有效期，为 None 时不缓存
+        self.cache_scope: CacheScope = "global"  # 结果缓存的共享范围
+        self.timeout = DEFAULT_FUNCTION_TIMEOUT  # 超时时间，单位秒
+        self.selectable = False  # 是否只在符合选择条件时提供给模型，为 False 时总是提供
+        self.select_keywords: Tuple[str, ...] = ()
+        self.select_matcher: Optional[SelectionMatcher] = None
+        self.select_image = False
+        self._validator: Optional[ArgumentValidator] = None  # 编译后的参数校验器，参数变化时重新编译
+        self.executor: Optional[ExecutorMode] = None  # 同步函数的执行方式，为 None 时在线程池中执行
 
     def add_param(self, name: str, description: str, param_type: Literal["string", "number", "integer", "boolean"] = "string", required: bool = False) -> "FunctionDescription":
         """
@@ -56,14 +158,15 @@ class FunctionDescription:
             "description": description,
             "required": required
         }
+        self._validator = None
         return self
     
-    def add_enum_param(self, name: str, description: str, enum_values: List[str], enum_type: Literal["string", "number", "integer", "boolean"] = "string", required: bool = False) -> "FunctionDescription":
+    def add_enum_param(self, name: str, description: str, enum_values: Union[List[str], Callable[[], List[str]]], enum_type: Literal["string", "number", "integer", "boolean"] = "string", required: bool = False) -> "FunctionDescription":
         """
         添加枚举参数，参数：
             name: 参数名称
             description: 参数描述
-            enum_values: 枚举值列表
+            enum_values: 枚举值列表，或返回枚举值列表的函数，后者在第一次生成描述或校验参数时才调用（例如需要扫描目录的枚举值）
             enum_type: 枚举类型，默认为 "string"，可选 "number"、"integer"、"boolean"
             required: 是否必需
         """
@@ -73,6 +176,7 @@ class FunctionDescription:
             "enum": enum_values,
             "required": required
         }
+        self._validator = None
         return self
     
     def add_list_param(self, name: str, description: str, item_type: Literal["string", "number", "integer", "boolean"] = "string", required: bool = False) -> "FunctionDescription":
@@ -91,6 +195,7 @@ class FunctionDescription:
             "description": description,
             "required": required
         }
+        self._validator = None
         return self
     
     def add_dict_param(self, name: str, description: str, value_type: Literal["string", "number", "integer", "boolean"] = "string", required: bool = False) -> "FunctionDescription":
@@ -109,9 +214,10 @@ class FunctionDescription:
             "description": description,
             "required": required
         }
+        self._validator = None
         return self
     
-    def add_injection_param(self, name: Literal["group_id", "user_id"], description: str = "") -> "FunctionDescription":
+    def add_injection_param(self, name: Literal["group_id", "user_id", "read_only"], description: str = "") -> "FunctionDescription":
         """
         添加注入参数，参数：
             name: 参数名称
@@ -125,14 +231,140 @@ class FunctionDescription:
         可用的注入参数名称包括：
             - group_id: 当前上下文所在群组 ID
             - user_id: 触发本次事件用户的 ID
+            - read_only: 是否为只读调用（影子模式等非正式调用），为 True 时函数不应改变任何状态，例如读取记忆时不记录读取
         """
         if description == "":
             description = f"注入参数: {name}"
         self.injection_parameters[name] = {
             "description": description
         }
+        self._validator = None
+        return self
+
+    def mark_side_effect(self) -> "FunctionDescription":
+        """
+        标记函数会产生副作用，例如发送消息、禁言、修改记忆等
+        返回值：
+            返回函数描述对象本身，支持链式调用
+        说明：
+            有副作用的函数不会在影子模式等非正式调用中真正执行
+        """
+        if self.prefetch_matcher is not None or self.cache_ttl is not None:
+            raise ValueError(f"函数 {self.name} 设置了预取或缓存，不能标记为有副作用")
+        self.side_effect = True
+        return self
+
+    def mark_paid(self) -> "FunctionDescription":
+        """
+        标记函数会调用计费的外部接口，例如图片识别
+        返回值：
+            返回函数描述对象本身，支持链式调用
+        说明：
+            计费的函数不会在影子模式等非正式调用中真正执行，避免产生费用和计入群组的用量
+        """
+        self.paid = True
+        return self
+
+    def set_prefetch(self, matcher: PrefetchMatcher) -> "FunctionDescription":
+        """
+        设置预取匹配器，收到消息时用它判断是否需要提前执行该函数，参数：
+            matcher: 预取匹配器，参数为博士说的话和当前的注入参数（group_id、user_id），
+                返回可能需要预取的函数参数列表（不包括注入参数），不需要预取时返回空列表
+        返回值：
+            返回函数描述对象本身，支持链式调用
+        说明：
+            预取的函数与第一次 LLM 请求并行执行，模型以相同的参数调用该函数时直接使用预取的结果
+            匹配器应只使用本地信息且执行很快，有副作用的函数不能预取
+        """
+        if self.side_effect:
+            raise ValueError(f"函数 {self.name} 有副作用，不能预取")
+        self.prefetch_matcher = matcher
+        return self
+
+    def set_cache(self, ttl: float, scope: "CacheScope" = "global") -> "FunctionDescription":
+        """
+        设置结果缓存，参数：
+            ttl: 结果的有效期，单位秒
+            scope: 缓存的共享范围
+                - "global": 所有群组共享
+                - "group": 同一群组共享
+                - "user": 同一用户共享
+        返回值：
+            返回函数描述对象本身，支持链式调用
+        说明：
+            缓存的标识由函数名称和模型提供的参数（不包括注入参数）生成，出错或抛出 FunctionError 的结果不会被缓存
+            有副作用的函数不能缓存
+        """
+        if self.side_effect:
+            raise ValueError(f"函数 {self.name} 有副作用，不能缓存")
+        self.cache_ttl = ttl
+        self.cache_scope = scope
+        return self
+
+    def set_timeout(self, timeout: float) -> "FunctionDescription":
+        """
+        设置超时时间，参数：
+            timeout: 超时时间，单位秒，未设置时为 DEFAULT_FUNCTION_TIMEOUT
+        返回值：
+            返回函数描述对象本身，支持链式调用
+        说明：
+            函数超时后会被取消，模型收到超时结果（设置了缓存的函数会在后台继续执行并缓存结果）
+        """
+        self.timeout = timeout
+        return self
+
+    def set_executor(self, mode: ExecutorMode) -> "FunctionDescription":
+        """
+        设置同步函数的执行方式，参数：
+            mode: 执行方式
+                - "inline": 在事件循环中直接执行，只适用于很快的函数
+                - "thread": 在共享的线程池中执行（同步函数的默认方式）
+                - "process": 在共享的进程池中执行，适用于 CPU 密集的计算，函数和参数需能被 pickle
+        返回值：
+            返回函数描述对象本身，支持链式调用
+        说明：
+            异步函数总是在事件循环中执行，不能设置为 "thread" 或 "process"
+        """
+        self.executor = mode
+        return self
+
+    def set_selection(self, keywords: Sequence[str] = (), matcher: Optional[SelectionMatcher] = None, image: bool = False) -> "FunctionDescription":
+        """
+        设置函数的选择条件，开启函数选择时只在符合条件的对话中提供该函数，参数：
+            keywords: 博士说的话中包含任意一个关键词时提供
+            matcher: 选择匹配器，参数为博士说的话，返回 True 时提供
+            image: 消息中附带图片时提供
+        返回值：
+            返回函数描述对象本身，支持链式调用
+        说明：
+            没有设置选择条件的函数总是提供；群内最近调用过的函数也会继续提供
+        """
+        self.selectable = True
+        self.select_keywords = tuple(keywords)
+        self.select_matcher = matcher
+        self.select_image = image
         return self
 
+    def get_enum_values(self, name: str) -> list:
+        """
+        获取枚举参数的枚举值，延迟计算的枚举值在第一次获取时计算并保存
+        """
+        info = self.enum_parameters[name]
+        if callable(info["enum"]):
+            info["enum"] = list(info["enum"]())
+        return info["enum"]
+
+    @property
+    def validator(self) -> ArgumentValidator:
+        """
+        参数校验器，第一次使用时由当前的参数声明编译
+        """
+        if self._validator is None:
+            for name in self.enum_parameters:
+                self.get_enum_values(name)
+            self._validator = ArgumentValidator(self)
+        return self._validator
+
     def to_schema(self) -> dict:
         """
         将当前函数描述转换为 function calling 所需的格式
@@ -164,7 +396,7 @@ class FunctionDescription:
             props[name] = {
                 "type": info["type"],
                 "description": info["description"],
-                "enum": info["enum"]
+                "enum": self.get_enum_values(name)
             }
             if info.get("required"):
                 required_list.append(name)
@@ -189,9 +421,146 @@ class FunctionDescription:
         return schema
 
 
+@dataclass
+class PipelineStep:
+    """
+    组合函数中的一个步骤
+    """
+    name: str                                          # 步骤名称，用于引用该步骤的结果
+    function: str                                      # 调用的已注册函数名称
+    args: StepArgs = field(default_factory=dict)       # 步骤参数，不包括注入参数
+    depends: List[str] = field(default_factory=list)   # 依赖的步骤名称
+
+class FunctionPipeline:
+    """
+    组合函数，由多个已注册的函数组成依赖图，一次函数调用在本地执行所有步骤并返回合并的结果
+    add_step 方法用于添加步骤
+    set_output 方法用于设置输出格式
+    levels 方法用于将步骤按依赖关系分层
+    run 方法用于执行组合函数
+    """
+
+    def __init__(self, function_description: FunctionDescription):
+        """
+        参数：
+            function_description: 组合函数的描述，只需添加模型需要提供的参数，注入参数和副作用标记在注册时根据步骤自动添加
+        说明：
+            没有依赖关系的步骤会并发执行，可以将原本需要模型多次请求才能完成的函数调用合并为一次
+        """
+
+        self.function_description = function_description
+        self.steps: Dict[str, PipelineStep] = {}
+        self.output: Optional[PipelineOutput] = None
+
+    def add_step(self, name: str, function: str, args: Optional[StepArgs] = None, depends: Sequence[str] = ()) -> "FunctionPipeline":
+        """
+        添加步骤，参数：
+            name: 步骤名称
+            function: 调用的已注册函数名称
+            args: 步骤参数，可以是固定的参数字典，或参数为 (组合函数的参数, 之前步骤的结果) 并返回参数字典的函数
+            depends: 依赖的步骤名称，这些步骤完成后才会执行该步骤
+        返回值：
+            返回组合函数对象本身，支持链式调用
+        """
+        if name in self.steps:
+            raise ValueError(f"组合函数 {self.function_description.name} 中已有名为 {name} 的步骤")
+        self.steps[name] = PipelineStep(name=name, function=function, args=args or {}, depends=list(depends))
+        return self
+
+    def set_output(self, output: PipelineOutput) -> "FunctionPipeline":
+        """
+        设置输出格式，参数：
+            output: 参数为 (组合函数的参数, 所有步骤的结果) 并返回字符串的函数，不设置时按添加顺序拼接所有步骤的结果
+        返回值：
+            返回组合函数对象本身，支持链式调用
+        """
+        self.output = output
+        return self
+
+    def levels(self) -> List[List[PipelineStep]]:
+        """
+        将步骤按依赖关系分层，同一层的步骤互不依赖，可以并发执行
+        """
+        done: set = set()
+        levels: List[List[PipelineStep]] = []
+        pending = list(self.steps.values())
+        for step in pending:
+            for dep in step.depends:
+                if dep not in self.steps:
+                    raise ValueError(f"组合函数 {self.function_description.name} 的步骤 {step.name} 依赖不存在的步骤 {dep}")
+        while pending:
+            ready = [step for step in pending if all(dep in done for dep in step.depends)]
+            if not ready:
+                raise ValueError(f"组合函数 {self.function_description.name} 的步骤存在循环依赖")
+            levels.append(ready)
+            done.update(step.name for step in ready)
+            pending = [step for step in pending if step.name not in done]
+        return levels
+
+    async def run(self,
+                  functions: Dict[str, Callable],
+                  function_descriptions: Dict[str, FunctionDescription],
+                  params: Dict[str, Any],
+                  executors: Optional[FunctionExecutors] = None
+    ) -> str:
+        """
+        执行组合函数，参数：
+            functions: 已注册的函数
+            function_descriptions: 已注册的函数描述
+            params: 组合函数的参数，包括注入参数
+            executors: 同步函数使用的执行器，为 None 时所有步骤在事件循环中直接执行
+        说明：
+            有步骤失败时仍然生成输出，但以 FunctionError 抛出，整个组合函数的结果标记为失败
+        """
+        start_time = time.perf_counter()
+        results: Dict[str, str] = {}
+        ok = True
+        for level in self.levels():
+            outputs = await asyncio.gather(*(self._run_step(step, functions, function_descriptions, params, results, executors)
+                                             for step in level))
+            results.update(zip((step.name for step in level), (output.text for output in outputs)))
+            ok = ok and all(output.ok for output in outputs)
+
+        logger.debug(f"组合函数 {self.function_description.name} 执行完成，"
+                     f"共{len(self.steps)}个步骤，耗时{time.perf_counter() - start_time:.3f}秒")
+        if self.output is not None:
+            output = self.output(params, results)
+        else:
+            output = "\n".join(results[name] for name in self.steps)
+        if not ok:
+            raise FunctionError(output)
+        return output
+
+    async def _run_step(self,
+                        step: PipelineStep,
+                        functions: Dict[str, Callable],
+                        function_descriptions: Dict[str, FunctionDescription],
+                        params: Dict[str, Any],
+                        results: Dict[str, str],
+                        executors: Optional[FunctionExecutors]
+    ) -> FunctionResult:
+        """执行单个步骤"""
+        try:
+            args = dict(step.args(params, results) if callable(step.args) else step.args)
+        except Exception as e:
+            logger.exception(f"组合函数 {self.function_description.name} 的步骤 {step.name} 生成参数出错")
+            return FunctionResult(f"函数调用出错: {e}", False)
+        # 步骤所需的注入参数来自组合函数的注入参数
+        fd = function_descriptions[step.function]
+        for inj_name in fd.injection_parameters:
+            args[inj_name] = params[inj_name]
+        func = functions[step.function]
+        executor = executors.select(fd.executor, func) if executors is not None else None
+        return await run_function(step.function, func, args, executor)
+
 class FunctionContainer:
     """
     全局唯一的函数调用管理容器，用于注册和存储所有可用的函数
+    function_calling 方法用于注册函数
+    declare_function 方法用于声明延迟加载的函数
+    function_pipeline 方法用于注册组合函数
+    context_provider 方法用于注册自动注入的背景信息提供器
+    reload 方法用于在运行时重载函数模块
     """
 
     def __init__(self, path: str = "functions"):
@@ -206,6 +575,15 @@ class FunctionContainer:
         self.excluded_paths = ["__pycache__"]
         self.functions: Dict[str, Callable] = {}
         self.function_descriptions: Dict[str, FunctionDescription] = {}
+        self.modules: Dict[str, str] = {}  # 延迟加载的函数名称 -> 实现模块
+        self.packages: Dict[str, str] = {}  # 函数名称 -> 所属的函数模块（functions 下的目录名）
+        self.package_mtimes: Dict[str, float] = {}  # 函数模块 -> 加载时源文件的最后修改时间
+        self._loading: Optional[str] = None  # 正在加载的函数模块
+        # 重载时新注册的函数，函数名称 -> (函数, 函数描述, 实现模块)，全部导入成功后一次性替换
+        self._staging: Optional[Dict[str, Tuple[Callable, FunctionDescription, Optional[str]]]] = None
+        self.result_cache = ToolResultCache()  # 所有群组共享的函数调用结果缓存
+        self.executors = FunctionExecutors()  # 所有群组共享的线程池和进程池
+        self.context_providers: Dict[str, ContextProvider] = {}  # 提供器名称 -> 背景信息提供器
 
         current_dir = os.path.dirname(os.path.abspath(__file__))
         self.fullpath = os.path.join(current_dir, Path(self.path))
@@ -218,32 +596,249 @@ class FunctionContainer:
         """
 
         def decorator(func: F) -> F:
-            self.functions[function_description.name] = func
-            self.function_descriptions[function_description.name] = function_description
+            if asyncio.iscoroutinefunction(func) and function_description.executor in ("thread", "process"):
+                raise ValueError(f"函数 {function_description.name} 是异步函数，不能在{function_description.executor}执行器中执行")
+            self._register(function_description, func)
             return func
 
         return decorator
+
+    def declare_function(self, function_description: FunctionDescription, module: str) -> FunctionDescription:
+        """
+        声明延迟加载的函数，只注册函数描述，实现模块在第一次调用该函数时才导入
+        参数：
+            function_description: 函数描述
+            module: 实现模块的完整名称，模块中需使用 function_calling 以同一个函数描述注册函数
+        返回值：
+            返回函数描述对象本身
+        """
+        self._register(function_description, self._lazy_function(function_description.name), module)
+        return function_description
+
+    def _register(self, function_description: FunctionDescription, func: Callable, module: Optional[str] = None) -> None:
+        """注册函数，重载时先放入待替换的函数中"""
+        name = function_description.name
+        if self._staging is not None:
+            self._staging[name] = (func, function_description, module)
+            return
+        self.functions[name] = func
+        self.function_descriptions[name] = function_description
+        if module is not None:
+            self.modules[name] = module
+        if self._loading is not None:
+            self.packages[name] = self._loading
+
+    def load_module(self, name: str) -> Callable:
+        """
+        导入延迟加载的函数的实现模块，返回注册的函数
+        """
+        module = self.modules[name]
+        if module not in sys.modules:
+            start = time.perf_counter()
+            import_module(module)
+            logger.info(f"函数实现模块 {module} 加载完成，耗时{(time.perf_counter() - start) * 1000:.0f}毫秒")
+        return self.functions[name]
+
+    def _lazy_function(self, name: str) -> Callable[..., Coroutine[Any, Any, Any]]:
+        """生成延迟加载的函数，第一次调用时导入实现模块并替换为注册的函数"""
+
+        async def load_and_call(**args: Any) -> Any:
+            start = time.perf_counter()
+            func = self.load_module(name)
+            if func is load_and_call:
+                raise RuntimeError(f"模块 {self.modules[name]} 没有注册函数 {name}")
+            loaded = time.perf_counter()
+            retv = await call_function(func, args, self.executor_for(name))
+            logger.info(f"函数 {name} 首次调用耗时{(time.perf_counter() - start) * 1000:.0f}毫秒，"
+                        f"其中加载实现模块{(loaded - start) * 1000:.0f}毫秒")
+            return retv
+
+        return load_and_call
+
+    def executor_for(self, name: str) -> Optional[ExecutorPool]:
+        """
+        获取函数使用的执行器，在事件循环中直接执行时返回 None
+        """
+        return self.executors.select(self.function_descriptions[name].executor, self.functions[name])
+
+    def function_pipeline(self, pipeline: FunctionPipeline) -> FunctionPipeline:
+        """
+        注册组合函数，组合函数中的步骤需已注册
+        说明：
+            组合函数会自动获得所有步骤的注入参数，任一步骤有副作用时组合函数也被标记为有副作用
+        """
+
+        fd = pipeline.function_description
+        for step in pipeline.steps.values():
+            if self._staging is not None and step.function in self._staging:
+                step_fd = self._staging[step.function][1]
+            elif step.function in self.functions:
+                step_fd = self.function_descriptions[step.function]
+            else:
+                raise ValueError(f"组合函数 {fd.name} 的步骤 {step.name} 调用了未注册的函数 {step.function}")
+            for inj_name, info in step_fd.injection_parameters.items():
+                fd.injection_parameters.setdefault(inj_name, info)
+            if step_fd.side_effect and not fd.side_effect:
+                fd.mark_side_effect()
+        pipeline.levels()  # 检查依赖关系
+
+        async def run_pipeline(**params: Any) -> str:
+            return await pipeline.run(self.functions, self.function_descriptions, params, self.executors)
+
+        self._register(fd, run_pipeline)
+        return pipeline
     
+    def context_provider(self, name: str) -> Callable[[ContextProvider], ContextProvider]:
+        """
+        注册背景信息提供器，收到消息时在第一次 LLM 请求前调用，结果注入本轮对话的请求中，见 context.py
+        参数：
+            name: 提供器名称，用于日志，同名的提供器会被替换
+        """
+
+        def decorator(provider: ContextProvider) -> ContextProvider:
+            self.context_providers[name] = provider
+            return provider
+
+        return decorator
+
     def load_functions(self) -> None:
         """
         从指定路径加载所有注册的函数
+        说明：
+            包含 manifest.py 的函数模块只导入 manifest.py 中的函数声明，实现模块在第一次调用时才导入；
+            没有 manifest.py 的函数模块（例如需要在 Bot 启动时加载数据的 memory）直接导入
         """
 
+        start = time.perf_counter()
         for dir in Path(self.fullpath).iterdir():
             if dir.is_dir() and dir.name not in self.excluded_paths:
                 module_name = f"{__package__}.{self.path}.{dir.name}" # 例如: rmts.plugins.chat.functions.action
+                if (dir / "manifest.py").exists():
+                    module_name += ".manifest"
                 logger.info(f"正在加载函数模块: {module_name}")
-                import_module(module_name) # 运行该文件夹下 __init__.py 中所有的 function_container.function_calling(func_desc_xxx)
+                module_start = time.perf_counter()
+                self._loading = dir.name
+                try:
+                    import_module(module_name) # 运行该文件中所有的 function_container.function_calling(func_desc_xxx) 或 declare_function
+                finally:
+                    self._loading = None
+                self.package_mtimes[dir.name] = self._package_mtime(dir)
+                logger.info(f"函数模块 {module_name} 加载完成，耗时{(time.perf_counter() - module_start) * 1000:.0f}毫秒")
 
-        logger.success("function calling 函数加载完成")
+        logger.success(f"function calling 函数加载完成，耗时{(time.perf_counter() - start) * 1000:.0f}毫秒")
         function_names = [self.function_descriptions[name].name for name in self.function_descriptions]
         logger.info(f"已完成以下函数的加载注册：{function_names}")
 
+    def reload(self, packages: Sequence[str] = ()) -> List[str]:
+        """
+        重载函数模块，参数：
+            packages: 需要重载的函数模块（functions 下的目录名），为空时重载源文件有改动的函数模块
+        返回值：
+            每个函数模块的重载结果
+        """
+        if not packages:
+            packages = [package for package, mtime in self.package_mtimes.items()
+                        if self._package_mtime(Path(self.fullpath) / package) != mtime]
+            if not packages:
+                return ["没有源文件有改动的函数模块"]
+
+        results = []
+        for package in packages:
+            start = time.perf_counter()
+            try:
+                names = self.reload_package(package)
+            except Exception as e:
+                if isinstance(e, ValueError):
+                    logger.warning(f"函数模块 {package} 重载失败: {e}")
+                else:
+                    logger.exception(f"函数模块 {package} 重载失败")
+                results.append(f"函数模块 {package} 重载失败: {e}")
+                continue
+            results.append(f"函数模块 {package} 重载完成，共{len(names)}个函数，"
+                           f"耗时{(time.perf_counter() - start) * 1000:.0f}毫秒")
+        return results
+
+    def reload_package(self, package: str) -> List[str]:
+        """
+        重新导入函数模块并替换其中注册的函数，返回重载后的函数名称
+        说明：
+            只支持包含 manifest.py 的函数模块（memory 等直接导入的函数模块保存着运行时数据，不能重载）；
+            新的函数在 manifest.py 全部导入成功后一次性替换，导入出错时保留原来的函数；
+            正在进行的调用使用原来的函数完成；被替换的函数的缓存结果会被删除，
+            实现模块（以及其中读取的数据文件）在下一次调用时重新导入
+        """
+        dir = Path(self.fullpath) / package
+        if package in self.excluded_paths or not dir.is_dir():
+            raise ValueError(f"函数模块 {package} 不存在")
+        if not (dir / "manifest.py").exists():
+            raise ValueError(f"函数模块 {package} 没有 manifest.py，不支持重载")
+
+        prefix = f"{__package__}.{self.path}.{package}"
+        old_modules = {name: module for name, module in sys.modules.items()
+                       if name == prefix or name.startswith(f"{prefix}.")}
+        for name in old_modules:
+            del sys.modules[name]
+
+        self._staging = {}
+        try:
+            import_module(f"{prefix}.manifest")
+            staged = self._staging
+            for name in staged:
+                owner = self.packages.get(name, package)
+                if owner != package:
+                    raise ValueError(f"函数 {name} 已由函数模块 {owner} 注册")
+        except Exception:
+            # 恢复原来的模块
+            for name in [name for name in sys.modules if name == prefix or name.startswith(f"{prefix}.")]:
+                del sys.modules[name]
+            sys.modules.update(old_modules)
+            raise
+        finally:
+            self._staging = None
+
+        # 以下替换过程中没有 await，对事件循环中的其他协程来说是原子的
+        old_names = {name for name, owner in self.packages.items() if owner == package}
+        self._replace(self.functions, old_names, {name: func for name, (func, _, _) in staged.items()})
+        self._replace(self.function_descriptions, old_names, {name: fd for name, (_, fd, _) in staged.items()})
+        self._replace(self.modules, old_names, {name: module for name, (_, _, module) in staged.items() if module is not None})
+        self._replace(self.packages, old_names, {name: package for name in staged})
+        for name in old_names | staged.keys():
+            self.result_cache.invalidate(name)
+        self.package_mtimes[package] = self._package_mtime(dir)
+
+        logger.success(f"函数模块 {package} 重载完成，函数: {list(staged)}")
+        return list(staged)
+
+    @staticmethod
+    def _replace(target: Dict[str, Any], old_names: Set[str], new_items: Dict[str, Any]) -> None:
+        """原地替换字典中的旧条目，新条目放在第一个旧条目的位置，保持函数描述的顺序以便命中前缀缓存"""
+        items = list(target.items())
+        target.clear()
+        inserted = False
+        for name, value in items:
+            if name in old_names or name in new_items:
+                if not inserted:
+                    target.update(new_items)
+                    inserted = True
+            else:
+                target[name] = value
+        if not inserted:
+            target.update(new_items)
+
+    @staticmethod
+    def _package_mtime(dir: Path) -> float:
+        """函数模块源文件的最后修改时间"""
+        return max((file.stat().st_mtime for file in dir.rglob("*.py")), default=0.0)
+
 class FunctionCalling:
     """
     为每个不同的聊天上下文使用的函数调用管理器
     call 方法用于调用函数
-    to_schemas 方法用于获取所有函数的 Function Calling 描述
+    parse_arguments 方法用于解析、修复模型给出的函数参数
+    run 方法用于执行函数，函数设置了缓存时使用缓存
+    begin_turn 和 end_turn 方法用于在每轮对话开始和结束时启动、清理预取和函数选择
+    build_context 方法用于获取本轮对话自动注入的背景信息
+    to_schemas 方法用于获取本轮提供的函数的 Function Calling 描述
     """
 
     def __init__(self, function_container: FunctionContainer, injection_params: Dict[str, Any] = {}):
@@ -256,54 +851,195 @@ class FunctionCalling:
         self.functions: Dict[str, Callable] = function_container.functions
         self.function_descriptions: Dict[str, FunctionDescription] = function_container.function_descriptions
         self.injection_params: Dict[str, Any] = injection_params
+        self.prefetcher: Optional["ToolPrefetcher"] = None  # 预取器，为 None 时不预取
+        self.selector: Optional["ToolSelector"] = None  # 函数选择器，为 None 时总是提供全部函数
+        self.argument_stats = ArgumentStats()  # 参数修复统计，可由 ModelPool 替换为所有群组共享的实例
+        self.result_cache: ToolResultCache = function_container.result_cache
+        self.function_container = function_container
+        self._turn_results: Dict[str, str] = {}  # 本轮对话中设置了缓存的函数的调用结果，调用标识 -> 结果
 
         # debug 使用
         # logger.info(f"function tools str: \n{self.to_schemas_str()}\n")
     
-    async def call(self, name: str, args: dict) -> str:
+    async def call(self, name: str, args: dict, timeout: Optional[float] = None) -> str:
         """
         调用函数
 
         参数：
             name: 函数名称
             args: 函数参数
+            timeout: 本次调用的最长等待时间，单位秒，与函数声明的超时时间取较小值，为 None 时只使用函数声明的超时时间
 
         返回：
-            str: 函数调用结果
+            str: 函数调用结果，超时时返回 timeout_result 生成的超时结果
         """
+        if self.selector is not None:
+            if name == REQUEST_MORE_FUNCTIONS:
+                return self.selector.widen()
+            self.selector.record_call(name)
+
         if name not in self.functions:
             return f"函数 {name} 不存在"
         
-        # 注入参数
+        self.inject_params(name, args)
+        fd = self.function_descriptions[name]
+        key = make_call_key(name, args)
+
+        # 设置了缓存的函数本轮对话中已经以相同参数调用过，直接返回之前的结果，避免模型反复调用同一个函数
+        if key in self._turn_results:
+            self.result_cache.get_counter(name).repeats += 1
+            logger.info(f"本轮已调用过函数 {name}，参数: {args}，直接返回之前的结果")
+            return f"{self._turn_results[key]}（本轮已调用过相同的函数，结果相同，请不要重复调用）"
+
+        limit = fd.timeout if timeout is None else min(fd.timeout, timeout)
+        task = self.prefetcher.take(name, args) if self.prefetcher is not None else None
+        timed_out = False
+        if limit <= 0:
+            if task is not None:
+                task.cancel()
+            logger.warning(f"本轮对话剩余时间不足，跳过函数 {name}，参数: {args}")
+            result = self.timeout_result(name, 0)
+            timed_out = True
+        else:
+            try:
+                if task is not None:
+                    # 本轮对话已经预取了相同的函数调用，直接使用预取的结果
+                    logger.info(f"调用函数 {name}，参数: {args}，使用预取结果")
+                    result = await asyncio.wait_for(task, limit)
+                else:
+                    result = await asyncio.wait_for(self.run(name, args), limit)
+            except TimeoutError:
+                logger.warning(f"函数 {name} 超过{limit:.1f}秒没有返回，已取消，参数: {args}")
+                result = self.timeout_result(name, limit)
+                timed_out = True
+
+        if fd.side_effect:
+            # 有副作用的函数可能改变了其他函数的结果（例如写入记忆后再查询），之前记录的结果不再可靠
+            self._turn_results.clear()
+        elif fd.cache_ttl is not None and not timed_out:
+            self._turn_results[key] = result
+        return result
+
+    @staticmethod
+    def timeout_result(name: str, timeout: float) -> str:
+        """
+        生成返回给模型的超时结果
+        """
+        return json.dumps({
+            "status": "timeout",
+            "function": name,
+            "timeout_seconds": round(timeout, 1),
+            "message": "函数执行超时，没有获得结果，请不要重复调用，根据已有信息回答博士"
+        }, ensure_ascii=False)
+
+    async def run(self, name: str, args: dict) -> str:
+        """
+        执行函数，参数中需已包含注入参数，函数设置了缓存时优先使用缓存的结果
+        """
+        fd = self.function_descriptions[name]
+        if fd.cache_ttl is None:
+            return (await self.execute(name, args)).text
+        return await self.result_cache.get_or_run(name, self.cache_key(name, args), fd.cache_ttl,
+                                                  lambda: self.execute(name, dict(args)))
+
+    def cache_key(self, name: str, args: dict) -> str:
+        """
+        生成函数调用的缓存标识，由函数名称、模型提供的参数和缓存共享范围生成
+        """
+        fd = self.function_descriptions[name]
+        key_args = {k: v for k, v in args.items() if k not in fd.injection_parameters}
+        if fd.cache_scope == "group":
+            key_args["@group_id"] = self.injection_params.get("group_id")
+        elif fd.cache_scope == "user":
+            key_args["@user_id"] = self.injection_params.get("user_id")
+        return make_call_key(name, key_args)
+
+    def parse_arguments(self, name: str, text: str) -> Tuple[dict, bool]:
+        """
+        解析模型给出的函数参数，必要时修复格式错误，并按函数声明检查、转换参数
+
+        参数：
+            name: 函数名称
+            text: 参数 JSON 字符串
+
+        返回：
+            (参数字典, 是否修复或转换过)，修复或转换过时应将参数重新序列化后写入历史记录
+        说明：
+            无法修复时抛出 ArgumentError，不符合函数声明时抛出 ValidationError，其消息可以直接返回给模型
+        """
+        counter = self.argument_stats.get(name)
+        counter.calls += 1
+        try:
+            args, repairs = parse_arguments(text)
+        except ArgumentError:
+            counter.failed += 1
+            logger.warning(f"函数 {name} 的参数无法修复: {text}")
+            raise
+
+        fd = self.function_descriptions.get(name)
+        try:
+            coerced = fd.validator.validate(args) if fd is not None else []
+        except ValidationError as e:
+            counter.invalid += 1
+            logger.warning(f"函数 {name} 的参数不符合声明: {e.errors}，参数: {args}")
+            raise
+
+        if repairs:
+            counter.repaired += 1
+            for kind in repairs:
+                counter.repairs[kind] = counter.repairs.get(kind, 0) + 1
+        if coerced:
+            counter.coerced += 1
+        if repairs or coerced:
+            logger.info(f"函数 {name} 的参数已修复，修复方式: {repairs}，转换类型的参数: {coerced}")
+        return args, bool(repairs or coerced)
+
+    def inject_params(self, name: str, args: dict) -> dict:
+        """
+        将注入参数写入函数参数，返回写入后的参数（即 args 本身）
+        """
         fd = self.function_descriptions[name]
         for inj_name in fd.injection_parameters:
             # if inj_name not in args: # 注入那些没有被提供的参数
             args[inj_name] = self.injection_params[inj_name] # 覆盖所有参数
+        return args
 
-        logger.info(f"调用函数 {name}，参数: {args}")
-        
-        func = self.functions[name]
-        try:
-            # 检测是否为协程函数
-            if asyncio.iscoroutinefunction(func):
-                retv = await func(**args)
-            else:
-                retv = func(**args)
+    async def execute(self, name: str, args: dict) -> FunctionResult:
+        """
+        执行函数，参数中需已包含注入参数，函数出错时返回标记为失败的错误信息而不是抛出异常
+        """
+        return await run_function(name, self.functions[name], args, self.function_container.executor_for(name))
 
-            # 没有返回值
-            if retv is None:
-                logger.warning(f"函数 {name} ，参数 {args} 没有返回值，已自动转换为字符串提示")
-                return "该 function calling 函数没有返回值"
-            
-            # 返回值不是字符串
-            if not isinstance(retv, str):
-                logger.warning(f"函数 {name} ，参数 {args} 返回值不是字符串，已自动转换为字符串")
-                return str(retv)
-            
-            return retv
-        except Exception as e:
-            logger.exception(f"函数 {name} 调用出错，参数: {args}")
-            return f"函数调用出错: {e}"
+    def begin_turn(self, user_message: str) -> None:
+        """
+        开始一轮对话，根据用户消息启动预取、选择本轮提供的函数
+        """
+        self._turn_results.clear()
+        if self.prefetcher is not None:
+            self.prefetcher.start(user_message)
+        if self.selector is not None:
+            self.selector.start(user_message)
+
+    async def build_context(self, user_message: str, max_length: int = MAX_CONTEXT_LENGTH) -> Optional[str]:
+        """
+        调用所有背景信息提供器，返回本轮对话要注入的背景信息，没有背景信息时返回 None
+        说明：
+            戳一戳等没有博士说的话的消息不注入背景信息
+        """
+        if not has_user_text(user_message):
+            return None
+        return await gather_context(self.function_container.context_providers,
+                                    extract_user_text(user_message), self.injection_params, max_length)
+
+    def end_turn(self) -> None:
+        """
+        结束一轮对话，取消本轮没有被使用的预取，记录本轮使用过的函数
+        """
+        self._turn_results.clear()
+        if self.prefetcher is not None:
+            self.prefetcher.finish()
+        if self.selector is not None:
+            self.selector.finish()
         
     def add_injection_param(self, name: str, value: Any) -> None:
         """
@@ -323,8 +1059,10 @@ class FunctionCalling:
     
     def to_schemas(self) -> list:
         """
-        获取所有函数的 Function Calling 描述
+        获取本轮提供的函数的 Function Calling 描述，没有开启函数选择时为所有函数
         """
+        if self.selector is not None:
+            return self.selector.schemas()
         return [
             fd.to_schema()
             for fd in self.function_descriptions.values()
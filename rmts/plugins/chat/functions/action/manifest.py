@@ -0,0 +1,37 @@
+"""
+和交互动作有关的函数声明，实现位于 impl.py，第一次调用时才导入
+"""
+
+from rmts.plugins.chat.function_calling import FunctionDescription, function_container
+
+from .send_sticker import SendSticker
+
+IMPL_MODULE = f"{__package__}.impl"
+
+# 戳一戳
+func_desc_poke = FunctionDescription(name="poke_doctor", description="戳一戳指定博士")
+func_desc_poke.add_param(name="doctor_id", description="博士的唯一标识符", param_type="integer", required=True)
+func_desc_poke.add_injection_param(name="group_id", description="群组的唯一标识符")
+func_desc_poke.mark_side_effect()
+func_desc_poke.set_selection(keywords=["戳"])
+function_container.declare_function(func_desc_poke, IMPL_MODULE)
+
+# 发送表情，表情列表在第一次生成函数描述时才扫描表情目录
+send_sticker_util = SendSticker()
+func_desc_send_sticker = FunctionDescription(name="send_sticker",description="向博士发送指定表情")
+func_desc_send_sticker.add_enum_param(name="type", description="表情类型", enum_values=send_sticker_util.get_sticker_list, required=True)
+func_desc_send_sticker.add_injection_param(name="group_id", description="群组的唯一标识符")
+func_desc_send_sticker.mark_side_effect()
+func_desc_send_sticker.set_selection(keywords=["表情", "贴纸", "斗图"])
+function_container.declare_function(func_desc_send_sticker, IMPL_MODULE)
+
+# 群组禁言
+func_desc_group_ban = FunctionDescription(name="group_ban", description="禁言指定博士一段时间")
+func_desc_group_ban.add_param(name="doctor_id", description="博士的唯一标识符", param_type="integer", required=True)
+func_desc_group_ban.add_param(name="duration", description="禁言持续时间，单位为秒", param_type="integer", required=True)
+
+func_desc_group_ban.add_injection_param(name="group_id", description="群组的唯一标识符")
+func_desc_group_ban.add_injection_param(name="user_id", description="用户的唯一标识符")
+func_desc_group_ban.mark_side_effect()
+func_desc_group_ban.set_selection(keywords=["禁言", "睡眠套餐", "闭嘴"])
+function_container.declare_function(func_desc_group_ban, IMPL_MODULE)
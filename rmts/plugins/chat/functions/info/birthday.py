@@ -42,12 +42,14 @@ console.log(`\n成功提取 ${results.length} 条数据`);
 """
 
 import os
-import json
 
 from pathlib import Path
+from functools import cache
 from datetime import datetime
 from typing import Dict, List, Optional
 
+from rmts.utils.codec import loads
+
 class Birthday:
     """
     加载和查询干员生日信息
@@ -67,8 +69,8 @@ class Birthday:
         加载数据，初始化时自动调用
         """
 
-        with open(self.path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        with open(self.path, "rb") as f:
+            data = loads(f.read())
 
         return data
     
@@ -104,6 +106,13 @@ class Birthday:
         
         return None
 
+@cache
+def get_birthday() -> Birthday:
+    """
+    获取共享的生日数据，函数声明（预取匹配的干员名）和函数实现共用，第一次调用时读取数据文件
+    """
+    return Birthday()
+
 if __name__ == "__main__":
     birthday = Birthday()
     print(birthday.get_birth_by_date("3月15日"))
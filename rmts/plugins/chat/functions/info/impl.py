@@ -0,0 +1,94 @@
+"""
+和获取信息有关的函数实现，函数声明位于 manifest.py
+"""
+
+from datetime import datetime
+from typing import Optional
+
+from nonebot import get_driver
+
+from rmts.plugins.chat.function_calling import FunctionError, function_container
+from rmts.plugins.chat.usage import usage_ledger
+
+from .birthday import get_birthday
+from .weather import Weather
+from .operators import OperatorInfoManager
+from .image_vision import ImageVision
+from .manifest import func_desc_time, func_desc_birthday_by_date, func_desc_birthday_by_name
+from .manifest import func_desc_weather, func_desc_operator_info, image_vision_desc, remember_location
+
+# 获取当前时间
+@function_container.function_calling(func_desc_time)
+def get_current_time() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+# 通过日期获取过生日的干员
+@function_container.function_calling(func_desc_birthday_by_date)
+def get_birth_by_date(date: str) -> str:
+    result = get_birthday().get_birth_by_date(date)
+    if result:
+        return f"{date}过生日的干员有: {', '.join(result)}"
+    else:
+        return f"{date}没有干员过生日"
+
+# 通过名字获取干员的生日
+@function_container.function_calling(func_desc_birthday_by_name)
+def get_birth_by_name(name: str) -> str:
+    result = get_birthday().get_birth_by_name(name)
+    if result:
+        return f"{name}的生日是: {result}"
+    else:
+        return f"没有找到名为{name}的干员的生日信息"
+
+# 天气查询
+weather_query = Weather(get_driver().config.amap_weather_api_key)
+
+@function_container.function_calling(func_desc_weather)
+async def get_weather(location: str) -> str:
+    try:
+        result = await weather_query.get_forecast_weather(location)
+    except Exception as e:
+        raise FunctionError(f"获取天气信息时发生错误: {str(e)}") from e
+    
+    if result:
+        remember_location(location)
+        return result.to_readable_text()
+    else:
+        return f"没有找到{location}的天气信息"
+
+# 干员信息查询
+operator_manager = OperatorInfoManager()
+
+@function_container.function_calling(func_desc_operator_info)
+async def get_operator_info(name: str) -> str:
+    try:
+        operator = await operator_manager.get_operator_info_by_name(name)
+    except Exception as e:
+        raise FunctionError(f"获取干员信息时发生错误: {str(e)}") from e
+
+    if operator:
+        summary = operator.get("summary", "该干员无信息")
+        return f"{name}的干员信息：{summary}"
+    else:
+        return f"没有找到名为{name}的干员信息"
+
+# 图片识别
+iv = ImageVision(
+    api_key=get_driver().config.image_vision_api_key,
+    model=get_driver().config.image_vision_model,
+    base_url=get_driver().config.image_vision_base_url
+)
+
+@function_container.function_calling(image_vision_desc)
+async def analyze_image(image_url: str, group_id: int, user_id: int, focus_point: Optional[str] = None) -> str:
+    # 验证URL格式
+    if not image_url.startswith("https://multimedia.nt.qq.com.cn/download?appid="):
+        return "不支持分析该图片"
+    
+    try:
+        result = await iv.analyze_image_with_usage(image_url=image_url, focus_point=focus_point, detail="auto")
+        usage = result["usage"]
+        usage_ledger.record(group_id, user_id, iv.model, "analyze_image", usage["prompt_tokens"], usage["completion_tokens"])
+        return result["description"]
+    except Exception as e:
+        raise FunctionError(f"分析图片时发生错误: {str(e)}") from e
@@ -0,0 +1,130 @@
+"""
+和获取信息有关的函数声明，实现位于 impl.py，第一次调用时才导入
+"""
+
+import re
+
+from datetime import datetime
+from functools import lru_cache
+from collections import OrderedDict
+from typing import Any, Dict, List
+
+from rmts.plugins.chat.function_calling import FunctionDescription, FunctionPipeline, function_container
+
+from .birthday import get_birthday
+
+IMPL_MODULE = f"{__package__}.impl"
+
+# 获取当前时间
+func_desc_time = FunctionDescription(name="get_current_time", description="获取当前时间")
+func_desc_time.set_executor("inline")
+function_container.declare_function(func_desc_time, IMPL_MODULE)
+
+@lru_cache(maxsize=1)
+def operator_names() -> List[str]:
+    """
+    预取匹配使用的干员名，按长度从长到短排列，不包括迷迭香自己和单字名，第一次匹配时读取生日数据
+    """
+    return sorted({item["name"] for item in get_birthday().data if len(item["name"]) > 1} - {"迷迭香"},
+                  key=len, reverse=True)
+
+# 消息中的日期，如：1月1日、12月31号
+DATE_PATTERN = re.compile(r"(\d{1,2})月(\d{1,2})[日号]")
+
+def match_operator_names(text: str, limit: int = 2) -> List[str]:
+    """
+    找出消息中提到的干员名，较短的名字是已匹配名字的一部分时忽略
+    """
+    found: List[str] = []
+    for name in operator_names():
+        if name in text and not any(name in other for other in found):
+            found.append(name)
+            if len(found) >= limit:
+                break
+    return found
+
+def match_birthday_dates(text: str, injection_params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """预取匹配器：询问生日且提到日期时，预取该日期过生日的干员"""
+    if "生日" not in text:
+        return []
+    return [{"date": f"{int(month)}月{int(day)}日"} for month, day in DATE_PATTERN.findall(text)]
+
+func_desc_birthday_by_date = FunctionDescription(name="get_birth_by_date", description="通过日期获取过生日的干员")
+func_desc_birthday_by_date.add_param(name="date", description="日期字符串，格式为MM月DD日，例如1月1日", param_type="string", required=True)
+func_desc_birthday_by_date.set_prefetch(match_birthday_dates)
+func_desc_birthday_by_date.set_cache(ttl=86400)
+func_desc_birthday_by_date.set_selection(keywords=["生日"])
+function_container.declare_function(func_desc_birthday_by_date, IMPL_MODULE)
+
+# 获取今天过生日的干员，组合查询时间和通过日期查询生日两个函数，只需一次函数调用
+def date_from_time(params: Dict[str, Any], results: Dict[str, str]) -> Dict[str, Any]:
+    """将 get_current_time 的结果转换为 get_birth_by_date 的日期参数"""
+    now = datetime.strptime(results["time"], "%Y-%m-%d %H:%M:%S")
+    return {"date": f"{now.month}月{now.day}日"}
+
+func_desc_birthday_today = FunctionDescription(name="get_today_birthday", description="获取当前时间和今天过生日的干员")
+func_desc_birthday_today.set_prefetch(lambda text, _: [{}] if "生日" in text and "今天" in text else [])
+func_desc_birthday_today.set_selection(keywords=["生日"])
+
+function_container.function_pipeline(
+    FunctionPipeline(func_desc_birthday_today)
+    .add_step("time", "get_current_time")
+    .add_step("birthday", "get_birth_by_date", args=date_from_time, depends=["time"])
+    .set_output(lambda params, results: f"当前时间: {results['time']}，{results['birthday']}")
+)
+
+# 通过名字获取干员的生日
+func_desc_birthday_by_name = FunctionDescription(name="get_birth_by_name", description="通过名字获取干员的生日")
+func_desc_birthday_by_name.add_param(name="name", description="干员名字", param_type="string", required=True)
+func_desc_birthday_by_name.set_prefetch(
+    lambda text, _: [{"name": name} for name in match_operator_names(text)] if "生日" in text else []
+)
+func_desc_birthday_by_name.set_cache(ttl=86400)
+func_desc_birthday_by_name.set_selection(keywords=["生日"])
+function_container.declare_function(func_desc_birthday_by_name, IMPL_MODULE)
+
+# 天气查询
+# 查询成功过的地点，用于预取匹配，地点 -> 去掉省市县区后缀的简称
+known_locations: "OrderedDict[str, str]" = OrderedDict()
+MAX_KNOWN_LOCATIONS = 200
+
+def remember_location(location: str) -> None:
+    """记录查询成功的地点，超过上限时删除最久没有查询的地点"""
+    known_locations[location] = location.rstrip("省市县区") or location
+    known_locations.move_to_end(location)
+    while len(known_locations) > MAX_KNOWN_LOCATIONS:
+        known_locations.popitem(last=False)
+
+def match_weather_locations(text: str, injection_params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """预取匹配器：询问天气且提到查询过的地点时，预取该地点的天气"""
+    if "天气" not in text:
+        return []
+    return [{"location": location} for location, short in reversed(known_locations.items()) if short in text][:1]
+
+func_desc_weather = FunctionDescription(name="get_weather", description="获取天气信息")
+func_desc_weather.add_param(name="location", description="查询天气的地点，如：广州市、广宁县等", param_type="string", required=True)
+func_desc_weather.set_prefetch(match_weather_locations)
+func_desc_weather.set_cache(ttl=600)
+func_desc_weather.set_timeout(8)
+func_desc_weather.set_selection(keywords=["天气", "下雨", "下雪", "气温", "温度"])
+function_container.declare_function(func_desc_weather, IMPL_MODULE)
+
+# 干员信息查询
+func_desc_operator_info = FunctionDescription(name="get_operator_info", description="获取干员信息")
+func_desc_operator_info.add_param(name="name", description="干员名字，如：澄闪", param_type="string", required=True)
+func_desc_operator_info.set_prefetch(lambda text, _: [{"name": name} for name in match_operator_names(text)])
+func_desc_operator_info.set_cache(ttl=3600)
+func_desc_operator_info.set_selection(keywords=["干员"], matcher=lambda text: bool(match_operator_names(text, limit=1)))
+function_container.declare_function(func_desc_operator_info, IMPL_MODULE)
+
+# 图片识别
+image_vision_desc = FunctionDescription(name="analyze_image", description="分析图片并返回描述信息")
+image_vision_desc.add_param(name="image_url", description="图片的URL地址", param_type="string", required=True)
+image_vision_desc.add_param(name="focus_point", description="图片中需要关注的点（可选）", param_type="string", required=False)
+image_vision_desc.add_injection_param(name="group_id", description="群组的唯一标识符")  # 用于记录 token 用量
+image_vision_desc.add_injection_param(name="user_id", description="用户的唯一标识符")
+image_vision_desc.set_cache(ttl=3600)
+image_vision_desc.mark_paid()
+image_vision_desc.set_timeout(20)
+image_vision_desc.set_selection(keywords=["图片", "照片"], image=True)
+function_container.declare_function(image_vision_desc, IMPL_MODULE)
@@ -4,7 +4,6 @@ ref: https://github.com/Kengxxiao/ArknightsGameData
 """
 
 import os
-import json
 import aiofiles
 
 from pathlib import Path
@@ -12,6 +11,8 @@ from openai import AsyncOpenAI
 from dataclasses import dataclass, field
 from typing import Optional, List, Dict, Union
 
+from rmts.utils.codec import dumps, loads
+
 
 @dataclass
 class StoryInfo:
@@ -207,8 +208,8 @@ class OperatorInfoBuilder:
         """
         从 JSON 文件加载所有干员信息
         """
-        with open(self.resource_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        with open(self.resource_path, 'rb') as f:
+            data = loads(f.read())
         
         handbook_dict = data.get("handbookDict", {})
         
@@ -394,8 +395,9 @@ class OperatorInfoBuilder:
                 }
             }
             
-            with open(self.output_path, 'w', encoding='utf-8') as f:
-                json.dump(save_data, f, ensure_ascii=False, indent=2)
+            # 输出文件随仓库提交，保留缩进便于查看改动
+            with open(self.output_path, 'wb') as f:
+                f.write(dumps(save_data, indent=True))
             
             print(f"\n✓ 批次 {batch_num} 完成，已保存到 {self.output_path}")
             print(f"  进度: {len(results)}/{total_count} 个干员")
@@ -433,9 +435,8 @@ class OperatorInfoManager:
         加载干员信息
         """
         
-        async with aiofiles.open(self.json_file_path, 'r', encoding='utf-8') as f:
-            content = await f.read()
-            data = json.loads(content)
+        async with aiofiles.open(self.json_file_path, 'rb') as f:
+            data = loads(await f.read())
         
         # 从 JSON 中提取 operators 字段
         self.operators_info = data.get("operators", {})
@@ -11,6 +11,8 @@ from typing import Literal, Optional
 
 from nonebot.log import logger
 
+from rmts.utils.codec import loads
+
 @dataclass
 class LivesItem:
     """实时天气数据项"""
@@ -309,7 +311,7 @@ class Weather:
                 response.raise_for_status()
                 
                 # 解析响应
-                data = response.json()
+                data = loads(response.content)
                 
                 # 检查 API 返回的状态
                 if data.get("status") != "1":
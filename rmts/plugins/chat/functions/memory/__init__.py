@@ -2,22 +2,30 @@
 和记忆或信息存储相关的函数调用
 """
 
+from typing import Any, Dict, List, Optional
+
 from nonebot import get_driver
-from rmts.plugins.chat.function_calling import FunctionDescription, function_container
+from rmts.plugins.chat.config import Config
+from rmts.plugins.chat.function_calling import FunctionDescription, FunctionPipeline, function_container
+from rmts.plugins.chat.archive import history_archives
 
 from .memory_manager import MemoryManager, Memory
 
-# 记忆管理
-mem_manager = MemoryManager()
 # 加载和保存记忆
 driver = get_driver()
+# 记忆管理
+plugin_config = Config(**driver.config.model_dump())
+mem_manager = MemoryManager(max_length=plugin_config.memory_max_length, flush_delay=plugin_config.memory_flush_delay)
+
+# 读取全部记忆的函数只在博士问起时提供（开启函数选择时），平时使用检索记忆的函数
+READ_ALL_KEYWORDS = ("所有", "全部", "都记得", "记得什么", "了解我")
 
 # Bot 启动时加载所有记忆
 @driver.on_startup
 async def load_memories():
     await mem_manager.load_memories_from_file()
 
-# Bot 关闭时保存所有记忆
+# Bot 关闭时保存还没有写入文件的记忆，运行期间添加的记忆会在后台写入
 @driver.on_shutdown
 async def save_memories():
     await mem_manager.save_memories_to_file()
@@ -28,6 +36,7 @@ func_desc_add_info.add_list_param("info", "信息的列表", "string", True)
 func_desc_add_info.add_param(name="doctor_id", description="博士的唯一标识符", param_type="integer", required=True)
 func_desc_add_info.add_injection_param(name="user_id", description="用户的唯一标识符")
 func_desc_add_info.add_injection_param(name="group_id", description="群组的唯一标识符")
+func_desc_add_info.mark_side_effect()
 
 @function_container.function_calling(func_desc_add_info)
 async def add_doctor_info(info: list, group_id: int, doctor_id: int, user_id: int) -> str:
@@ -42,18 +51,21 @@ async def add_doctor_info(info: list, group_id: int, doctor_id: int, user_id: in
 func_desc_get_all_info = FunctionDescription("get_doctor_all_info", "在终端读取指定博士的所有信息")
 func_desc_get_all_info.add_param(name="doctor_id", description="博士的唯一标识符", param_type="integer", required=True)
 func_desc_get_all_info.add_injection_param(name="group_id", description="群组的唯一标识符")
+func_desc_get_all_info.add_injection_param(name="read_only", description="是否为只读调用")
+func_desc_get_all_info.set_selection(keywords=READ_ALL_KEYWORDS)
 
 @function_container.function_calling(func_desc_get_all_info)
-async def get_doctor_all_info(group_id: int, doctor_id: int) -> str:
-    memories = await mem_manager.get_user_memories(str(group_id), str(doctor_id))
+async def get_doctor_all_info(group_id: int, doctor_id: int, read_only: bool) -> str:
+    memories = await mem_manager.read_memories(str(group_id), str(doctor_id), touch=not read_only)
     if not memories:
         return "博士还没有任何记录的信息"
-    return f"博士的所有信息：\n{memories.get_all_memory()}"
+    return f"博士的所有信息：\n{memories}"
 
 # 添加全局记忆
 func_desc_add_group_info = FunctionDescription("add_global_info", "在终端添加全局信息")
 func_desc_add_group_info.add_list_param("info", "信息的列表", "string", True)
 func_desc_add_group_info.add_injection_param(name="group_id", description="群组的唯一标识符")
+func_desc_add_group_info.mark_side_effect()
 
 @function_container.function_calling(func_desc_add_group_info)
 async def add_global_info(info: list, group_id: int) -> str:
@@ -63,10 +75,114 @@ async def add_global_info(info: list, group_id: int) -> str:
 # 获取所有全局记忆
 func_desc_get_group_all_info = FunctionDescription("get_global_all_info", "在终端读取所有全局信息")
 func_desc_get_group_all_info.add_injection_param(name="group_id", description="群组的唯一标识符")
+func_desc_get_group_all_info.add_injection_param(name="read_only", description="是否为只读调用")
+func_desc_get_group_all_info.set_selection(keywords=READ_ALL_KEYWORDS)
 
 @function_container.function_calling(func_desc_get_group_all_info)
-async def get_global_all_info(group_id: int) -> str:
-    memories = await mem_manager.get_user_memories(str(group_id), str(group_id))
+async def get_global_all_info(group_id: int, read_only: bool) -> str:
+    memories = await mem_manager.read_memories(str(group_id), str(group_id), touch=not read_only)
     if not memories:
         return "还没有任何记录的全局信息"
-    return f"群组的所有全局信息：\n{memories.get_all_memory()}"
+    return f"群组的所有全局信息：\n{memories}"
+
+# 同时获取个人和全局记忆，组合两个查询函数并发执行，只需一次函数调用
+# 博士询问自己的信息时常用的词，用于预取匹配
+MEMORY_KEYWORDS = ("记得", "我是谁", "关于我", "了解我")
+
+func_desc_get_doctor_and_global_info = FunctionDescription("get_doctor_and_global_info", "在终端同时读取指定博士的所有信息和所有全局信息")
+func_desc_get_doctor_and_global_info.add_param(name="doctor_id", description="博士的唯一标识符", param_type="integer", required=True)
+func_desc_get_doctor_and_global_info.set_prefetch(
+    # 博士问起自己的信息时，预取该博士的记忆
+    lambda text, params: [{"doctor_id": params["user_id"]}] if any(k in text for k in MEMORY_KEYWORDS) else []
+)
+func_desc_get_doctor_and_global_info.set_selection(keywords=READ_ALL_KEYWORDS + MEMORY_KEYWORDS)
+
+function_container.function_pipeline(
+    FunctionPipeline(func_desc_get_doctor_and_global_info)
+    .add_step("doctor", "get_doctor_all_info", args=lambda params, _: {"doctor_id": params["doctor_id"]})
+    .add_step("global", "get_global_all_info")
+)
+
+def format_memories(title: str, memories: List[Memory]) -> str:
+    """将检索到的记忆转换为函数返回结果"""
+    return title + "\n" + "\n".join(f"- {mem.memory}" for mem in memories)
+
+# 检索个人记忆
+func_desc_query_info = FunctionDescription("query_doctor_info", "在终端检索指定博士与关键词相关的信息")
+func_desc_query_info.add_param(name="query", description="检索的关键词，多个关键词用空格分隔，如：所在地 城市", param_type="string", required=True)
+func_desc_query_info.add_param(name="doctor_id", description="博士的唯一标识符", param_type="integer", required=True)
+func_desc_query_info.add_injection_param(name="group_id", description="群组的唯一标识符")
+func_desc_query_info.add_injection_param(name="read_only", description="是否为只读调用")
+
+@function_container.function_calling(func_desc_query_info)
+async def query_doctor_info(query: str, group_id: int, doctor_id: int, read_only: bool) -> str:
+    memories = await mem_manager.query_memories(str(group_id), str(doctor_id), query, touch=not read_only)
+    if not memories:
+        return f"没有找到博士和“{query}”相关的信息"
+    return format_memories("博士的相关信息：", memories)
+
+# 检索全局记忆
+func_desc_query_global_info = FunctionDescription("query_global_info", "在终端检索与关键词相关的全局信息")
+func_desc_query_global_info.add_param(name="query", description="检索的关键词，多个关键词用空格分隔", param_type="string", required=True)
+func_desc_query_global_info.add_injection_param(name="group_id", description="群组的唯一标识符")
+func_desc_query_global_info.add_injection_param(name="read_only", description="是否为只读调用")
+
+@function_container.function_calling(func_desc_query_global_info)
+async def query_global_info(query: str, group_id: int, read_only: bool) -> str:
+    memories = await mem_manager.query_memories(str(group_id), str(group_id), query, touch=not read_only)
+    if not memories:
+        return f"没有找到和“{query}”相关的全局信息"
+    return format_memories("相关的全局信息：", memories)
+
+# 同时检索个人和全局记忆，只返回最相关的几条，记忆再多每次查询的长度也不会增加
+func_desc_query_doctor_and_global_info = FunctionDescription("query_doctor_and_global_info", "在终端同时检索指定博士和全局与关键词相关的信息")
+func_desc_query_doctor_and_global_info.add_param(name="query", description="检索的关键词，多个关键词用空格分隔，如：所在地 城市", param_type="string", required=True)
+func_desc_query_doctor_and_global_info.add_param(name="doctor_id", description="博士的唯一标识符", param_type="integer", required=True)
+
+function_container.function_pipeline(
+    FunctionPipeline(func_desc_query_doctor_and_global_info)
+    .add_step("doctor", "query_doctor_info", args=lambda params, _: {"query": params["query"], "doctor_id": params["doctor_id"]})
+    .add_step("global", "query_global_info", args=lambda params, _: {"query": params["query"]})
+)
+
+# 自动注入的记忆，个人和全局各最多几条
+MEMORY_CONTEXT_LIMIT = 3
+# 几乎每条记忆都包含的称呼，自动检索时去掉，避免所有记忆都被命中
+MEMORY_CONTEXT_STOP_WORDS = ("博士", "迷迭香")
+
+@function_container.context_provider("memory")
+async def memory_context(text: str, params: Dict[str, Any]) -> Optional[str]:
+    """
+    按博士说的话检索发言的博士和群组最相关的记忆，注入本轮对话，模型不需要先调用函数查询
+    说明：
+        只按二元组和英文单词匹配，只有单字相同的记忆不注入；没有相关的记忆时不注入；
+        每条消息都会检索，检索是只读的，只有模型通过函数读取记忆才计入记忆的热度
+    """
+    for word in MEMORY_CONTEXT_STOP_WORDS:
+        text = text.replace(word, " ")
+    group_id, user_id = str(params["group_id"]), str(params["user_id"])
+    doctor = await mem_manager.query_memories(group_id, user_id, text, MEMORY_CONTEXT_LIMIT,
+                                              min_term_length=2, touch=False)
+    shared = await mem_manager.query_memories(group_id, group_id, text, MEMORY_CONTEXT_LIMIT,
+                                              min_term_length=2, touch=False)
+    sections = []
+    if doctor:
+        sections.append(format_memories(f"ID为{user_id}的博士的相关信息：", doctor))
+    if shared:
+        sections.append(format_memories("相关的全局信息：", shared))
+    return "\n".join(sections) or None
+
+# 检索被截断的较早的聊天记录
+func_desc_search_history = FunctionDescription("search_chat_history", "检索群里较早的、已经不在上下文中的聊天记录，需要回忆之前聊过的具体内容时使用")
+func_desc_search_history.add_param(name="query", description="检索的关键词，多个关键词用空格分隔，如：草莓 蛋糕", param_type="string", required=True)
+func_desc_search_history.add_injection_param(name="group_id", description="群组的唯一标识符")
+func_desc_search_history.set_selection(keywords=["之前", "以前", "上次", "那次", "记得", "说过", "聊过", "提过"])
+
+@function_container.function_calling(func_desc_search_history)
+async def search_chat_history(query: str, group_id: int) -> str:
+    if not history_archives.enabled:
+        return "没有保存较早的聊天记录"
+    turns = await history_archives.get(group_id).search(query)
+    if not turns:
+        return f"没有找到和“{query}”有关的较早的聊天记录"
+    return "找到以下较早的聊天记录：\n" + "\n\n".join(turn.to_text() for turn in turns)
@@ -1,23 +1,57 @@
-import json
+import time
+import asyncio
 import aiofiles
 
 from pathlib import Path
 from asyncio import Lock
-from typing import List, Dict, Optional
+from typing import Any, List, Dict, Optional, Set
 
 from nonebot.log import logger
 
+from rmts.utils.codec import encode_versioned, decode_versioned, write_atomic
+from rmts.utils.search import BM25Index
+
+# 记忆文件的数据格式版本，版本 0 为没有版本号的 {博士 ID: {"max_length", "memories": [记忆内容]}}，
+# 版本 2 起每条记忆保存为 {"text", "created", "last_access", "hits"}
+MEMORY_VERSION = 2
+MEMORY_MIGRATIONS = {
+    0: lambda old: old,
+    1: lambda old: {doctor_id: {**unit, "memories": [{"text": text} for text in unit.get("memories", [])]}
+                    for doctor_id, unit in old.items()},
+}
+
+# 记忆热度的半衰期，单位秒，超过该时间没有被读取的记忆热度减半
+MEMORY_HALF_LIFE = 7 * 86400
+# 检索记忆时默认返回的条数
+MEMORY_QUERY_LIMIT = 5
+# 添加记忆后延迟写入文件的时间，单位秒
+MEMORY_FLUSH_DELAY = 5.0
+
 class Memory:
     """
-    单个记忆
+    单个记忆，记录创建时间、最近一次被读取的时间和被读取的次数，用于淘汰时计算热度
     """
 
-    def __init__(self, memory: str) -> None:
+    __slots__ = ("memory", "created", "last_access", "hits")
+
+    def __init__(self,
+                 memory: str,
+                 *,
+                 created: Optional[float] = None,
+                 last_access: Optional[float] = None,
+                 hits: int = 0
+    ) -> None:
         """
         参数：
             memory: 记忆内容
+            created: 创建时间，默认为当前时间
+            last_access: 最近一次被读取的时间，默认为创建时间
+            hits: 被读取的次数
         """
         self.memory = memory
+        self.created = time.time() if created is None else created
+        self.last_access = self.created if last_access is None else last_access
+        self.hits = hits
 
     def get_length(self) -> int:
         """
@@ -25,67 +59,162 @@ class Memory:
         """
         return len(self.memory)
 
+    def touch(self, now: float) -> None:
+        """
+        记录一次读取
+        """
+        self.hits += 1
+        self.last_access = now
+
+    def score(self, now: float) -> float:
+        """
+        记忆的热度：读取次数越多越高，每经过一个半衰期没有被读取减半
+        """
+        return (1 + self.hits) * 0.5 ** (max(now - self.last_access, 0) / MEMORY_HALF_LIFE)
+
+    def to_data(self) -> Dict[str, Any]:
+        """转换为可序列化的格式"""
+        return {"text": self.memory, "created": self.created, "last_access": self.last_access, "hits": self.hits}
+
+    @classmethod
+    def from_data(cls, data: Dict[str, Any]) -> "Memory":
+        """从反序列化的数据恢复记忆，旧版本的记忆没有时间和读取次数，视为刚刚创建"""
+        return cls(data["text"], created=data.get("created"), last_access=data.get("last_access"), hits=data.get("hits", 0))
+
 class MemoryUnit:
     """
-    记忆单元
+    记忆单元，记忆总长度超过上限时按热度淘汰：最久没有被读取、读取次数最少的记忆最先被删除，
+    经常被读取的记忆（如博士的所在地）不会被之后添加的零碎信息挤掉；都没有被读取过时最早添加的记忆最先被删除。
+    添加和淘汰记忆时同步维护全文索引，可以只检索与查询相关的记忆
     """
 
+    __slots__ = ("max_length", "memory", "length", "index")
+
     def __init__(self, max_length: int) -> None:
         """
         参数：
             max_length: 记忆最大长度
         """
         self.max_length = max_length
-        self.memory: List[Memory] = [] # 记忆列表
-    
-    def add_memory(self, memory: Memory) -> None:
+        self.memory: List[Memory] = [] # 记忆列表，按添加顺序排列
+        self.length = 0                # 记忆总长度
+        self.index: BM25Index[Memory] = BM25Index()  # 记忆内容的全文索引
+
+    def __len__(self) -> int:
+        return len(self.memory)
+
+    def add_memory(self, memory: Memory, now: Optional[float] = None) -> List[Memory]:
         """
-        添加记忆：
+        添加记忆，总长度超过上限时淘汰热度最低的记忆
         参数：
             memory: 记忆内容
+            now: 当前时间，默认为 time.time()
+        返回值：
+            被淘汰的记忆
         """
         self.memory.append(memory)
-        # 确保记忆总长度不超过最大长度
-        while (sum(mem.get_length() for mem in self.memory) > self.max_length) and self.memory:
-            self.memory.pop(0)
+        self.length += memory.get_length()
+        self.index.add(memory, memory.memory)
+        if self.length <= self.max_length:
+            return []
+        evicted = self._evict(time.time() if now is None else now)
+        for mem in evicted:
+            self.index.remove(mem)
+        return evicted
+
+    def query(self, query: str, limit: int = MEMORY_QUERY_LIMIT, now: Optional[float] = None,
+              min_term_length: int = 1, touch: bool = True) -> List[Memory]:
+        """
+        检索与查询最相关的记忆，并记录返回的每条记忆被读取了一次
+        参数：
+            query: 查询文本
+            limit: 最多返回的条数
+            now: 当前时间，默认为 time.time()
+            min_term_length: 只使用不短于该长度的检索词，见 BM25Index.search
+            touch: 是否记录读取，自动注入等不是模型主动读取的检索应为 False，不影响记忆的热度
+        返回值：
+            按相关性从高到低排列的记忆，没有相关的记忆时为空列表
+        """
+        found = [mem for mem, _ in self.index.search(query, limit, min_term_length)]
+        if touch:
+            now = time.time() if now is None else now
+            for mem in found:
+                mem.touch(now)
+        return found
+
+    def read(self, now: Optional[float] = None) -> str:
+        """
+        读取所有记忆内容的拼接字符串，并记录每条记忆被读取了一次
+        """
+        now = time.time() if now is None else now
+        for mem in self.memory:
+            mem.touch(now)
+        return self.get_all_memory()
 
     def get_all_memory(self) -> str:
         """
-        获取所有记忆内容的拼接字符串
+        获取所有记忆内容的拼接字符串，不记录读取
         """
         return "\n".join(mem.memory for mem in self.memory)
 
+    def _evict(self, now: float) -> List[Memory]:
+        """按热度从低到高淘汰记忆直到总长度不超过上限，刚添加的记忆本身超过上限时只淘汰它"""
+        newest = self.memory[-1]
+        if newest.get_length() > self.max_length:
+            self.memory.pop()
+            self.length -= newest.get_length()
+            return [newest]
+        # 每条记忆的热度只计算一次，通常只需淘汰一条
+        scores = [mem.score(now) for mem in self.memory]
+        evicted: List[Memory] = []
+        while self.length > self.max_length:
+            # min 返回第一个最小值，热度相同时先淘汰较早添加的记忆
+            i = min(range(len(self.memory) - 1), key=scores.__getitem__)
+            mem = self.memory.pop(i)
+            del scores[i]
+            evicted.append(mem)
+            self.length -= mem.get_length()
+        return evicted
+
 class MemoryManager:
     """
     记忆管理器
+    说明：
+        读写内存中的记忆时没有 await，对事件循环中的其他协程来说是原子的，不需要加锁，不同群组的记忆调用互不等待；
+        记忆有变化的群组被标记为待保存，变化后 flush_delay 秒在后台只将这些群组的记忆原子地写入文件，
+        期间的多次变化合并为一次写入，同一群组的写入按群组的锁依次进行
     """
 
-    def __init__(self, max_length: int = 300) -> None:
+    def __init__(self, max_length: int = 300, flush_delay: float = MEMORY_FLUSH_DELAY) -> None:
         """
         参数：
             max_length: 每个记忆单元的最大长度
+            flush_delay: 添加记忆后延迟写入文件的时间，单位秒
         """
         self.max_length = max_length
+        self.flush_delay = flush_delay
         self.memories: Dict[str, Dict[str, MemoryUnit]] = {} # 群号 -> id -> 记忆
-        self._lock = Lock()  # 并发安全锁
+        self._locks: Dict[str, Lock] = {}  # 每个群组一个写入文件的锁
+        self._dirty: Set[str] = set()  # 有尚未保存的变化的群号
+        self._flush_task: Optional[asyncio.Task] = None  # 等待中的后台写入
 
     async def add_memories(self, group_id: str, doctor_id: str, memories: List[Memory]) -> None:
         """
-        添加记忆：
+        添加记忆，并安排在后台保存该群组的记忆：
         参数：
             group_id: 群号
             doctor_id: 博士ID
             memories: 记忆列表
         """
-        async with self._lock:
-            if group_id not in self.memories:
-                self.memories[group_id] = {}
+        if group_id not in self.memories:
+            self.memories[group_id] = {}
 
-            if doctor_id not in self.memories[group_id]:
-                self.memories[group_id][doctor_id] = MemoryUnit(self.max_length)
-            
-            for memory in memories:
-                self.memories[group_id][doctor_id].add_memory(memory)
+        if doctor_id not in self.memories[group_id]:
+            self.memories[group_id][doctor_id] = MemoryUnit(self.max_length)
+
+        for memory in memories:
+            self.memories[group_id][doctor_id].add_memory(memory)
+        self._mark_dirty(group_id)
 
     async def get_user_memories(self, group_id: str, doctor_id: str) -> Optional[MemoryUnit]:
         """
@@ -96,54 +225,129 @@ class MemoryManager:
         返回：
             所有记忆内容
         """
-        async with self._lock:
-            if group_id in self.memories and doctor_id in self.memories[group_id]:
-                return self.memories[group_id][doctor_id]
-            
+        return self.memories.get(group_id, {}).get(doctor_id)
+
+    async def read_memories(self, group_id: str, doctor_id: str, touch: bool = True) -> Optional[str]:
+        """
+        读取用户所有记忆，并记录每条记忆被读取了一次，读取次数越多的记忆越不容易被淘汰
+        参数：
+            group_id: 群号
+            doctor_id: 博士ID
+            touch: 是否记录读取，为 False 时只读，不改变记忆的热度，也不需要保存
+        返回：
+            所有记忆内容，没有记忆时返回 None
+        说明：
+            读取记录随该群组下一次保存写入文件，不单独触发写入
+        """
+        memory_unit = self.memories.get(group_id, {}).get(doctor_id)
+        if not memory_unit:
             return None
+        if not touch:
+            return memory_unit.get_all_memory()
+        self._mark_dirty(group_id, flush=False)
+        return memory_unit.read()
+
+    async def query_memories(self, group_id: str, doctor_id: str, query: str,
+                             limit: int = MEMORY_QUERY_LIMIT, min_term_length: int = 1,
+                             touch: bool = True) -> List[Memory]:
+        """
+        检索用户与查询最相关的记忆，只有返回的记忆被记录读取
+        参数：
+            group_id: 群号
+            doctor_id: 博士ID
+            query: 查询文本
+            limit: 最多返回的条数
+            min_term_length: 只使用不短于该长度的检索词，见 BM25Index.search
+            touch: 是否记录读取，为 False 时只读，不改变记忆的热度，也不需要保存
+        返回：
+            按相关性从高到低排列的记忆
+        """
+        memory_unit = self.memories.get(group_id, {}).get(doctor_id)
+        if not memory_unit:
+            return []
+        found = memory_unit.query(query, limit, min_term_length=min_term_length, touch=touch)
+        if found and touch:
+            self._mark_dirty(group_id, flush=False)
+        return found
+
+    async def flush(self) -> bool:
+        """
+        将所有有变化的群组的记忆写入文件
+        返回：
+            全部保存成功返回 True，任意一个失败返回 False（失败的群组在下一次保存时重试）
+        """
+        results = await asyncio.gather(*(self._save_group(group_id) for group_id in list(self._dirty)))
+        return all(results)
 
     async def save_memories_to_file(self) -> bool:
         """
-        保存所有群的记忆到文件（每个群一个独立文件）
+        取消等待中的后台写入，立即保存所有有变化的群组的记忆（每个群一个独立文件），没有变化的群组不重写
         返回：
             全部保存成功返回 True，任意一个失败返回 False
         """
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        return await self.flush()
+
+    def _mark_dirty(self, group_id: str, flush: bool = True) -> None:
+        """标记群组的记忆有变化，flush 为 True 时安排在后台写入"""
+        self._dirty.add(group_id)
+        if flush and self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        """等待 flush_delay 秒后保存有变化的群组，等待期间的变化合并为一次写入"""
         try:
-            # 创建用户目录下的隐藏文件夹
-            user_home = Path.home()
-            hidden_dir = user_home / ".rmts_chat"
-            hidden_dir.mkdir(exist_ok=True)
-            
-            all_success = True
-            async with self._lock:
-                # 遍历所有群
-                for group_id, group_memories in self.memories.items():
-                    try:
-                        # 生成文件名
-                        filename = f"rosmontis_memory_group_{group_id}.json"
-                        filepath = hidden_dir / filename
-                        
-                        # 将记忆转换为可序列化的格式
-                        serializable_data = {}
-                        for doctor_id, memory_unit in group_memories.items():
-                            serializable_data[doctor_id] = {
-                                "max_length": memory_unit.max_length,
-                                "memories": [mem.memory for mem in memory_unit.memory]
-                            }
-                        
-                        # 使用异步文件写入
-                        async with aiofiles.open(filepath, 'w', encoding='utf-8') as f:
-                            await f.write(json.dumps(serializable_data, ensure_ascii=False, indent=2))
-                        
-                        logger.success(f"群 {group_id} 的记忆已保存到: {filepath}")
-                    except Exception as e:
-                        logger.error(f"保存群 {group_id} 的记忆失败: {e}")
-                        all_success = False
-            
-            return all_success
-        except Exception as e:
-            logger.error(f"保存记忆失败: {e}")
-            return False
+            await asyncio.sleep(self.flush_delay)
+        finally:
+            # 写入期间的新变化会安排下一次写入
+            self._flush_task = None
+        await self.flush()
+
+    def _get_lock(self, group_id: str) -> Lock:
+        """获取群组写入文件的锁，不存在时创建"""
+        if group_id not in self._locks:
+            self._locks[group_id] = Lock()
+        return self._locks[group_id]
+
+    @staticmethod
+    def _filepath(group_id: str) -> Path:
+        """群组的记忆文件路径，保存在用户目录下的 .rmts_chat 文件夹中"""
+        return Path.home() / ".rmts_chat" / f"rosmontis_memory_group_{group_id}.json"
+
+    async def _save_group(self, group_id: str) -> bool:
+        """
+        在线程中原子地写入群组的记忆文件，写入失败时保留待保存标记
+        """
+        async with self._get_lock(group_id):
+            # 等待锁期间其他写入可能已经保存了最新的记忆
+            if group_id not in self._dirty:
+                return True
+            self._dirty.discard(group_id)
+            # 在事件循环中生成快照，之后的变化不影响本次写入的内容
+            snapshot = {
+                doctor_id: {"max_length": memory_unit.max_length,
+                            "memories": [mem.to_data() for mem in memory_unit.memory]}
+                for doctor_id, memory_unit in self.memories.get(group_id, {}).items()
+            }
+            filepath = self._filepath(group_id)
+
+            def write() -> None:
+                filepath.parent.mkdir(exist_ok=True)
+                write_atomic(filepath, encode_versioned(snapshot, MEMORY_VERSION))
+
+            try:
+                await asyncio.to_thread(write)
+            except asyncio.CancelledError:
+                self._dirty.add(group_id)
+                raise
+            except Exception as e:
+                logger.error(f"保存群 {group_id} 的记忆失败: {e}")
+                self._dirty.add(group_id)
+                return False
+        logger.debug(f"群 {group_id} 的记忆已保存到: {filepath}")
+        return True
 
     async def load_memories_from_file(self) -> bool:
         """
@@ -174,24 +378,26 @@ class MemoryManager:
                     group_id = filepath.stem.replace("rosmontis_memory_group_", "")
                     
                     # 使用异步文件读取
-                    async with aiofiles.open(filepath, 'r', encoding='utf-8') as f:
-                        content = await f.read()
-                        data = json.loads(content)
+                    async with aiofiles.open(filepath, 'rb') as f:
+                        data = decode_versioned(await f.read(), MEMORY_VERSION, MEMORY_MIGRATIONS)
                     
-                    async with self._lock:
-                        # 重建记忆结构
-                        if group_id not in self.memories:
-                            self.memories[group_id] = {}
-                        
-                        for doctor_id, memory_data in data.items():
-                            max_length = memory_data.get("max_length", self.max_length)
-                            memory_unit = MemoryUnit(max_length)
-                            
-                            # 恢复记忆列表
-                            for memory_content in memory_data.get("memories", []):
-                                memory_unit.add_memory(Memory(memory_content))
-                            
-                            self.memories[group_id][doctor_id] = memory_unit
+                    # 重建记忆结构
+                    if group_id not in self.memories:
+                        self.memories[group_id] = {}
+
+                    for doctor_id, memory_data in data.items():
+                        # 使用当前配置的上限，调大上限后已有的记忆单元也能保存更多记忆
+                        memory_unit = MemoryUnit(self.max_length)
+
+                        # 恢复记忆列表
+                        saved = memory_data.get("memories", [])
+                        for memory in saved:
+                            memory_unit.add_memory(Memory.from_data(memory))
+                        # 调小上限后有记忆被淘汰，下一次保存时写入
+                        if len(memory_unit) < len(saved):
+                            self._dirty.add(group_id)
+
+                        self.memories[group_id][doctor_id] = memory_unit
                     
                     logger.success(f"群 {group_id} 的记忆已从 {filepath} 加载")
                 except Exception as e:
@@ -1,145 +1,338 @@
-import json
+"""
+聊天记录持久化
+每个群组的聊天记录由一个快照和一个只追加的 JSONL 日志组成：
+    - 每轮对话后，将历史消息自上次记录以来的变化（删除开头的若干条、追加新消息）作为一行追加到日志
+    - 日志累计到一定条数（或无法表示为增量变化，如清空历史）时，将完整的历史消息写入新的快照并清空日志
+    - 快照先写入临时文件再替换，写入过程中崩溃时原快照保持不变，可选 gzip 压缩
+    - 快照和日志的每一行都带有代数，合并后代数加一，旧日志即使没来得及删除也会在加载时被忽略
+    - 登记过的系统提示（见 message_store.intern_prompt）只保存内容哈希，不在每个群组的文件中重复保存
+加载时读取快照，再依次应用同一代数的日志，程序崩溃时最多丢失最后一轮对话
+"""
+
+import gzip
+import asyncio
 import aiofiles
 
-from typing import Optional
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 from pathlib import Path
 from nonebot.log import logger
 
+from rmts.utils.codec import dumps, loads, encode_versioned, decode_versioned, write_atomic
+
+from .message_store import StoredMessage, prompt_ref, resolve_prompt
+
 from openai.types.chat import ChatCompletionSystemMessageParam
 from openai.types.chat import ChatCompletionUserMessageParam
 from openai.types.chat import ChatCompletionAssistantMessageParam
 from openai.types.chat import ChatCompletionToolMessageParam
 
-async def save_messages_to_file(messages, group_id: Optional[int] = None, filename: str = "rosmontis_chat.json"):
-    """保存消息历史到用户目录下的隐藏文件夹
-    
-    Args:
-        messages: 要保存的消息列表
-        group_id: 群号,用于区分不同群组的聊天记录
-        filename: 基础文件名,如果提供了群号会自动加上群号后缀
-    """
-    try:
-        # 创建用户目录下的隐藏文件夹
-        user_home = Path.home()
-        hidden_dir = user_home / ".rmts_chat"
-        hidden_dir.mkdir(exist_ok=True)
-        
-        # 根据群号生成文件名
-        if group_id:
-            base_name = filename.rsplit('.', 1)[0] if '.' in filename else filename
-            extension = filename.rsplit('.', 1)[1] if '.' in filename else 'json'
-            filename = f"{base_name}_group_{group_id}.{extension}"
-        
-        # 完整文件路径
-        filepath = hidden_dir / filename
+def messages_to_data(messages) -> list:
+    """将消息列表转换为可序列化的格式"""
+    serializable_messages = []
+    for msg in messages:
+        if msg["role"] == "system":
+            ref = prompt_ref(msg.get("content"))
+            if ref is not None:
+                serializable_messages.append({"role": "system", "prompt": ref})
+                continue
+
+        msg_dict = {
+            "role": msg["role"],
+            "content": msg.get("content")
+        }
         
-        # 将消息转换为可序列化的格式
-        serializable_messages = []
-        for msg in messages:
-            msg_dict = {
-                "role": msg["role"],
-                "content": msg.get("content")
-            }
-            
-            # 处理 assistant 消息的 tool_calls
-            if msg["role"] == "assistant" and "tool_calls" in msg:
-                msg_dict["tool_calls"] = msg["tool_calls"]
-            
-            # 处理 tool 消息的 tool_call_id
-            if msg["role"] == "tool" and "tool_call_id" in msg:
-                msg_dict["tool_call_id"] = msg["tool_call_id"]
-            
-            serializable_messages.append(msg_dict)
+        # 处理 assistant 消息的 tool_calls
+        if msg["role"] == "assistant" and "tool_calls" in msg:
+            msg_dict["tool_calls"] = msg["tool_calls"]
         
-        # 使用异步文件写入
-        async with aiofiles.open(filepath, 'w', encoding='utf-8') as f:
-            await f.write(json.dumps(serializable_messages, ensure_ascii=False, indent=2))
+        # 处理 tool 消息的 tool_call_id
+        if msg["role"] == "tool" and "tool_call_id" in msg:
+            msg_dict["tool_call_id"] = msg["tool_call_id"]
         
-        logger.success(f"消息已保存到: {filepath}")
-        return True
-    except Exception as e:
-        logger.error(f"保存消息失败: {e}")
-        return False
+        serializable_messages.append(msg_dict)
+    return serializable_messages
 
-async def load_messages_from_file(group_id: Optional[int] = None, filename: str = "rosmontis_chat.json"):
-    """从用户目录下的隐藏文件夹加载消息历史"""
-    try:
-        user_home = Path.home()
-        hidden_dir = user_home / ".rmts_chat"
-        
-        if group_id:
-            base_name = filename.rsplit('.', 1)[0] if '.' in filename else filename
-            extension = filename.rsplit('.', 1)[1] if '.' in filename else 'json'
-            filename = f"{base_name}_group_{group_id}.{extension}"
-        
-        filepath = hidden_dir / filename
+def messages_from_data(data: list) -> list:
+    """
+    从反序列化的数据重新构建消息列表
+    说明：
+        以内容哈希保存的系统提示在本次运行没有登记过时（系统提示已修改），内容为 None，由 Model 替换为当前的系统提示
+    """
+    messages = []
+    for msg_data in data:
+        role = msg_data["role"]
+        content = msg_data.get("content")
+        if "prompt" in msg_data:
+            content = resolve_prompt(msg_data["prompt"])
         
-        if not filepath.exists():
-            logger.warning(f"文件 {filepath} 不存在")
+        if role == "system":
+            messages.append(ChatCompletionSystemMessageParam(content=content, role="system"))
+        elif role == "user":
+            messages.append(ChatCompletionUserMessageParam(content=content, role="user"))
+        elif role == "assistant":
+            msg_param = ChatCompletionAssistantMessageParam(content=content, role="assistant")
+            if "tool_calls" in msg_data:
+                msg_param["tool_calls"] = msg_data["tool_calls"]
+            messages.append(msg_param)
+        elif role == "tool":
+            messages.append(ChatCompletionToolMessageParam(
+                role="tool",
+                tool_call_id=msg_data["tool_call_id"],
+                content=content
+            ))
+    return messages
+
+# 日志累计该条数后合并为快照
+DEFAULT_COMPACT_ENTRIES = 50
+# 快照的数据格式版本，版本 0 为完整的消息列表（或没有版本号的 {"gen", "messages"}），
+# 版本 2 起系统提示可以保存为内容哈希 {"role": "system", "prompt": 哈希}
+SNAPSHOT_VERSION = 2
+SNAPSHOT_MIGRATIONS = {
+    0: lambda old: old if isinstance(old, dict) else {"gen": 0, "messages": old},
+    1: lambda old: old,
+}
+
+def history_dir() -> Path:
+    """聊天记录所在目录，用户目录下的 .rmts_chat 文件夹"""
+    return Path.home() / ".rmts_chat"
+
+class HistoryJournal:
+    """
+    单个群组的聊天记录快照和日志，方法：
+        load: 从快照和日志恢复历史消息
+        record: 将历史消息自上次记录以来的变化追加到日志
+        compact: 将历史消息写入快照并清空日志
+        delete: 删除快照和日志
+    说明：
+        通过消息记录的对象身份（StoredMessage 创建后不会被修改）比较两次记录之间的变化，
+        同一群组的 record、compact 调用需持有该群组的锁
+    """
+
+    def __init__(self,
+                 group_id: int,
+                 *,
+                 filename: str = "rosmontis_chat.json",
+                 compress: bool = False,
+                 compact_entries: int = DEFAULT_COMPACT_ENTRIES,
+                 directory: Optional[Path] = None
+    ) -> None:
+        """
+        参数：
+            group_id: 群号
+            filename: 基础文件名，会自动加上群号后缀
+            compress: 快照是否使用 gzip 压缩，读取时两种格式都支持
+            compact_entries: 日志累计该条数后合并为快照
+            directory: 文件所在目录，默认为 history_dir()
+        """
+        directory = directory or history_dir()
+        base_name = filename.rsplit(".", 1)[0]
+        self.snapshot_path = directory / f"{base_name}_group_{group_id}.json"
+        self.compressed_path = directory / f"{base_name}_group_{group_id}.json.gz"
+        self.journal_path = directory / f"{base_name}_group_{group_id}.journal.jsonl"
+        self.compress = compress
+        self.compact_entries = compact_entries
+        self.generation = 0  # 当前快照的代数
+        self.entries = 0     # 当前快照之后的日志条数
+        self.persisted: List[Any] = []  # 上次记录时的消息记录列表
+        self.inline_prompt = False      # 读取的系统提示是否以完整内容保存（旧版本的文件）
+
+    def read(self) -> List[dict]:
+        """
+        同步读取快照和日志，返回可序列化格式的历史消息，没有记录时返回空列表
+        说明：
+            日志末尾不完整的一行（写入时崩溃）会被截掉
+        """
+        data: List[dict] = []
+        snapshot = self._read_snapshot()
+        if snapshot is not None:
+            self.generation, data = snapshot
+        self.entries = 0
+        if self.journal_path.exists():
+            data = self._read_journal(data)
+        self.inline_prompt = bool(data) and data[0]["role"] == "system" and "prompt" not in data[0]
+        return data
+
+    async def load(self) -> List[StoredMessage]:
+        """
+        从快照和日志恢复历史消息，返回消息记录列表，没有记录或读取失败时返回空列表
+        说明：
+            读取、解析文件和创建消息记录都在线程中进行，不阻塞事件循环
+        """
+        def read_records() -> List[StoredMessage]:
+            return [StoredMessage.from_param(msg) for msg in messages_from_data(self.read())]
+
+        try:
+            records = await asyncio.to_thread(read_records)
+        except Exception as e:
+            logger.error(f"加载群组聊天记录失败: {e}")
             return []
-        
-        # 使用异步文件读取
-        async with aiofiles.open(filepath, 'r', encoding='utf-8') as f:
-            content = await f.read()
-            data = json.loads(content)
-        
-        # 重新构建消息列表
-        messages = []
-        for msg_data in data:
-            role = msg_data["role"]
-            content = msg_data.get("content")
-            
-            if role == "system":
-                messages.append(ChatCompletionSystemMessageParam(content=content, role="system"))
-            elif role == "user":
-                messages.append(ChatCompletionUserMessageParam(content=content, role="user"))
-            elif role == "assistant":
-                msg_param = ChatCompletionAssistantMessageParam(content=content, role="assistant")
-                if "tool_calls" in msg_data:
-                    msg_param["tool_calls"] = msg_data["tool_calls"]
-                messages.append(msg_param)
-            elif role == "tool":
-                messages.append(ChatCompletionToolMessageParam(
-                    role="tool",
-                    tool_call_id=msg_data["tool_call_id"],
-                    content=content
-                ))
-        
-        logger.success(f"消息已从 {filepath} 加载")
-        return messages
-    except Exception as e:
-        logger.error(f"加载消息失败: {e}")
-        return []
+        if records:
+            logger.success(f"消息已从 {self.snapshot_path.stem} 的快照和{self.entries}条日志加载")
+        return records
+
+    async def record(self, records: Sequence[Any]) -> bool:
+        """
+        将历史消息自上次记录以来的变化追加到日志，日志条数达到上限或无法表示为增量变化时合并为快照
+        参数：
+            records: 当前的消息记录列表，会被复制
+        返回值：
+            成功返回 True，失败返回 False
+        """
+        entry = self._diff(records)
+        if entry is None:
+            return True
+        if "reset" in entry or self.entries + 1 >= self.compact_entries:
+            return await self.compact(records)
+
+        try:
+            entry["gen"] = self.generation
+            async with aiofiles.open(self.journal_path, "ab") as f:
+                await f.write(dumps(entry) + b"\n")
+        except Exception as e:
+            logger.error(f"写入聊天记录日志失败: {e}")
+            return False
+        self.entries += 1
+        self.persisted = list(records)
+        return True
+
+    async def compact(self, records: Sequence[Any]) -> bool:
+        """
+        将历史消息写入下一代快照并删除日志
+        参数：
+            records: 当前的消息记录列表，会被复制
+        返回值：
+            成功返回 True，失败返回 False
+        """
+        generation = self.generation + 1
+        text = encode_versioned({"gen": generation, "messages": messages_to_data(records)}, SNAPSHOT_VERSION)
+        target, other = ((self.compressed_path, self.snapshot_path) if self.compress
+                         else (self.snapshot_path, self.compressed_path))
+
+        def write() -> None:
+            target.parent.mkdir(exist_ok=True)
+            write_atomic(target, gzip.compress(text) if self.compress else text)
+            # 新快照已经写入，之后崩溃时旧日志会因为代数不同被忽略
+            other.unlink(missing_ok=True)
+            self.journal_path.unlink(missing_ok=True)
+
+        try:
+            await asyncio.to_thread(write)
+        except Exception as e:
+            logger.error(f"保存聊天记录快照失败: {e}")
+            return False
+        self.generation = generation
+        self.entries = 0
+        self.persisted = list(records)
+        return True
+
+    def delete(self) -> bool:
+        """
+        删除快照和日志，返回是否删除了任何文件
+        """
+        deleted = False
+        for path in (self.snapshot_path, self.compressed_path, self.journal_path):
+            if path.exists():
+                path.unlink()
+                deleted = True
+        self.generation = 0
+        self.entries = 0
+        self.persisted = []
+        return deleted
+
+    def _read_snapshot(self) -> Optional[Tuple[int, List[dict]]]:
+        """读取快照，返回 (代数, 消息)，两种格式都存在时使用较新的，不存在时返回 None"""
+        paths = [p for p in (self.snapshot_path, self.compressed_path) if p.exists()]
+        if not paths:
+            return None
+        path = max(paths, key=lambda p: p.stat().st_mtime)
+        content = path.read_bytes()
+        if path.suffix == ".gz":
+            content = gzip.decompress(content)
+        snapshot = decode_versioned(content, SNAPSHOT_VERSION, SNAPSHOT_MIGRATIONS)
+        return snapshot["gen"], snapshot["messages"]
+
+    def _read_journal(self, data: List[dict]) -> List[dict]:
+        """依次应用同一代数的日志，截掉末尾不完整的一行"""
+        with open(self.journal_path, "rb") as f:
+            content = f.read()
+        offset = 0
+        for line in content.splitlines(keepends=True):
+            try:
+                if not line.endswith(b"\n"):
+                    raise ValueError("不完整的日志记录")
+                entry = loads(line)
+            except ValueError:
+                logger.warning(f"聊天记录日志 {self.journal_path} 末尾有不完整的记录，已截断")
+                with open(self.journal_path, "r+b") as f:
+                    f.truncate(offset)
+                break
+            offset += len(line)
+            if entry.get("gen") != self.generation:
+                continue  # 合并为快照后没来得及删除的旧日志
+            data = self._apply(data, entry)
+            self.entries += 1
+        return data
+
+    @staticmethod
+    def _apply(data: List[dict], entry: Dict[str, Any]) -> List[dict]:
+        """将一条日志应用到历史消息上"""
+        if "reset" in entry:
+            return list(entry["reset"])
+        # 保留第一条系统提示，删除其后的 drop 条消息
+        data = data[:1] + data[1 + entry.get("drop", 0):]
+        data.extend(entry.get("append", []))
+        return data
+
+    def _diff(self, records: Sequence[Any]) -> Optional[Dict[str, Any]]:
+        """
+        比较上次记录和当前的消息记录列表，返回日志条目，没有变化时返回 None
+        说明：
+            历史消息只会在系统提示之后删除最旧的消息（截断）、在末尾追加新消息，
+            其他变化（清空历史、替换系统提示等）返回 reset 条目
+        """
+        old = self.persisted
+        if not old or not records or records[0] is not old[0]:
+            return {"reset": messages_to_data(records)}
+
+        # 当前第一条非系统消息在上次记录中的位置，之前的消息已被截断
+        start = len(old)
+        if len(records) > 1:
+            for i in range(1, len(old)):
+                if old[i] is records[1]:
+                    start = i
+                    break
+        kept = len(old) - start
+        if any(a is not b for a, b in zip(old[start:], records[1:1 + kept])) or len(records) < 1 + kept:
+            return {"reset": messages_to_data(records)}
+        appended = records[1 + kept:]
+        persisted_ids = {id(m) for m in old}
+        if any(id(m) in persisted_ids for m in appended):
+            return {"reset": messages_to_data(records)}
+
+        drop = start - 1
+        if drop == 0 and not appended:
+            return None
+        return {"drop": drop, "append": messages_to_data(appended)}
+
+async def load_messages_from_file(group_id: int, filename: str = "rosmontis_chat.json") -> List[StoredMessage]:
+    """从用户目录下的隐藏文件夹加载群组的快照和日志，恢复消息历史"""
+    return await HistoryJournal(group_id, filename=filename).load()
+
+def delete_messages_file(group_id: int, filename: str = "rosmontis_chat.json") -> bool:
+    """删除指定群组的聊天记录快照和日志
 
-def delete_messages_file(group_id: Optional[int] = None, filename: str = "rosmontis_chat.json"):
-    """删除指定群组的消息历史文件
-    
     Args:
         group_id: 群号,用于区分不同群组的聊天记录
-        filename: 基础文件名,如果提供了群号会自动加上群号后缀
-    
+        filename: 基础文件名,会自动加上群号后缀
+
     Returns:
         bool: 删除成功返回 True,文件不存在或删除失败返回 False
     """
     try:
-        # 获取隐藏文件夹路径
-        user_home = Path.home()
-        hidden_dir = user_home / ".rmts_chat"
-        
-        # 根据群号生成文件名
-        if group_id:
-            base_name = filename.rsplit('.', 1)[0] if '.' in filename else filename
-            extension = filename.rsplit('.', 1)[1] if '.' in filename else 'json'
-            filename = f"{base_name}_group_{group_id}.{extension}"
-        
-        filepath = hidden_dir / filename
-        
-        if not filepath.exists():
-            logger.warning(f"文件 {filepath} 不存在,无需删除")
+        if not HistoryJournal(group_id, filename=filename).delete():
+            logger.warning(f"群组 {group_id} 的聊天记录不存在,无需删除")
             return False
-        
-        filepath.unlink()
-        logger.success(f"消息历史已删除: {filepath}")
+        logger.success(f"群组 {group_id} 的消息历史已删除")
         return True
     except Exception as e:
         logger.error(f"删除消息历史失败: {e}")
@@ -0,0 +1,29 @@
+"""
+用户消息格式相关的工具函数
+用户消息形如：博士（TA的名字是：xx，TA的ID是xx），发送了图片：xx，对你说：xx
+"""
+
+# 用户消息中，博士说的话之前的分隔标记
+USER_TEXT_MARKER = "，对你说："
+# 用户消息中，图片信息的标记
+USER_IMAGE_MARKER = "，发送了图片："
+
+def extract_user_text(user_message: str) -> str:
+    """
+    提取用户消息中博士说的话，戳一戳等没有对话内容的消息原样返回
+    """
+    if USER_TEXT_MARKER not in user_message:
+        return user_message
+    return user_message.split(USER_TEXT_MARKER, 1)[1]
+
+def has_user_text(user_message: str) -> bool:
+    """
+    判断用户消息是否包含博士说的话（戳一戳等事件消息不包含）
+    """
+    return USER_TEXT_MARKER in user_message
+
+def has_user_image(user_message: str) -> bool:
+    """
+    判断用户消息是否附带了图片
+    """
+    return USER_IMAGE_MARKER in user_message.split(USER_TEXT_MARKER, 1)[0]
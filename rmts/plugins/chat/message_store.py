@@ -0,0 +1,237 @@
+"""
+紧凑的消息存储
+Model 常驻内存的历史消息使用带 __slots__ 的记录保存，角色、函数名和发言博士的身份前缀使用驻留字符串，
+只在构建请求时才转换为 OpenAI 的消息参数字典；
+登记过的系统提示所有群组共享同一个字符串，保存聊天记录时只保存它的内容哈希
+"""
+
+import re
+import sys
+import hashlib
+
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union, overload
+
+from openai.types.chat import ChatCompletionMessageParam
+
+from .prompt import prompt as default_prompt
+
+# 用户消息开头的博士身份前缀，形如：博士（TA的名字是：xx，TA的ID是xx）
+SPEAKER_PATTERN = re.compile(r"^博士（TA的名字是：.*?，TA的ID是\d+）")
+
+# 内容哈希 -> 登记过的系统提示
+_prompts: Dict[str, str] = {}
+# 登记过的系统提示 -> 内容哈希
+_prompt_refs: Dict[str, str] = {}
+
+def intern_prompt(prompt: str) -> str:
+    """
+    登记系统提示，返回所有群组共享的字符串，内容相同的系统提示只保留一份
+    """
+    ref = _prompt_refs.get(prompt)
+    if ref is not None:
+        return _prompts[ref]
+    ref = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+    _prompts[ref] = prompt
+    _prompt_refs[prompt] = ref
+    return prompt
+
+def prompt_ref(prompt: Optional[str]) -> Optional[str]:
+    """
+    获取登记过的系统提示的内容哈希，未登记时返回 None
+    """
+    return _prompt_refs.get(prompt) if prompt is not None else None
+
+def resolve_prompt(ref: str) -> Optional[str]:
+    """
+    获取内容哈希对应的系统提示，本次运行没有登记过（如系统提示已修改）时返回 None
+    """
+    return _prompts.get(ref)
+
+intern_prompt(default_prompt)
+
+class StoredToolCall:
+    """
+    紧凑存储的函数调用
+    """
+
+    __slots__ = ("id", "name", "arguments")
+
+    def __init__(self, id: str, name: str, arguments: str) -> None:
+        self.id = id
+        self.name = sys.intern(name)
+        self.arguments = arguments
+
+    def to_param(self) -> dict:
+        """转换为 OpenAI 的函数调用参数字典"""
+        return {
+            "id": self.id,
+            "type": "function",
+            "function": {
+                "name": self.name,
+                "arguments": self.arguments
+            }
+        }
+
+class StoredMessage:
+    """
+    紧凑存储的单条消息，记录创建后不会被修改，可以在多个 MessageStore 之间共享
+    说明：
+        支持 msg["role"]、msg.get("content")、"tool_calls" in msg 等只读的字典式访问，
+        以便截断、保存等逻辑可以同时处理消息参数字典和消息记录
+    """
+
+    __slots__ = ("role", "speaker", "content", "tool_call_id", "tool_calls")
+
+    def __init__(self,
+                 role: str,
+                 content: Optional[str],
+                 *,
+                 tool_call_id: Optional[str] = None,
+                 tool_calls: Tuple[StoredToolCall, ...] = ()
+    ) -> None:
+        """
+        参数：
+            role: 消息角色
+            content: 消息内容
+            tool_call_id: tool 消息对应的函数调用 ID
+            tool_calls: assistant 消息中的函数调用
+        """
+        self.role = sys.intern(role)
+        self.speaker: Optional[str] = None  # 用户消息的博士身份前缀，同一位博士的消息共享同一个字符串
+        self.content = content
+        if role == "system" and content is not None:
+            ref = _prompt_refs.get(content)
+            if ref is not None:
+                self.content = _prompts[ref]  # 使用共享的系统提示，不保留加载时读取的副本
+        self.tool_call_id = tool_call_id
+        self.tool_calls = tool_calls
+
+        if role == "user" and content:
+            match = SPEAKER_PATTERN.match(content)
+            if match:
+                self.speaker = sys.intern(match.group(0))
+                self.content = content[match.end():]
+
+    @classmethod
+    def from_param(cls, param: Any) -> "StoredMessage":
+        """从 OpenAI 的消息参数字典创建消息记录"""
+        if isinstance(param, StoredMessage):
+            return param
+        tool_calls = tuple(
+            StoredToolCall(tc["id"], tc["function"]["name"], tc["function"]["arguments"])
+            for tc in param.get("tool_calls") or []
+        )
+        return cls(param["role"],
+                   param.get("content"),
+                   tool_call_id=param.get("tool_call_id"),
+                   tool_calls=tool_calls)
+
+    def get_content(self) -> Optional[str]:
+        """获取完整的消息内容"""
+        if self.speaker is None:
+            return self.content
+        return self.speaker + (self.content or "")
+
+    def to_param(self) -> ChatCompletionMessageParam:
+        """转换为 OpenAI 的消息参数字典"""
+        param: dict = {"role": self.role, "content": self.get_content()}
+        if self.tool_calls:
+            param["tool_calls"] = [tc.to_param() for tc in self.tool_calls]
+        if self.tool_call_id is not None:
+            param["tool_call_id"] = self.tool_call_id
+        return param  # type: ignore
+
+    def __getitem__(self, key: str) -> Any:
+        if key == "role":
+            return self.role
+        if key == "content":
+            return self.get_content()
+        if key == "tool_calls" and self.tool_calls:
+            return [tc.to_param() for tc in self.tool_calls]
+        if key == "tool_call_id" and self.tool_call_id is not None:
+            return self.tool_call_id
+        raise KeyError(key)
+
+    def __contains__(self, key: object) -> bool:
+        try:
+            self[key]  # type: ignore
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+class MessageStore:
+    """
+    消息记录列表，方法：
+        append/extend: 添加消息参数字典或消息记录
+        replace: 替换全部消息记录
+        to_params: 转换为 OpenAI 的消息参数字典列表，构建请求时调用
+    说明：
+        下标访问和迭代返回的是消息记录（StoredMessage），不是参数字典
+    """
+
+    __slots__ = ("records",)
+
+    def __init__(self, messages: Iterable[Any] = ()) -> None:
+        self.records: List[StoredMessage] = [StoredMessage.from_param(msg) for msg in messages]
+
+    def append(self, message: Any) -> None:
+        self.records.append(StoredMessage.from_param(message))
+
+    def extend(self, messages: Iterable[Any]) -> None:
+        self.records.extend(StoredMessage.from_param(msg) for msg in messages)
+
+    def replace(self, messages: Iterable[Any]) -> None:
+        self.records = [StoredMessage.from_param(msg) for msg in messages]
+
+    def clear(self) -> None:
+        self.records.clear()
+
+    def to_params(self) -> List[ChatCompletionMessageParam]:
+        return [record.to_param() for record in self.records]
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __iter__(self) -> Iterator[StoredMessage]:
+        return iter(self.records)
+
+    @overload
+    def __getitem__(self, index: int) -> StoredMessage: ...
+    @overload
+    def __getitem__(self, index: slice) -> List[StoredMessage]: ...
+    def __getitem__(self, index: Union[int, slice]) -> Union[StoredMessage, List[StoredMessage]]:
+        return self.records[index]
+
+    def __delitem__(self, index: Union[int, slice]) -> None:
+        del self.records[index]
+
+def measure_memory(obj: Any) -> int:
+    """
+    估算对象及其引用的所有对象占用的内存（字节），每个对象只计算一次
+    说明：
+        用于比较不同消息表示方式的内存占用，驻留字符串被多个消息共享时也只计算一次
+    """
+    seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        current = stack.pop()
+        if id(current) in seen:
+            continue
+        seen.add(id(current))
+        total += sys.getsizeof(current)
+
+        if isinstance(current, dict):
+            stack.extend(current.keys())
+            stack.extend(current.values())
+        elif isinstance(current, (list, tuple, set)):
+            stack.extend(current)
+        elif hasattr(current, "__slots__"):
+            stack.extend(getattr(current, slot) for slot in current.__slots__ if hasattr(current, slot))
+    return total
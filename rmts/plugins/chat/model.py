@@ -1,5 +1,8 @@
 import json
+import time
+import asyncio
 
+from dataclasses import dataclass
 from openai import AsyncOpenAI
 from openai.types.chat import ChatCompletionSystemMessageParam
 from openai.types.chat import ChatCompletionUserMessageParam
@@ -9,11 +12,85 @@ from openai.types.chat import ChatCompletionMessageFunctionToolCall
 
 from nonebot.log import logger
 
-from typing import List, Union, Optional
+from typing import Dict, Literal, Optional
 
 from .prompt import prompt
 from .function_calling import FunctionCalling
-from .history import save_messages_to_file, load_messages_from_file
+from .message_store import MessageStore, StoredMessage, intern_prompt
+from .arguments import ArgumentError
+from .validation import ValidationError
+from .usage import UsageLedger, CHAT_FUNCTION
+from .history import HistoryJournal
+from .archive import HistoryArchive
+from rmts.utils.tokens import estimate_request_tokens
+from rmts.utils.quota_limiter import QuotaLimiter
+
+@dataclass
+class TurnStats:
+    """
+    一轮对话的统计信息
+    """
+    latency: float = 0.0         # 耗时，单位秒
+    rounds: int = 0              # LLM 请求次数
+    tool_calls: int = 0          # 函数调用次数
+    prompt_tokens: int = 0       # 输入 token 数
+    completion_tokens: int = 0   # 输出 token 数
+    response_length: int = 0     # 最终回复的字符数
+    forced_final: bool = False   # 是否因为时间不足被要求直接回答
+    context_length: int = 0      # 自动注入的背景信息字符数，0 表示没有注入
+
+# 历史消息截断策略
+#   sliding: 每次超过限制时只删除超出的部分，上下文最长，但每轮请求的前缀都会变化
+#   batch: 超过限制时一次删除到限制的一半，之后若干轮请求的前缀保持不变，便于命中缓存
+TruncationPolicy = Literal["sliding", "batch"]
+# 历史消息压缩策略
+#   none: 不压缩
+#   tool_results: 构建请求时，将之前几轮对话中较长的函数返回结果截短
+CompactionPolicy = Literal["none", "tool_results"]
+
+# tool_results 压缩策略保留的函数返回结果长度
+COMPACT_TOOL_RESULT_LENGTH = 60
+
+# 为最后一次直接回答的请求预留的时间，单位秒
+FINAL_ANSWER_RESERVE = 8.0
+# 时间不足时附加在请求末尾的提示，不会写入历史记录
+FINAL_ANSWER_HINT = "本轮对话的时间快用完了，不能再调用函数，请根据已有的信息直接回答博士"
+
+class EmptyReplyError(Exception):
+    """
+    要求直接回答时模型仍然没有给出文字回复（部分服务商会忽略 tool_choice="none" 继续发起函数调用）
+    """
+
+def trim_messages(messages: list, max_history: int, policy: TruncationPolicy = "sliding") -> list:
+    """
+    如果历史消息长度超过限制（不包括系统提示），返回删除最旧消息后的新列表，否则原样返回
+    """
+    if len(messages) <= max_history + 1:
+        return messages
+    keep = max_history if policy == "sliding" else max(max_history // 2, 1)
+    # 保留系统提示（第一条）和最新的 keep 条消息
+    messages = [messages[0]] + messages[-keep:]
+    # 确保 tool call 和 tool response 同时被删除
+    # 删除所有开头的孤立 tool 消息（可能有多个连续的 tool response）
+    while len(messages) > 1 and messages[1].get("role") == "tool":
+        messages.pop(1)
+    return messages
+
+def compact_tool_results(messages: list, end: int) -> list:
+    """
+    返回将 messages[:end] 中较长的函数返回结果截短后的新列表，不修改原列表
+    """
+    compacted = list(messages)
+    for i in range(min(end, len(compacted))):
+        msg = compacted[i]
+        content = msg.get("content")
+        if msg["role"] == "tool" and isinstance(content, str) and len(content) > COMPACT_TOOL_RESULT_LENGTH:
+            compacted[i] = ChatCompletionToolMessageParam(
+                role="tool",
+                tool_call_id=msg["tool_call_id"],
+                content=content[:COMPACT_TOOL_RESULT_LENGTH] + "…（已省略）"
+            )
+    return compacted
 
 class Model:
     """
@@ -23,6 +100,7 @@ class Model:
         save_messages: 保存消息历史
         load_messages: 加载消息历史
         clear_history: 清除消息历史
+        record_fallback: 记录兜底回复
     说明：
         在调用 chat 方法前，需先调用 init_model 方法初始化模型
     """
@@ -38,7 +116,10 @@ class Model:
                  max_history: int = 10,
                  temperature: float = 1.5,
                  max_function_calls: int = 10,
-                 max_tokens: int = 256
+                 max_tokens: int = 256,
+                 truncation: TruncationPolicy = "sliding",
+                 compaction: CompactionPolicy = "none",
+                 turn_budget: Optional[float] = None
     ) -> None:
         """
         参数：
@@ -52,6 +133,12 @@ class Model:
             temperature: 温度参数，控制输出随机性
             max_function_calls: 最大函数调用次数，防止无限循环
             max_tokens: 模型输出的最大 token 数量限制
+            truncation: 历史消息截断策略，见 TruncationPolicy
+            compaction: 历史消息压缩策略，见 CompactionPolicy
+            turn_budget: 每轮对话的时间预算，单位秒，为 None 时不限制
+        说明：
+            设置了 turn_budget 时，每次请求和函数调用只能使用预算中除去 FINAL_ANSWER_RESERVE 的部分，
+            剩余时间不足时禁止函数调用并要求模型直接回答，一轮对话最长耗时为 turn_budget + FINAL_ANSWER_RESERVE
         """
 
         self.client: AsyncOpenAI
@@ -60,21 +147,39 @@ class Model:
         self.key = key
         self.base_url = base_url
         self.model = model
-        self.prompt = prompt
+        # 所有使用相同系统提示的群组共享同一个字符串，保存聊天记录时只保存内容哈希
+        self.prompt = intern_prompt(prompt)
         self.max_history = max_history
         self.temperature = temperature
         self.max_function_calls = max_function_calls
         self.max_tokens = max_tokens
-        self.messages: List[Union[ChatCompletionSystemMessageParam,
-                                  ChatCompletionUserMessageParam,
-                                  ChatCompletionAssistantMessageParam,
-                                  ChatCompletionToolMessageParam]] = []
+        self.truncation: TruncationPolicy = truncation
+        self.compaction: CompactionPolicy = compaction
+        self.turn_budget = turn_budget
+        # 历史消息以紧凑的记录保存，构建请求时才转换为消息参数字典
+        self.messages = MessageStore()
+        # 当前未完成的一轮对话中，用户消息在历史记录中的下标
+        self._turn_index: Optional[int] = None
+        # 当前一轮对话自动注入的背景信息，只出现在本轮的请求中，不写入历史记录
+        self._turn_context: Optional[str] = None
+        # 最近一轮对话的统计信息
+        self.last_turn_stats = TurnStats()
+        # 聊天记录的快照和日志
+        self.journal = HistoryJournal(group_id)
+        # 服务商配额限流器，为 None 时不限流
+        self.quota_limiter: Optional[QuotaLimiter] = None
+        # token 用量账本，为 None 时不记录
+        self.usage_ledger: Optional[UsageLedger] = None
+        # 被截断的历史消息的归档，为 None 时不归档
+        self.archive: Optional[HistoryArchive] = None
 
-    async def init_model(self) -> None:
+    async def init_model(self, client: Optional[AsyncOpenAI] = None) -> None:
         """
         初始化 OpneAI 客户端，加载历史消息
+        参数：
+            client: 共享的客户端，为 None 时创建新的客户端（创建客户端需要数十毫秒，会阻塞事件循环）
         """
-        self.client = AsyncOpenAI(
+        self.client = client or AsyncOpenAI(
             api_key=self.key,
             base_url=self.base_url
         )
@@ -85,36 +190,66 @@ class Model:
             # 初始化历史消息列表，包含系统提示
             self.messages.append(ChatCompletionSystemMessageParam(content=self.prompt, role="system"))
         else:
-            self.messages = messages
+            self.messages.replace(messages)
+            self.journal.persisted = list(self.messages.records)
+            # 系统提示已修改或文件保存的是完整的系统提示时，立即写入新的快照
+            if self._upgrade_prompt() or self.journal.inline_prompt:
+                await self.journal.compact(self.messages.records)
 
-    async def chat(self, user_message: str) -> Optional[str]:
+    async def chat(self, user_message: str, context: Optional[str] = None) -> Optional[str]:
         """
         LLM 聊天接口
+        参数：
+            user_message: 用户消息
+            context: 自动注入的背景信息（见 context.py），放在本轮用户消息之前，不写入历史记录
         """
 
+        # 上一轮对话被中断且没有记录兜底回复，回滚未完成的对话，避免留下没有响应的 tool call
+        if self._turn_index is not None:
+            logger.warning(f"[群:{self.group_id}] 回滚未完成的对话")
+            del self.messages[self._turn_index:]
+            self._turn_index = None
+
         # 添加用户消息到历史记录
         self.messages.append(ChatCompletionUserMessageParam(content=user_message, role="user"))
-        # 如果历史消息长度超过限制（不包括系统提示），删除最旧的消息
-        if len(self.messages) > self.max_history + 1:
-            # 保留系统提示（第一条）和最新的 max_history 条消息
-            self.messages = [self.messages[0]] + self.messages[-(self.max_history):]
-            # 确保 tool call 和 tool response 同时被删除
-            # 删除所有开头的孤立 tool 消息（可能有多个连续的 tool response）
-            while len(self.messages) > 1 and self.messages[1].get("role") == "tool":
-                self.messages.pop(1)
+        self._trim_history()
+        self._turn_index = len(self.messages) - 1
+        self._turn_context = context
 
         # 函数调用计数器
         function_call_count = 0
+        # 本轮对话统计
+        stats = TurnStats(context_length=len(context or ""))
+        self.last_turn_stats = stats
+        start_time = time.perf_counter()
+        deadline = None if self.turn_budget is None else time.monotonic() + self.turn_budget
         
         # 循环处理，直到获得普通消息响应
         while True:
-            # 发起请求
-            response = await self._create_chat_completion()
+            # 剩余时间不足时要求模型直接回答
+            if deadline is not None and not stats.forced_final and self._remaining(deadline) <= 0:
+                logger.warning(f"[群:{self.group_id}] 本轮对话剩余时间不足，要求模型直接回答")
+                stats.forced_final = True
+
+            # 发起请求，直接回答的请求使用预留时间，其他请求使用除去预留时间的剩余时间
+            try:
+                async with asyncio.timeout(None if deadline is None else
+                                           FINAL_ANSWER_RESERVE if stats.forced_final else self._remaining(deadline)):
+                    response = await self._create_chat_completion(force_final=stats.forced_final)
+            except TimeoutError:
+                if deadline is None or stats.forced_final:
+                    raise
+                continue
+            stats.rounds += 1
+            if response.usage:
+                stats.prompt_tokens += response.usage.prompt_tokens
+                stats.completion_tokens += response.usage.completion_tokens
+            stats.latency = time.perf_counter() - start_time
             # 获取响应内容
             response_message = response.choices[0].message
 
-            # 检查是否有工具调用
-            if response_message.tool_calls:
+            # 检查是否有工具调用，要求直接回答时忽略模型仍然发起的函数调用
+            if response_message.tool_calls and not stats.forced_final:
                 # 增加函数调用计数
                 function_call_count += 1
                 
@@ -127,10 +262,30 @@ class Model:
                         content=error_msg,
                         role="assistant"
                     ))
+                    self._turn_index = None
                     return error_msg
                 
-                # 将带工具调用的助手消息添加到历史
-                self._add_assistant_message_with_tool_calls(response_message)
+                # 解析所有函数调用的参数，格式错误的参数在本地修复，不符合函数声明的参数不调用函数
+                arguments: Dict[str, dict] = {}  # tool_call_id -> 参数，无法修复或不符合声明时不存在
+                repaired: Dict[str, str] = {}    # tool_call_id -> 修复后的参数 JSON
+                invalid: Dict[str, str] = {}     # tool_call_id -> 返回给模型的参数错误信息
+                for tool_call in response_message.tool_calls:
+                    if not isinstance(tool_call, ChatCompletionMessageFunctionToolCall):
+                        continue
+                    try:
+                        args_dict, changed = self.fc.parse_arguments(tool_call.function.name, tool_call.function.arguments)
+                    except ValidationError as e:
+                        invalid[tool_call.id] = str(e)
+                        continue
+                    except ArgumentError:
+                        continue
+                    arguments[tool_call.id] = args_dict
+                    if changed:
+                        repaired[tool_call.id] = json.dumps(args_dict, ensure_ascii=False)
+
+                # 将带工具调用的助手消息添加到历史，历史中记录修复后的参数
+                self._add_assistant_message_with_tool_calls(response_message, repaired)
+                stats.tool_calls += len(response_message.tool_calls)
                 
                 # 执行所有函数调用
                 for tool_call in response_message.tool_calls:
@@ -140,11 +295,13 @@ class Model:
                     function_name = tool_call.function.name
                     function_args = tool_call.function.arguments
 
-                    try:
-                        args_dict = json.loads(function_args)
-                        # 调用函数并获取结果
-                        function_response = await self.fc.call(function_name, args_dict)
-                    except json.JSONDecodeError:
+                    if tool_call.id in arguments:
+                        # 调用函数并获取结果，函数调用不能超过本轮剩余的时间
+                        timeout = None if deadline is None else self._remaining(deadline)
+                        function_response = await self.fc.call(function_name, arguments[tool_call.id], timeout)
+                    elif tool_call.id in invalid:
+                        function_response = invalid[tool_call.id]
+                    else:
                         function_response = f"函数参数解析错误: {function_args}"
 
                     # 添加工具返回结果
@@ -155,37 +312,140 @@ class Model:
                     ))
                 # 继续循环，再次调用 API
             else:
+                # 要求直接回答时没有文字回复，不写入历史，由调用方使用兜底回复
+                if stats.forced_final and not response_message.content:
+                    raise EmptyReplyError("要求直接回答时模型没有给出回复")
                 # 没有工具调用，将普通助手响应添加到历史记录并返回
                 self.messages.append(ChatCompletionAssistantMessageParam(content=response_message.content, role="assistant"))
+                self._turn_index = None
+                stats.response_length = len(response_message.content or "")
                 return response_message.content
     
     async def save_messages(self):
-        """保存当前会话的消息历史"""
-        return await save_messages_to_file(self.messages, self.group_id)
+        """将被截断的历史消息追加到归档，将当前会话的消息历史自上次保存以来的变化追加到日志"""
+        if self.archive is not None:
+            await self.archive.flush()
+        return await self.journal.record(self.messages.records)
     
     async def load_messages(self):
-        """加载消息历史到当前会话"""
-        return await load_messages_from_file(self.group_id)
+        """从快照和日志加载消息历史"""
+        return await self.journal.load()
     
+    def _upgrade_prompt(self) -> bool:
+        """
+        将加载的历史消息中的系统提示替换为当前的系统提示，返回是否进行了替换
+        """
+        first = self.messages[0] if len(self.messages) else None
+        if first is not None and first.role == "system" and first.content is self.prompt:
+            return False
+        logger.info(f"[群:{self.group_id}] 聊天记录中的系统提示不是当前版本，已更新")
+        if first is not None and first.role == "system":
+            self.messages.records[0] = StoredMessage("system", self.prompt)
+        else:
+            self.messages.records.insert(0, StoredMessage("system", self.prompt))
+        return True
+
     def clear_history(self):
         """清除当前会话的消息历史，保留系统提示"""
         self.messages.clear()
         self.messages.append(ChatCompletionSystemMessageParam(content=self.prompt, role="system"))
+        self._turn_index = None
+
+    def record_fallback(self, user_message: str, reply: str) -> None:
+        """
+        将兜底回复记录到历史中，保持历史记录的连贯性
+        参数：
+            user_message: 触发兜底回复的用户消息
+            reply: 兜底回复内容
+        说明：
+            如果本轮对话已经开始，则丢弃本轮未完成的函数调用，只保留用户消息和兜底回复
+            否则将用户消息和兜底回复一起追加到历史记录末尾
+        """
+        if self._turn_index is not None:
+            del self.messages[self._turn_index + 1:]
+            self._turn_index = None
+        else:
+            self.messages.append(ChatCompletionUserMessageParam(content=user_message, role="user"))
+            self._trim_history()
+        self.messages.append(ChatCompletionAssistantMessageParam(content=reply, role="assistant"))
+
+    def _trim_history(self) -> None:
+        """如果历史消息长度超过限制（不包括系统提示），删除最旧的消息，设置了归档时将删除的消息加入归档"""
+        trimmed = trim_messages(self.messages.records, self.max_history, self.truncation)
+        if trimmed is not self.messages.records:
+            if self.archive is not None:
+                kept = {id(msg) for msg in trimmed}
+                evicted = [msg for msg in self.messages.records[1:] if id(msg) not in kept]
+                # 截断可能发生在一轮对话中间，保留的历史消息开头属于该轮对话的回复也一起归档
+                for msg in trimmed[1:]:
+                    if msg["role"] == "user":
+                        break
+                    evicted.append(msg)
+                self.archive.add(evicted)
+            self.messages.replace(trimmed)
     
-    async def _create_chat_completion(self):
-        """创建聊天完成请求"""
-        return await self.client.chat.completions.create(
+    @staticmethod
+    def _remaining(deadline: float) -> float:
+        """本轮对话除去直接回答预留时间后的剩余时间"""
+        return deadline - time.monotonic() - FINAL_ANSWER_RESERVE
+
+    async def _create_chat_completion(self, force_final: bool = False):
+        """
+        创建聊天完成请求
+        说明：
+            设置了 quota_limiter 时，先按估算的输入 token 数加上 max_tokens 预留配额（配额不足时排队），
+            请求完成后用实际用量修正；请求出错时保留预留，按估算的用量计入配额
+            设置了 usage_ledger 时，将实际用量记录到用量账本
+        """
+        request = self._build_request(force_final)
+        reservation = None
+        if self.quota_limiter is not None:
+            estimated = estimate_request_tokens(request["messages"], request["tools"]) + self.max_tokens
+            reservation = await self.quota_limiter.acquire(estimated)
+
+        response = await self.client.chat.completions.create(**request)
+        if response.usage:
+            if reservation is not None and self.quota_limiter is not None:
+                self.quota_limiter.settle(reservation, response.usage.total_tokens)
+            if self.usage_ledger is not None:
+                self.usage_ledger.record(self.group_id, self.fc.injection_params.get("user_id", 0), self.model,
+                                         CHAT_FUNCTION, response.usage.prompt_tokens, response.usage.completion_tokens)
+        return response
+
+    def _build_request(self, force_final: bool = False) -> dict:
+        """
+        构建聊天完成请求的参数
+        参数：
+            force_final: 是否禁止函数调用并要求模型直接回答
+        """
+        messages = self.messages.to_params()
+        if self.compaction == "tool_results" and self._turn_index is not None:
+            # 只压缩之前几轮对话的函数返回结果，本轮的结果保持完整
+            messages = compact_tool_results(messages, self._turn_index)
+        if self._turn_context and self._turn_index is not None:
+            # 背景信息放在本轮用户消息之前，之前对话的前缀保持不变
+            messages.insert(self._turn_index, ChatCompletionSystemMessageParam(content=self._turn_context, role="system"))
+        if force_final:
+            messages.append(ChatCompletionSystemMessageParam(content=FINAL_ANSWER_HINT, role="system"))
+
+        return dict(
             model=self.model,
-            messages=self.messages,
+            messages=messages,
             temperature=self.temperature,
             max_tokens=self.max_tokens,
             tools=self.fc.to_schemas(),
-            tool_choice="auto",
+            tool_choice="none" if force_final else "auto",
             stream=False
         )
     
-    def _add_assistant_message_with_tool_calls(self, response_message) -> None:
-        """将带有工具调用的助手消息添加到历史记录"""
+    def _add_assistant_message_with_tool_calls(self, response_message, repaired: Optional[Dict[str, str]] = None) -> None:
+        """
+        将带有工具调用的助手消息添加到历史记录
+        参数：
+            response_message: 模型的回复消息
+            repaired: tool_call_id -> 修复后的参数 JSON，这些函数调用在历史中使用修复后的参数
+        """
+        repaired = repaired or {}
         self.messages.append(ChatCompletionAssistantMessageParam(
             role="assistant",
             content=response_message.content,
@@ -195,7 +455,7 @@ class Model:
                     "type": "function",
                     "function": {
                         "name": tool_call.function.name,
-                        "arguments": tool_call.function.arguments
+                        "arguments": repaired.get(tool_call.id, tool_call.function.arguments)
                     }
                 }
                 for tool_call in response_message.tool_calls
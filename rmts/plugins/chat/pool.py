@@ -1,11 +1,25 @@
+import time
 import asyncio
 from typing import Optional
+from openai import AsyncOpenAI
 from nonebot import get_driver
+from nonebot.log import logger
 
 from .model import Model
+from .config import Config
+from .shadow import ShadowEvaluator
+from .fallback import FallbackResponder
+from .prefetch import ToolPrefetcher, PrefetchStats
+from .selector import ToolSelector, SelectionStats
+from .arguments import ArgumentStats
 from .function_calling import FunctionContainer
 from .function_calling import FunctionCalling
-from .history import delete_messages_file
+from .history import HistoryJournal, delete_messages_file
+from .usage import usage_ledger
+from .archive import history_archives
+from .warmup import ActiveGroups, WarmupStats, LoopLagMonitor
+from .context import ContextStats
+from rmts.utils.quota_limiter import QuotaLimiter
 
 class ModelPool:
     """
@@ -20,65 +34,312 @@ class ModelPool:
 
         self.function_container = function_container
         self.pool: dict[int, Model] = {}
+        self.client: Optional[AsyncOpenAI] = None  # 所有群组共享的客户端
+        self.client_lock = asyncio.Lock()
         self.locks: dict[int, asyncio.Lock] = {}  # 每个群组一个锁
         self.key = get_driver().config.api_key
         self.base_url = get_driver().config.base_url
         self.model = get_driver().config.model_name
         self.max_history_length = get_driver().config.max_history_length
 
+        plugin_config = Config(**get_driver().config.model_dump())
+        self.chat_timeout = plugin_config.chat_timeout
+        self.chat_turn_budget = plugin_config.chat_turn_budget
+        self.history_truncation = plugin_config.history_truncation
+        self.history_compaction = plugin_config.history_compaction
+        self.history_compression = plugin_config.history_compression
+        # 启动时预加载最近活跃的群组的历史记录
+        self.history_preload_groups = plugin_config.history_preload_groups
+        # 被截断的对话的归档，search_chat_history 函数通过同一个 history_archives 检索
+        self.history_archives = history_archives
+        self.history_archives.max_turns = plugin_config.history_archive_turns
+        self.active_groups = ActiveGroups()
+        self.warmup_stats = WarmupStats()
+        self.loop_monitor = LoopLagMonitor()
+        self.tool_prefetch = plugin_config.tool_prefetch
+        self.prefetch_stats = PrefetchStats()
+        self.tool_selection = plugin_config.tool_selection
+        self.selection_stats = SelectionStats()
+        # 第一次请求前自动注入相关的记忆等背景信息
+        self.context_injection = plugin_config.context_injection
+        self.context_stats = ContextStats()
+        self.argument_stats = ArgumentStats()
+        self.fallback = FallbackResponder()
+        # token 用量账本和群组每天的 token 配额
+        self.usage_ledger = usage_ledger
+        self.usage_ledger.retention_days = plugin_config.usage_retention_days
+        self.group_daily_token_quota = plugin_config.group_daily_token_quota
+        self.group_token_quotas = plugin_config.group_token_quotas
+        # 所有群组共享的服务商配额限流器，没有配置配额时不限流
+        self.quota_limiter: Optional[QuotaLimiter] = None
+        if plugin_config.llm_requests_per_minute or plugin_config.llm_tokens_per_minute:
+            self.quota_limiter = QuotaLimiter(requests_per_minute=plugin_config.llm_requests_per_minute,
+                                              tokens_per_minute=plugin_config.llm_tokens_per_minute)
+        # 尚未写入历史记录的兜底回复，群号 -> [(用户消息, 兜底回复)]
+        self.pending_fallbacks: dict[int, list[tuple[str, str]]] = {}
+        # 影子模式，在后台评估候选模型
+        self.shadow = ShadowEvaluator(function_container=function_container,
+                                      key=plugin_config.shadow_api_key or self.key,
+                                      base_url=plugin_config.shadow_base_url or self.base_url,
+                                      model=plugin_config.shadow_model_name,
+                                      sample_rate=plugin_config.shadow_sample_rate,
+                                      max_history=self.max_history_length,
+                                      truncation=self.history_truncation,
+                                      compaction=self.history_compaction,
+                                      turn_budget=self.chat_turn_budget)
+        if self.shadow.key == self.key and self.shadow.base_url == self.base_url:
+            self.shadow.quota_limiter = self.quota_limiter
+
     async def chat(self, group_id: int, user_id: int, user_message: str) -> Optional[str]:
         """
         llm 聊天接口，确保同一群组的消息顺序处理
-        
+
         参数：
             group_id: 群号
             user_id: 用户 ID
             user_message: 用户发送的消息
+        说明：
+            LLM 调用出错或超过 chat_timeout 时，返回本地兜底回复
+            开启 context_injection 时，第一次请求前在本地检索相关的记忆等背景信息并注入本轮对话的请求
+            群组当天的 token 用量达到配额时，不调用 LLM，直接返回本地兜底回复
         """
-        # 确保该群组有对应的锁
-        if group_id not in self.locks:
-            self.locks[group_id] = asyncio.Lock()
-        
-        # 使用锁确保同一群组的消息顺序处理
-        async with self.locks[group_id]:
-            if group_id not in self.pool: # 懒加载
-                injection_params = {"group_id": group_id} # 注入参数 group_id
-                function_calling = FunctionCalling(self.function_container, injection_params)
-
-                model = Model(group_id=group_id,
-                              fc=function_calling,
-                              key=self.key,
-                              base_url=self.base_url,
-                              model=self.model,
-                              max_history=self.max_history_length)
-                await model.init_model()
-                self.pool[group_id] = model
-            self.pool[group_id].fc.add_injection_param("user_id", user_id)  # 每次调用时注入 user_id
-            return await self.pool[group_id].chat(user_message)
+        if self.over_quota(group_id):
+            logger.warning(f"[群:{group_id}] 今天的 token 用量已达到配额，使用兜底回复")
+            return self.fallback_chat(group_id, user_message)
+
+        owns_turn = False  # 是否已经获得该群组的锁并开始本轮对话
+        cold = group_id not in self.pool  # 本轮对话是否需要加载历史记录
+        start_time = time.perf_counter()
+        self.active_groups.touch(group_id)
+        # 使用锁确保同一群组的消息顺序处理，锁一直持有到保存完本轮的历史记录，chat_timeout 只限制得到回复之前的部分
+        lock = self._get_lock(group_id)
+        try:
+            try:
+                async with asyncio.timeout(self.chat_timeout):
+                    await lock.acquire()
+                    owns_turn = True
+                    model = await self._get_model(group_id)
+                    model.fc.add_injection_param("user_id", user_id)  # 每次调用时注入 user_id
+                    # 影子模式需要本轮对话开始前的历史记录
+                    shadow_messages = list(model.messages) if self.shadow.sample() else None
+                    # 预取与第一次 LLM 请求并行执行
+                    model.fc.begin_turn(user_message)
+                    try:
+                        context = await model.fc.build_context(user_message) if self.context_injection else None
+                        reply = await model.chat(user_message, context)
+                    finally:
+                        model.fc.end_turn()
+            except TimeoutError:
+                logger.warning(f"[群:{group_id}] 对话超过{self.chat_timeout}秒，使用兜底回复")
+                return self._reply_with_fallback(group_id, user_message, owns_turn=owns_turn)
+            except Exception:
+                logger.exception(f"[群:{group_id}] 对话出错，使用兜底回复")
+                return self._reply_with_fallback(group_id, user_message, owns_turn=owns_turn)
+
+            # 已经得到回复并写入了历史记录，之后的操作出错只记录日志，不会改为兜底回复或重复记录本轮对话
+            self.context_stats.record(model.last_turn_stats)
+            try:
+                # 每轮对话后将历史记录的变化追加到日志
+                await model.save_messages()
+            except Exception:
+                logger.exception(f"[群:{group_id}] 保存聊天记录失败，将在下次保存时重试")
+            if shadow_messages is not None:
+                try:
+                    self.shadow.submit(group_id=group_id,
+                                       user_id=user_id,
+                                       messages=shadow_messages,
+                                       user_message=user_message,
+                                       production_model=model.model,
+                                       production=model.last_turn_stats,
+                                       context=context)
+                except Exception:
+                    logger.exception(f"[群:{group_id}] 提交影子模式评估失败")
+            self.warmup_stats.record_turn(cold, time.perf_counter() - start_time)
+            return reply
+        finally:
+            if owns_turn:
+                lock.release()
+
+    def fallback_chat(self, group_id: int, user_message: str) -> str:
+        """
+        直接使用本地兜底回复，用于被限流等不调用 LLM 的情况
+
+        参数：
+            group_id: 群号
+            user_message: 用户发送的消息
+        """
+        return self._reply_with_fallback(group_id, user_message, owns_turn=False)
+
+    def over_quota(self, group_id: int) -> bool:
+        """
+        群组当天的 token 用量是否已达到配额，没有设置配额时返回 False
+        """
+        quota = self.group_token_quotas.get(group_id, self.group_daily_token_quota)
+        return quota > 0 and self.usage_ledger.group_tokens(group_id) >= quota
+
+    async def preload(self) -> None:
+        """
+        启动时并发加载上次关闭前最近活跃的群组的历史记录，在线程中加载用量记录，并开始检测事件循环卡顿
+        说明：
+            加载每个群组时持有该群组的锁，期间收到的消息会等待加载完成
+        """
+        self.loop_monitor.start()
+        # 第一次检查配额前加载用量记录，避免在收到消息时读取整个记录文件
+        await self.usage_ledger.load()
+        if self.history_preload_groups <= 0:
+            return
+        await asyncio.to_thread(self.active_groups.load)
+        group_ids = self.active_groups.recent(self.history_preload_groups)
+        if not group_ids:
+            return
+
+        async def preload_group(group_id: int) -> None:
+            async with self._get_lock(group_id):
+                if group_id not in self.pool:
+                    self.pool[group_id] = await self._create_model(group_id)
+
+        start_time = time.perf_counter()
+        results = await asyncio.gather(*(preload_group(group_id) for group_id in group_ids), return_exceptions=True)
+        for group_id, result in zip(group_ids, results):
+            if isinstance(result, BaseException):
+                logger.warning(f"[群:{group_id}] 预加载历史记录失败: {result}")
+        self.warmup_stats.preloaded = sum(1 for result in results if not isinstance(result, BaseException))
+        self.warmup_stats.preload_time = time.perf_counter() - start_time
+        logger.info(f"已预加载{self.warmup_stats.preloaded}个群组的历史记录，耗时{self.warmup_stats.preload_time * 1000:.0f}毫秒")
 
     async def clear_history(self, group_id: int):
         """
         参数：
             group_id: 群号
         """
-        if group_id not in self.locks:
-            self.locks[group_id] = asyncio.Lock()
-        
-        async with self.locks[group_id]:
+        async with self._get_lock(group_id):
+            self.pending_fallbacks.pop(group_id, None)
             if group_id in self.pool:
-                # Model 已加载,清空内存中的历史记录
+                # Model 已加载,清空内存中的历史记录并立即保存
                 self.pool[group_id].clear_history()
+                await self.pool[group_id].save_messages()
             else:
                 # Model 未加载,直接删除磁盘文件
                 delete_messages_file(group_id)
+            # 清除记忆后较早的对话也不能再被检索到
+            self.history_archives.delete(group_id)
 
     async def save_messages(self):
         """
-        保存所有群组的消息历史
+        保存所有群组的消息历史，每轮对话后已经追加到日志，这里只保存尚未保存的兜底回复等变化
         """
         # 为所有群组的保存操作加锁
         for group_id, model in self.pool.items():
-            if group_id not in self.locks:
-                self.locks[group_id] = asyncio.Lock()
-            async with self.locks[group_id]:
+            async with self._get_lock(group_id):
+                self._flush_fallbacks(group_id, model)
                 await model.save_messages()
+
+    async def close(self):
+        """
+        关闭聊天池，保存最近活跃的群组，输出影子模式对比报告、历史记录加载、事件循环卡顿、背景信息注入、用量、配额限流、预取、函数选择、参数修复、函数缓存和执行器统计，取消未完成的影子请求并关闭函数执行器
+        """
+        await self.loop_monitor.stop()
+        await asyncio.to_thread(self.active_groups.save, max(self.history_preload_groups, 0))
+        logger.info(self.warmup_stats.report())
+        logger.info(self.loop_monitor.report())
+        logger.info(self.context_stats.report())
+        argument_report = self.argument_stats.report()
+        if argument_report:
+            logger.info(argument_report)
+        logger.info(self.usage_ledger.report(days=1))
+        if self.quota_limiter is not None:
+            logger.info(self.quota_limiter.report())
+        if self.tool_prefetch:
+            logger.info(self.prefetch_stats.report())
+        if self.tool_selection:
+            logger.info(self.selection_stats.report())
+        logger.info(self.function_container.result_cache.report())
+        executor_report = self.function_container.executors.report()
+        if executor_report:
+            logger.info(executor_report)
+        if self.shadow.enabled:
+            logger.info(self.shadow.report())
+        await self.shadow.close()
+        self.function_container.executors.shutdown()
+        self.usage_ledger.close()
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+
+    def _get_lock(self, group_id: int) -> asyncio.Lock:
+        """获取群组的锁，不存在时创建"""
+        if group_id not in self.locks:
+            self.locks[group_id] = asyncio.Lock()
+        return self.locks[group_id]
+
+    async def _get_model(self, group_id: int) -> Model:
+        """获取群组的 Model 实例，不存在时懒加载，调用前需持有该群组的锁"""
+        if group_id not in self.pool:
+            start_time = time.perf_counter()
+            self.pool[group_id] = await self._create_model(group_id)
+            self.warmup_stats.record_cold_load(time.perf_counter() - start_time)
+
+        model = self.pool[group_id]
+        self._flush_fallbacks(group_id, model)
+        return model
+
+    async def _create_model(self, group_id: int) -> Model:
+        """创建群组的 Model 实例并加载历史记录，调用前需持有该群组的锁"""
+        injection_params = {"group_id": group_id, "read_only": False} # 注入参数 group_id、read_only
+        function_calling = FunctionCalling(self.function_container, injection_params)
+        function_calling.argument_stats = self.argument_stats
+        if self.tool_prefetch:
+            function_calling.prefetcher = ToolPrefetcher(function_calling, self.prefetch_stats)
+        if self.tool_selection:
+            function_calling.selector = ToolSelector(function_calling, self.selection_stats)
+
+        model = Model(group_id=group_id,
+                      fc=function_calling,
+                      key=self.key,
+                      base_url=self.base_url,
+                      model=self.model,
+                      max_history=self.max_history_length,
+                      truncation=self.history_truncation,
+                      compaction=self.history_compaction,
+                      turn_budget=self.chat_turn_budget)
+        model.journal = HistoryJournal(group_id, compress=self.history_compression)
+        model.quota_limiter = self.quota_limiter
+        model.usage_ledger = self.usage_ledger
+        if self.history_archives.enabled:
+            model.archive = self.history_archives.get(group_id)
+        await model.init_model(await self._get_client())
+        return model
+
+    async def _get_client(self) -> AsyncOpenAI:
+        """获取所有群组共享的客户端，不存在时创建"""
+        async with self.client_lock:
+            if self.client is None:
+                # 创建客户端时加载证书等耗时较长，在线程中创建，避免阻塞事件循环
+                self.client = await asyncio.to_thread(AsyncOpenAI, api_key=self.key, base_url=self.base_url)
+        return self.client
+
+    def _reply_with_fallback(self, group_id: int, user_message: str, *, owns_turn: bool) -> str:
+        """
+        生成兜底回复并记录到历史
+
+        参数：
+            group_id: 群号
+            user_message: 用户发送的消息
+            owns_turn: 本次对话是否已经持有过该群组的锁
+        说明：
+            此方法中没有 await，执行期间其他协程无法修改历史记录
+            如果该群组正在进行其他对话（或 Model 尚未加载），兜底回复会在下次获得锁时写入历史
+        """
+        reply = self.fallback.respond(user_message)
+
+        model = self.pool.get(group_id)
+        if model is not None and (owns_turn or not self._get_lock(group_id).locked()):
+            model.record_fallback(user_message, reply)
+        else:
+            self.pending_fallbacks.setdefault(group_id, []).append((user_message, reply))
+        return reply
+
+    def _flush_fallbacks(self, group_id: int, model: Model) -> None:
+        """将等待中的兜底回复写入历史记录，调用前需持有该群组的锁"""
+        for user_message, reply in self.pending_fallbacks.pop(group_id, []):
+            model.record_fallback(user_message, reply)
@@ -0,0 +1,127 @@
+"""
+函数调用预取
+收到消息时，使用各函数的预取匹配器从博士说的话中识别可能需要的函数调用（干员名、日期、天气地点等），
+与第一次 LLM 请求并行执行，模型以相同的参数发起函数调用时直接使用预取的结果
+"""
+
+import asyncio
+
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+from nonebot.log import logger
+
+from .cache import make_call_key
+from .message import extract_user_text, has_user_text
+
+if TYPE_CHECKING:
+    from .function_calling import FunctionCalling
+
+@dataclass
+class PrefetchCounter:
+    """
+    单个函数的预取统计
+    """
+    started: int = 0  # 启动的预取次数
+    hits: int = 0     # 被模型使用的预取次数
+    wasted: int = 0   # 本轮对话结束时仍未被使用的预取次数
+    misses: int = 0   # 模型调用了支持预取的函数，但没有相同参数的预取
+
+class PrefetchStats:
+    """
+    所有群组共享的预取统计，方法：
+        get: 获取函数的预取统计
+        report: 生成预取统计报告
+    """
+
+    def __init__(self) -> None:
+        self.counters: Dict[str, PrefetchCounter] = {}
+
+    def get(self, name: str) -> PrefetchCounter:
+        if name not in self.counters:
+            self.counters[name] = PrefetchCounter()
+        return self.counters[name]
+
+    def report(self) -> str:
+        """
+        生成预取统计报告
+        """
+        if not self.counters:
+            return "暂无预取记录"
+        lines = ["预取统计："]
+        for name, c in self.counters.items():
+            hit_rate = c.hits / c.started if c.started else 0
+            lines.append(f"{name}: 预取{c.started}次，命中{c.hits}次（{hit_rate:.0%}），浪费{c.wasted}次，未预取{c.misses}次")
+        return "\n".join(lines)
+
+class ToolPrefetcher:
+    """
+    单个聊天上下文的预取器，方法：
+        start: 根据用户消息启动预取
+        take: 取出与函数调用相同的预取任务
+        finish: 取消本轮没有被使用的预取
+    """
+
+    def __init__(self, fc: "FunctionCalling", stats: PrefetchStats, max_prefetch: int = 3) -> None:
+        """
+        参数：
+            fc: 所属的函数调用管理器
+            stats: 预取统计
+            max_prefetch: 每轮对话最多启动的预取数量
+        """
+        self.fc = fc
+        self.stats = stats
+        self.max_prefetch = max_prefetch
+        self.tasks: Dict[str, asyncio.Task] = {}  # 函数调用标识 -> 预取任务
+
+    def start(self, user_message: str) -> None:
+        """
+        根据用户消息启动预取，预取任务在当前协程第一次等待（即发起 LLM 请求）时开始执行
+        """
+        self.finish()
+        if not has_user_text(user_message):
+            return
+        text = extract_user_text(user_message)
+
+        for name, fd in self.fc.function_descriptions.items():
+            if fd.prefetch_matcher is None:
+                continue
+            try:
+                candidates = fd.prefetch_matcher(text, dict(self.fc.injection_params))
+            except Exception:
+                logger.exception(f"函数 {name} 的预取匹配器出错")
+                continue
+
+            for args in candidates:
+                if len(self.tasks) >= self.max_prefetch:
+                    return
+                args = self.fc.inject_params(name, dict(args))
+                key = make_call_key(name, args)
+                if key in self.tasks:
+                    continue
+                logger.debug(f"预取函数 {name}，参数: {args}")
+                self.tasks[key] = asyncio.create_task(self.fc.run(name, dict(args)))
+                self.stats.get(name).started += 1
+
+    def take(self, name: str, args: Dict[str, Any]) -> Optional[asyncio.Task]:
+        """
+        取出与函数调用相同的预取任务，没有时返回 None
+        参数：
+            name: 函数名称
+            args: 已写入注入参数的函数参数
+        """
+        task = self.tasks.pop(make_call_key(name, args), None)
+        if task is not None:
+            self.stats.get(name).hits += 1
+        elif self.fc.function_descriptions[name].prefetch_matcher is not None:
+            self.stats.get(name).misses += 1
+        return task
+
+    def finish(self) -> None:
+        """
+        取消本轮没有被使用的预取
+        """
+        for key, task in self.tasks.items():
+            task.cancel()
+            self.stats.get(key.split(":", 1)[0]).wasted += 1
+        self.tasks.clear()
@@ -0,0 +1,327 @@
+"""
+离线回放评估
+将保存的聊天记录（rosmontis_chat_group_*.json）按轮次重新经过 Model 的请求构建流程，
+由本地桩模型按原记录返回回复和函数调用结果，统计不同历史策略下每次请求的输入 token、请求字节数和可命中缓存的前缀长度
+用法：python replay.py --help
+"""
+
+import csv
+import re
+import json
+import time
+import argparse
+import asyncio
+
+from pathlib import Path
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from openai.types import CompletionUsage
+from openai.types.chat import ChatCompletion, ChatCompletionMessage
+from openai.types.chat import ChatCompletionMessageFunctionToolCall
+from openai.types.chat.chat_completion import Choice
+
+from rmts.utils.tokens import estimate_tokens, estimate_message_tokens
+
+from .model import Model, TruncationPolicy, CompactionPolicy
+from .prompt import prompt as default_prompt
+from .history import HistoryJournal, messages_from_data
+from .arguments import ArgumentError, parse_arguments
+
+@dataclass
+class ReplayStrategy:
+    """
+    回放使用的历史策略
+    """
+    max_history: int
+    truncation: TruncationPolicy = "sliding"
+    compaction: CompactionPolicy = "none"
+
+    @classmethod
+    def parse(cls, spec: str) -> "ReplayStrategy":
+        """
+        从字符串解析策略，格式为 max_history[:truncation[:compaction]]，例如 80、80:batch、40:sliding:tool_results
+        """
+        parts = spec.split(":")
+        strategy = cls(max_history=int(parts[0]))
+        if len(parts) > 1 and parts[1]:
+            if parts[1] not in ("sliding", "batch"):
+                raise ValueError(f"未知的截断策略: {parts[1]}")
+            strategy.truncation = parts[1]  # type: ignore
+        if len(parts) > 2 and parts[2]:
+            if parts[2] not in ("none", "tool_results"):
+                raise ValueError(f"未知的压缩策略: {parts[2]}")
+            strategy.compaction = parts[2]  # type: ignore
+        return strategy
+
+    @property
+    def name(self) -> str:
+        return f"{self.max_history}:{self.truncation}:{self.compaction}"
+
+@dataclass
+class RecordedResponse:
+    """
+    记录中的一次模型回复及其函数调用结果
+    """
+    content: Optional[str]
+    tool_calls: List[Dict[str, Any]] = field(default_factory=list)
+    tool_results: Dict[str, str] = field(default_factory=dict)  # tool_call_id -> 函数返回结果
+
+@dataclass
+class RecordedTurn:
+    """
+    记录中的一轮对话
+    """
+    user_message: str
+    responses: List[RecordedResponse] = field(default_factory=list)
+
+@dataclass
+class RequestMetrics:
+    """
+    一次请求的统计信息
+    """
+    source: str          # 聊天记录文件名
+    turn: int            # 第几轮对话
+    request: int         # 本轮的第几次请求
+    prompt_tokens: int   # 估算的输入 token 数
+    request_bytes: int   # 请求体的字节数
+    cached_tokens: int   # 与上一次请求相同的前缀 token 数（估算的可命中缓存长度）
+
+class ReplayFunctionCalling:
+    """
+    回放使用的函数调用管理器，按记录返回函数调用结果
+    """
+
+    def __init__(self, schemas: list) -> None:
+        self.schemas = schemas
+        self.expected: List[Tuple[str, Any, str]] = []  # (函数名, 参数, 返回结果)
+
+    def expect(self, tool_calls: List[Dict[str, Any]], results: Dict[str, str]) -> None:
+        """设置接下来的函数调用应返回的结果"""
+        self.expected = []
+        for tool_call in tool_calls:
+            function = tool_call["function"]
+            try:
+                args, _ = parse_arguments(function["arguments"])
+            except ArgumentError:
+                continue
+            self.expected.append((function["name"], args, results.get(tool_call["id"], "")))
+
+    async def call(self, name: str, args: dict, timeout: Optional[float] = None) -> str:
+        for i, (expected_name, expected_args, result) in enumerate(self.expected):
+            if expected_name == name and expected_args == args:
+                del self.expected[i]
+                return result
+        return ""
+
+    def parse_arguments(self, name: str, text: str) -> Tuple[dict, bool]:
+        args, repairs = parse_arguments(text)
+        return args, bool(repairs)
+
+    def add_injection_param(self, name: str, value: Any) -> None:
+        pass
+
+    def to_schemas(self) -> list:
+        return self.schemas
+
+class ReplayClient:
+    """
+    本地桩模型，按记录依次返回模型回复，并统计每次请求
+    """
+
+    def __init__(self, fc: ReplayFunctionCalling, source: str) -> None:
+        self.fc = fc
+        self.source = source
+        self.chat = self
+        self.completions = self
+        self.responses: List[RecordedResponse] = []
+        self.metrics: List[RequestMetrics] = []
+        self.turn = 0
+        self.request = 0
+        self._last_tools: Optional[str] = None
+        self._last_messages: List[str] = []
+
+    def start_turn(self, turn: RecordedTurn) -> None:
+        """开始回放新的一轮对话"""
+        self.turn += 1
+        self.request = 0
+        self.responses = list(turn.responses)
+
+    async def create(self, **kwargs: Any) -> ChatCompletion:
+        self.request += 1
+        self._record_metrics(kwargs)
+
+        if self.responses:
+            recorded = self.responses.pop(0)
+        else:
+            # 记录中本轮对话已结束（例如记录被截断），直接结束本轮
+            recorded = RecordedResponse(content="")
+        self.fc.expect(recorded.tool_calls, recorded.tool_results)
+
+        tool_calls = [ChatCompletionMessageFunctionToolCall.model_validate(tc) for tc in recorded.tool_calls]
+        message = ChatCompletionMessage(role="assistant", content=recorded.content, tool_calls=tool_calls or None)
+        completion_tokens = estimate_message_tokens(message.model_dump())
+        return ChatCompletion(
+            id=f"replay-{self.turn}-{self.request}",
+            object="chat.completion",
+            created=int(time.time()),
+            model=kwargs["model"],
+            choices=[Choice(index=0, finish_reason="tool_calls" if tool_calls else "stop", message=message)],
+            usage=CompletionUsage(prompt_tokens=self.metrics[-1].prompt_tokens,
+                                  completion_tokens=completion_tokens,
+                                  total_tokens=self.metrics[-1].prompt_tokens + completion_tokens)
+        )
+
+    def _record_metrics(self, kwargs: Dict[str, Any]) -> None:
+        """统计请求的 token 数、字节数和与上一次请求相同的前缀长度"""
+        tools = json.dumps(kwargs.get("tools"), ensure_ascii=False)
+        messages = [json.dumps(msg, ensure_ascii=False, sort_keys=True) for msg in kwargs["messages"]]
+        message_tokens = [estimate_message_tokens(msg) for msg in kwargs["messages"]]
+        tools_tokens = estimate_tokens(tools)
+
+        # 函数描述位于消息之前，只有函数描述相同时消息才可能命中缓存
+        cached_tokens = 0
+        if tools == self._last_tools:
+            cached_tokens = tools_tokens
+            for i, (current, last) in enumerate(zip(messages, self._last_messages)):
+                if current != last:
+                    break
+                cached_tokens += message_tokens[i]
+        self._last_tools = tools
+        self._last_messages = messages
+
+        self.metrics.append(RequestMetrics(
+            source=self.source,
+            turn=self.turn,
+            request=self.request,
+            prompt_tokens=tools_tokens + sum(message_tokens),
+            request_bytes=len(json.dumps(kwargs, ensure_ascii=False).encode("utf-8")),
+            cached_tokens=cached_tokens
+        ))
+
+def load_turns(path: Path) -> Tuple[str, List[RecordedTurn]]:
+    """
+    读取群组的聊天记录快照和日志，返回系统提示和按轮次划分的对话
+    参数：
+        path: 聊天记录快照路径，形如 rosmontis_chat_group_123.json，快照不存在时只读取日志
+    """
+    match = re.fullmatch(r"(.+)_group_(\d+)\.json", path.name)
+    if match is None:
+        raise ValueError(f"无法识别的聊天记录文件名: {path.name}")
+    journal = HistoryJournal(int(match.group(2)), filename=f"{match.group(1)}.json", directory=path.parent)
+    messages = messages_from_data(journal.read())
+
+    # 系统提示以内容哈希保存且已修改时无法还原，使用当前的系统提示
+    prompt = default_prompt
+    turns: List[RecordedTurn] = []
+    for msg in messages:
+        role = msg["role"]
+        if role == "system":
+            prompt = msg.get("content") or default_prompt
+        elif role == "user":
+            turns.append(RecordedTurn(user_message=str(msg.get("content") or "")))
+        elif not turns:
+            continue  # 记录被截断，跳过第一条用户消息之前的回复
+        elif role == "assistant":
+            turns[-1].responses.append(RecordedResponse(content=msg.get("content"),  # type: ignore
+                                                        tool_calls=list(msg.get("tool_calls") or [])))
+        elif role == "tool" and turns[-1].responses:
+            turns[-1].responses[-1].tool_results[msg["tool_call_id"]] = str(msg.get("content") or "")
+    return prompt, turns
+
+async def replay_file(path: Path, strategy: ReplayStrategy, schemas: list) -> List[RequestMetrics]:
+    """
+    使用指定策略回放一个聊天记录文件
+    """
+    prompt, turns = load_turns(path)
+    fc = ReplayFunctionCalling(schemas)
+    client = ReplayClient(fc, path.name)
+
+    model = Model(group_id=0,
+                  fc=fc,  # type: ignore
+                  key="",
+                  prompt=prompt,
+                  max_history=strategy.max_history,
+                  truncation=strategy.truncation,
+                  compaction=strategy.compaction)
+    model.client = client  # type: ignore
+    model.clear_history()
+
+    for turn in turns:
+        client.start_turn(turn)
+        await model.chat(turn.user_message)
+    return client.metrics
+
+def format_report(results: Dict[str, List[RequestMetrics]]) -> str:
+    """
+    生成各策略的对比报告
+    """
+    lines = ["策略                        请求数  平均输入token  平均请求字节  平均缓存token  缓存命中率"]
+    for name, metrics in results.items():
+        if not metrics:
+            lines.append(f"{name:<28}{0:>6}")
+            continue
+        count = len(metrics)
+        prompt_tokens = sum(m.prompt_tokens for m in metrics)
+        request_bytes = sum(m.request_bytes for m in metrics)
+        cached_tokens = sum(m.cached_tokens for m in metrics)
+        hit_rate = cached_tokens / prompt_tokens if prompt_tokens else 0
+        lines.append(f"{name:<28}{count:>6}{prompt_tokens / count:>15.0f}{request_bytes / count:>14.0f}"
+                     f"{cached_tokens / count:>15.0f}{hit_rate:>11.1%}")
+    return "\n".join(lines)
+
+def save_csv(results: Dict[str, List[RequestMetrics]], path: Path) -> None:
+    """
+    将每次请求的统计信息保存为 csv 文件
+    """
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["strategy", "source", "turn", "request", "prompt_tokens", "request_bytes", "cached_tokens"])
+        for name, metrics in results.items():
+            for m in metrics:
+                writer.writerow([name, m.source, m.turn, m.request, m.prompt_tokens, m.request_bytes, m.cached_tokens])
+
+async def run(paths: List[Path], strategies: List[ReplayStrategy], schemas: list) -> Dict[str, List[RequestMetrics]]:
+    """
+    使用所有策略回放所有聊天记录文件
+    """
+    results: Dict[str, List[RequestMetrics]] = {}
+    for strategy in strategies:
+        metrics: List[RequestMetrics] = []
+        for path in paths:
+            metrics.extend(await replay_file(path, strategy, schemas))
+        results[strategy.name] = metrics
+    return results
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    命令行入口，需在 NoneBot 初始化并加载 chat 插件后调用
+    """
+    from .function_calling import function_container
+
+    parser = argparse.ArgumentParser(description="离线回放聊天记录，评估不同历史策略的 token 开销和缓存命中")
+    parser.add_argument("--dir", default=str(Path.home() / ".rmts_chat"), help="聊天记录所在目录")
+    parser.add_argument("--strategy", action="append", default=None,
+                        help="历史策略，格式为 max_history[:sliding|batch[:none|tool_results]]，可指定多次")
+    parser.add_argument("--csv", default=None, help="保存每次请求统计信息的 csv 文件路径")
+    args = parser.parse_args(argv)
+
+    # 每个群组的快照（可能被压缩）和日志，按群号去重
+    group_ids = {match.group(1) for path in Path(args.dir).glob("rosmontis_chat_group_*")
+                 if (match := re.match(r"rosmontis_chat_group_(\d+)\.", path.name))}
+    paths = sorted(Path(args.dir) / f"rosmontis_chat_group_{group_id}.json" for group_id in group_ids)
+    if not paths:
+        print(f"在 {args.dir} 中未找到聊天记录")
+        return
+
+    specs = args.strategy or ["80:sliding", "80:batch", "80:sliding:tool_results", "40:sliding"]
+    strategies = [ReplayStrategy.parse(spec) for spec in specs]
+    schemas = [fd.to_schema() for fd in function_container.function_descriptions.values()]
+
+    print(f"回放 {len(paths)} 个聊天记录文件，{len(strategies)} 种策略")
+    results = asyncio.run(run(paths, strategies, schemas))
+    print(format_report(results))
+
+    if args.csv:
+        save_csv(results, Path(args.csv))
+        print(f"每次请求的统计信息已保存到 {args.csv}")
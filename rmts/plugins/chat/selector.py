@@ -0,0 +1,148 @@
+"""
+按消息动态选择提供给模型的函数
+每轮对话根据消息中的关键词、是否附带图片、群内最近使用过的函数等本地信息，只提供可能用到的函数，
+没有设置选择条件的函数总是提供；模型需要的函数不在其中时，可以调用 request_more_functions 获取全部函数
+"""
+
+from collections import deque
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Deque, Dict, List, Set
+
+from nonebot.log import logger
+
+from .message import extract_user_text, has_user_image
+
+if TYPE_CHECKING:
+    from .function_calling import FunctionCalling
+
+# 获取全部函数的函数名称
+REQUEST_MORE_FUNCTIONS = "request_more_functions"
+# 获取全部函数的函数描述
+REQUEST_MORE_FUNCTIONS_SCHEMA = {
+    "type": "function",
+    "function": {
+        "name": REQUEST_MORE_FUNCTIONS,
+        "description": "当前提供的函数中没有需要的功能时调用，调用后可以使用全部函数",
+        "parameters": {"type": "object", "properties": {}}
+    }
+}
+
+@dataclass
+class SelectionStats:
+    """
+    所有群组共享的函数选择统计
+    """
+    turns: int = 0          # 对话轮数
+    offered: int = 0        # 每轮提供的函数数量之和
+    widened: int = 0        # 扩展到全部函数的轮数
+    not_offered: Dict[str, int] = field(default_factory=dict)  # 模型需要但没有提供的函数 -> 次数
+
+    def report(self) -> str:
+        """
+        生成函数选择统计报告
+        """
+        if not self.turns:
+            return "暂无函数选择记录"
+        missed = "，".join(f"{name}{count}次" for name, count in self.not_offered.items())
+        return (f"函数选择统计：共{self.turns}轮，平均提供{self.offered / self.turns:.1f}个函数，"
+                f"扩展到全部函数{self.widened}轮（{self.widened / self.turns:.1%}）"
+                + (f"，没有提供的函数：{missed}" if missed else ""))
+
+class ToolSelector:
+    """
+    单个聊天上下文的函数选择器，方法：
+        start: 根据用户消息选择本轮提供的函数
+        schemas: 获取本轮提供的函数描述
+        record_call: 记录模型调用的函数
+        widen: 扩展到全部函数
+        finish: 结束本轮，记录使用过的函数
+    """
+
+    def __init__(self, fc: "FunctionCalling", stats: SelectionStats, recent_turns: int = 5, sticky_turns: int = 2) -> None:
+        """
+        参数：
+            fc: 所属的函数调用管理器
+            stats: 函数选择统计
+            recent_turns: 最近多少轮中调用过的函数会继续提供
+            sticky_turns: 最近多少轮中因关键词被选中的函数会继续提供（例如需要博士确认后才调用的函数）
+        """
+        self.fc = fc
+        self.stats = stats
+        self.recent_used: Deque[Set[str]] = deque(maxlen=recent_turns)
+        self.recent_selected: Deque[Set[str]] = deque(maxlen=sticky_turns)
+        self.offered: Set[str] = set(fc.function_descriptions)
+        self.widened = True  # 尚未开始任何一轮时提供全部函数
+        self.turn_used: Set[str] = set()
+
+    def start(self, user_message: str) -> None:
+        """
+        根据用户消息选择本轮提供的函数
+        """
+        text = extract_user_text(user_message)
+        image = has_user_image(user_message)
+
+        selected: Set[str] = set()
+        offered: Set[str] = set()
+        for name, fd in self.fc.function_descriptions.items():
+            if not fd.selectable:
+                offered.add(name)
+            elif self._match(fd, text, image):
+                selected.add(name)
+        offered |= selected
+        for names in (*self.recent_used, *self.recent_selected):
+            offered |= names & self.fc.function_descriptions.keys()
+
+        self.recent_selected.append(selected)
+        self.offered = offered
+        self.widened = False
+        self.turn_used = set()
+        self.stats.turns += 1
+        self.stats.offered += len(offered)
+
+    def schemas(self) -> List[dict]:
+        """
+        获取本轮提供的函数描述，未扩展到全部函数时附带 request_more_functions
+        """
+        schemas = [fd.to_schema() for name, fd in self.fc.function_descriptions.items()
+                   if self.widened or name in self.offered]
+        if not self.widened:
+            schemas.append(REQUEST_MORE_FUNCTIONS_SCHEMA)
+        return schemas
+
+    def record_call(self, name: str) -> None:
+        """
+        记录模型调用的函数，调用了没有提供的函数时扩展到全部函数
+        """
+        if name not in self.fc.function_descriptions:
+            return
+        self.turn_used.add(name)
+        if name not in self.offered:
+            self.widen()
+
+    def widen(self) -> str:
+        """
+        扩展到全部函数，返回给模型的提示
+        """
+        if not self.widened:
+            logger.info(f"本轮对话扩展到全部函数，原本提供的函数: {sorted(self.offered)}")
+            self.widened = True
+            self.stats.widened += 1
+        return "已提供全部函数，请重新选择需要调用的函数"
+
+    def finish(self) -> None:
+        """
+        结束本轮，记录使用过的函数，调用了但一开始没有提供的函数计入没有提供的函数
+        """
+        for name in self.turn_used - self.offered:
+            self.stats.not_offered[name] = self.stats.not_offered.get(name, 0) + 1
+        self.recent_used.append(self.turn_used)
+        self.turn_used = set()
+
+    @staticmethod
+    def _match(fd, text: str, image: bool) -> bool:
+        """判断函数是否符合本轮的选择条件"""
+        if image and fd.select_image:
+            return True
+        if any(keyword in text for keyword in fd.select_keywords):
+            return True
+        return fd.select_matcher is not None and fd.select_matcher(text)
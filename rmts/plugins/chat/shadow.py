@@ -0,0 +1,233 @@
+"""
+影子模式
+将一部分真实对话在后台发送给候选模型，记录其与正式模型的延迟、token、函数调用次数和回复长度
+影子模式的回复永远不会发送给博士，有副作用的函数和计费的函数也不会真正执行，其他函数以只读方式执行，不改变正式的状态
+"""
+
+import time
+import random
+import asyncio
+import aiofiles
+
+from pathlib import Path
+from collections import deque
+from dataclasses import dataclass, asdict
+from typing import Any, Deque, Dict, List, Optional, Set
+
+from openai import AsyncOpenAI
+from nonebot.log import logger
+
+from .model import Model, TurnStats, TruncationPolicy, CompactionPolicy
+from .function_calling import FunctionCalling, FunctionContainer
+from rmts.utils.codec import dumps_str
+from rmts.utils.quota_limiter import QuotaLimiter
+
+class ShadowFunctionCalling(FunctionCalling):
+    """
+    影子模式使用的函数调用管理器，有副作用的函数和计费的函数只返回模拟结果，其他函数以只读方式执行
+    """
+
+    async def call(self, name: str, args: dict, timeout: Optional[float] = None) -> str:
+        fd = self.function_descriptions.get(name)
+        if fd is not None and fd.side_effect:
+            return f"已执行函数 {name}"
+        if fd is not None and fd.paid:
+            return f"函数 {name} 暂时不可用，请根据已有信息回答博士"
+        return await super().call(name, args, timeout)
+
+@dataclass
+class ShadowRecord:
+    """
+    一次影子对比记录
+    """
+    time: float                  # 记录时间戳
+    group_id: int                # 群号
+    production_model: str        # 正式模型名称
+    shadow_model: str            # 候选模型名称
+    production: TurnStats        # 正式模型的统计
+    shadow: Optional[TurnStats]  # 候选模型的统计，出错时为 None
+    error: Optional[str] = None  # 候选模型出错信息
+
+class ShadowEvaluator:
+    """
+    影子模式评估器，方法：
+        sample: 判断本轮对话是否需要进行影子评估
+        submit: 提交一轮对话，在后台发送给候选模型
+        report: 生成正式模型与候选模型的对比报告
+        close: 取消所有未完成的影子请求
+    """
+
+    def __init__(self,
+                 *,
+                 function_container: FunctionContainer,
+                 key: str,
+                 base_url: str,
+                 model: str,
+                 sample_rate: float,
+                 max_history: int,
+                 truncation: TruncationPolicy = "sliding",
+                 compaction: CompactionPolicy = "none",
+                 turn_budget: Optional[float] = None,
+                 max_records: int = 1000,
+                 filename: str = "rosmontis_shadow.jsonl"
+    ) -> None:
+        """
+        参数：
+            function_container: 全局唯一的函数容器
+            key: 候选模型的 API 密钥
+            base_url: 候选模型的 API 基础 URL
+            model: 候选模型名称，为空时不启用影子模式
+            sample_rate: 采样比例，0 到 1 之间
+            max_history: 最大历史消息条数，与正式模型保持一致
+            truncation: 历史消息截断策略，与正式模型保持一致
+            compaction: 历史消息压缩策略，与正式模型保持一致
+            turn_budget: 每轮对话的时间预算，与正式模型保持一致
+            max_records: 内存中保留的对比记录数量
+            filename: 对比记录文件名，保存在用户目录下的 .rmts_chat 文件夹中
+        """
+
+        self.function_container = function_container
+        self.key = key
+        self.base_url = base_url
+        self.model = model
+        self.sample_rate = sample_rate
+        self.max_history = max_history
+        self.truncation: TruncationPolicy = truncation
+        self.compaction: CompactionPolicy = compaction
+        self.turn_budget = turn_budget
+        self.records: Deque[ShadowRecord] = deque(maxlen=max_records)
+        self.filepath = Path.home() / ".rmts_chat" / filename
+        self.client: Optional[AsyncOpenAI] = None
+        # 与正式模型使用同一个服务商账号时共享配额限流器
+        self.quota_limiter: Optional[QuotaLimiter] = None
+        self._tasks: Set[asyncio.Task] = set()  # 保存后台任务的引用，避免被垃圾回收
+
+        if self.enabled:
+            logger.info(f"影子模式已启用，候选模型: {self.model}，采样比例: {self.sample_rate}")
+
+    @property
+    def enabled(self) -> bool:
+        """是否启用影子模式"""
+        return bool(self.model) and self.sample_rate > 0
+
+    def sample(self) -> bool:
+        """
+        判断本轮对话是否需要进行影子评估
+        """
+        return self.enabled and random.random() < self.sample_rate
+
+    def submit(self,
+               *,
+               group_id: int,
+               user_id: int,
+               messages: List[Any],
+               user_message: str,
+               production_model: str,
+               production: TurnStats,
+               context: Optional[str] = None
+    ) -> None:
+        """
+        提交一轮对话，在后台发送给候选模型
+        参数：
+            group_id: 群号
+            user_id: 用户 ID
+            messages: 正式模型本轮对话开始前的历史消息（会被复制，不会被修改）
+            user_message: 本轮的用户消息
+            production_model: 正式模型名称
+            production: 正式模型本轮对话的统计
+            context: 正式模型本轮注入的背景信息，候选模型使用相同的背景信息
+        """
+        task = asyncio.create_task(self._run(group_id, user_id, list(messages), user_message,
+                                             production_model, production, context))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def report(self) -> str:
+        """
+        生成正式模型与候选模型的对比报告
+        """
+        if not self.records:
+            return "影子模式暂无对比记录"
+
+        completed = [r for r in self.records if r.shadow is not None]
+        lines = [f"影子模式对比报告（{self.model}），共{len(self.records)}条记录，失败{len(self.records) - len(completed)}条"]
+        if not completed:
+            return lines[0]
+
+        def average(stats: List[TurnStats], field: str) -> float:
+            return sum(getattr(s, field) for s in stats) / len(stats)
+
+        production = [r.production for r in completed]
+        shadow = [r.shadow for r in completed if r.shadow is not None]
+        for field, label in (("latency", "平均耗时(秒)"),
+                             ("rounds", "平均请求次数"),
+                             ("tool_calls", "平均函数调用次数"),
+                             ("prompt_tokens", "平均输入token"),
+                             ("completion_tokens", "平均输出token"),
+                             ("response_length", "平均回复长度")):
+            lines.append(f"{label}: 正式 {average(production, field):.2f}，候选 {average(shadow, field):.2f}")
+        return "\n".join(lines)
+
+    async def close(self) -> None:
+        """
+        取消所有未完成的影子请求
+        """
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+
+    async def _run(self,
+                   group_id: int,
+                   user_id: int,
+                   messages: List[Any],
+                   user_message: str,
+                   production_model: str,
+                   production: TurnStats,
+                   context: Optional[str] = None
+    ) -> None:
+        """在后台使用候选模型完成一轮对话并记录结果"""
+        if self.client is None:
+            self.client = AsyncOpenAI(api_key=self.key, base_url=self.base_url)
+
+        fc = ShadowFunctionCalling(self.function_container, {"group_id": group_id, "user_id": user_id, "read_only": True})
+        model = Model(group_id=group_id,
+                      fc=fc,
+                      key=self.key,
+                      base_url=self.base_url,
+                      model=self.model,
+                      max_history=self.max_history,
+                      truncation=self.truncation,
+                      compaction=self.compaction,
+                      turn_budget=self.turn_budget)
+        model.client = self.client
+        model.quota_limiter = self.quota_limiter
+        model.messages.replace(messages)
+
+        record = ShadowRecord(time=time.time(),
+                              group_id=group_id,
+                              production_model=production_model,
+                              shadow_model=self.model,
+                              production=production,
+                              shadow=None)
+        try:
+            await model.chat(user_message, context)
+            record.shadow = model.last_turn_stats
+        except Exception as e:
+            logger.warning(f"[群:{group_id}] 影子模式请求失败: {e}")
+            record.error = str(e)
+
+        self.records.append(record)
+        await self._save_record(record)
+
+    async def _save_record(self, record: ShadowRecord) -> None:
+        """将对比记录追加到文件"""
+        try:
+            self.filepath.parent.mkdir(exist_ok=True)
+            data: Dict[str, Any] = asdict(record)
+            async with aiofiles.open(self.filepath, 'a', encoding='utf-8') as f:
+                await f.write(dumps_str(data) + "\n")
+        except Exception as e:
+            logger.error(f"保存影子模式记录失败: {e}")
@@ -0,0 +1,293 @@
+"""
+LLM token 用量账本
+每次 LLM 请求（对话请求和函数内部的请求）记录一条：日期、群号、用户、模型、函数、输入和输出 token 数。
+记录按列保存在 array.array 中，每条只占 32 字节，按日期有序，可以快速按日期、群组、用户等汇总；
+同时以定长二进制记录追加写入文件，重启后重新加载，程序异常退出时最多丢失最后一条不完整的记录；
+启动时在线程中加载，只保留最近 retention_days 天的记录，关闭时从文件中删除过期的记录
+"""
+
+import time
+import struct
+import bisect
+import asyncio
+
+from array import array
+from pathlib import Path
+from datetime import date
+from dataclasses import dataclass
+from typing import BinaryIO, Dict, List, Literal, Optional, TextIO, Tuple
+
+from nonebot.log import logger
+
+from rmts.utils.codec import write_atomic
+
+# 单条记录的二进制格式：日期序号、群号、用户、模型名称序号、函数名称序号、输入 token、输出 token
+RECORD_FORMAT = struct.Struct("<IqqHHII")
+# 对话请求的函数名称，函数内部的请求使用函数名
+CHAT_FUNCTION = ""
+# 默认保留最近几天的记录，应不少于需要查看用量报告的天数
+DEFAULT_RETENTION_DAYS = 90
+
+# 单条记录：日期序号、群号、用户、模型名称序号、函数名称序号、输入 token、输出 token
+UsageRow = Tuple[int, int, int, int, int, int, int]
+
+# 汇总维度
+UsageDimension = Literal["day", "group", "user", "model", "function"]
+
+@dataclass
+class UsageTotal:
+    """
+    一组记录的用量汇总
+    """
+    calls: int = 0              # 请求次数
+    prompt_tokens: int = 0      # 输入 token 数
+    completion_tokens: int = 0  # 输出 token 数
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+class UsageLedger:
+    """
+    只追加的 token 用量账本，方法：
+        load: 在线程中加载已有的记录
+        record: 记录一次请求的用量
+        group_tokens: 获取群组某天使用的 token 数
+        rollup: 按维度汇总用量
+        report: 生成最近几天各群组的用量报告
+        close: 关闭文件，删除过期的记录
+    """
+
+    def __init__(self, filename: str = "rosmontis_usage.bin", retention_days: int = DEFAULT_RETENTION_DAYS) -> None:
+        """
+        参数：
+            filename: 记录文件名，保存在用户目录下的 .rmts_chat 文件夹中，
+                模型和函数名称保存在同名的 .names 文件中
+            retention_days: 保留最近几天的记录（包括今天），更早的记录加载时丢弃，关闭时从文件中删除
+        说明：
+            启动时应调用 load 在线程中加载已有的记录，没有加载时第一次使用会在事件循环中直接加载
+        """
+        self.filepath = Path.home() / ".rmts_chat" / filename
+        self.retention_days = retention_days
+        self.names_path = self.filepath.with_suffix(".names")
+        self.days = array("I")
+        self.groups = array("q")
+        self.users = array("q")
+        self.models = array("H")
+        self.functions = array("H")
+        self.prompt_tokens = array("I")
+        self.completion_tokens = array("I")
+        self.names: List[str] = []          # 模型和函数名称，记录中保存名称的序号
+        self._name_index: Dict[str, int] = {}
+        self._daily: Dict[Tuple[int, int], int] = {}  # (日期序号, 群号) -> token 数，用于配额检查
+        self._loaded = False
+        self._expired = 0  # 加载时丢弃的过期记录数，关闭时从文件中删除
+        self._file: Optional[BinaryIO] = None
+        self._names_file: Optional[TextIO] = None
+
+    def __len__(self) -> int:
+        self._load()
+        return len(self.days)
+
+    async def load(self) -> None:
+        """
+        在线程中从文件加载已有的记录，避免第一次检查配额时在事件循环中读取文件
+        """
+        if self._loaded:
+            return
+        try:
+            loaded = await asyncio.to_thread(self._read)
+        except OSError as e:
+            logger.error(f"加载用量记录失败: {e}")
+            return
+        # 读取期间可能已经在事件循环中直接加载过
+        if not self._loaded:
+            self._apply(*loaded)
+
+    def record(self, group_id: int, user_id: int, model: str, function: str,
+               prompt_tokens: int, completion_tokens: int) -> None:
+        """
+        记录一次请求的用量并追加写入文件
+        参数：
+            group_id: 群号
+            user_id: 用户 ID，未知时为 0
+            model: 模型名称
+            function: 发起请求的函数名称，对话请求为 CHAT_FUNCTION
+            prompt_tokens: 输入 token 数
+            completion_tokens: 输出 token 数
+        """
+        self._load()
+        row = (date.today().toordinal(), group_id, user_id, self._intern(model), self._intern(function),
+               prompt_tokens, completion_tokens)
+        self._append(row)
+        try:
+            if self._file is None:
+                self._file = open(self.filepath, "ab")
+            self._file.write(RECORD_FORMAT.pack(*row))
+            self._file.flush()
+        except OSError as e:
+            logger.error(f"写入用量记录失败: {e}")
+
+    def group_tokens(self, group_id: int, day: Optional[date] = None) -> int:
+        """
+        获取群组某天使用的 token 数，默认为今天
+        """
+        self._load()
+        return self._daily.get(((day or date.today()).toordinal(), group_id), 0)
+
+    def rollup(self, by: UsageDimension, *, since: Optional[date] = None,
+               group_id: Optional[int] = None) -> Dict[object, UsageTotal]:
+        """
+        按维度汇总用量
+        参数：
+            by: 汇总维度，日期维度的键为 date，模型和函数维度的键为名称，其他维度的键为 ID
+            since: 只汇总该日期及之后的记录
+            group_id: 只汇总该群组的记录
+        返回值：
+            键 -> 用量汇总，按键排序
+        """
+        self._load()
+        # 记录按日期有序，二分查找起始位置
+        start = bisect.bisect_left(self.days, since.toordinal()) if since else 0
+        column = {"day": self.days, "group": self.groups, "user": self.users,
+                  "model": self.models, "function": self.functions}[by]
+        totals: Dict[int, UsageTotal] = {}
+        for i in range(start, len(self.days)):
+            if group_id is not None and self.groups[i] != group_id:
+                continue
+            total = totals.get(column[i])
+            if total is None:
+                total = totals[column[i]] = UsageTotal()
+            total.calls += 1
+            total.prompt_tokens += self.prompt_tokens[i]
+            total.completion_tokens += self.completion_tokens[i]
+
+        def label(key: int) -> object:
+            if by == "day":
+                return date.fromordinal(key)
+            if by in ("model", "function"):
+                return self.names[key] if key < len(self.names) else f"#{key}"
+            return key
+        return {label(key): totals[key] for key in sorted(totals)}
+
+    def report(self, days: int = 7, limit: int = 10) -> str:
+        """
+        生成最近几天各群组的用量报告，按 token 数从多到少列出
+        参数：
+            days: 统计的天数，包括今天
+            limit: 最多列出的群组数量
+        """
+        since = date.fromordinal(date.today().toordinal() - days + 1)
+        groups = self.rollup("group", since=since)
+        if not groups:
+            return f"最近{days}天没有用量记录"
+        total = sum(t.total_tokens for t in groups.values())
+        lines = [f"最近{days}天共请求{sum(t.calls for t in groups.values())}次，使用{total}个token"]
+        ranked = sorted(groups.items(), key=lambda item: item[1].total_tokens, reverse=True)
+        for group_id, t in ranked[:limit]:
+            lines.append(f"群{group_id}: 请求{t.calls}次，输入{t.prompt_tokens}，输出{t.completion_tokens}，共{t.total_tokens}")
+        for name, t in self.rollup("function", since=since).items():
+            if name != CHAT_FUNCTION:
+                lines.append(f"函数{name}: 请求{t.calls}次，共{t.total_tokens}")
+        return "\n".join(lines)
+
+    def close(self) -> None:
+        """
+        关闭记录文件，加载时丢弃了过期的记录时，用保留的记录重写文件
+        """
+        for f in (self._file, self._names_file):
+            if f is not None:
+                f.close()
+        self._file = None
+        self._names_file = None
+        if self._expired:
+            columns = (self.days, self.groups, self.users, self.models, self.functions,
+                       self.prompt_tokens, self.completion_tokens)
+            try:
+                write_atomic(self.filepath, b"".join(RECORD_FORMAT.pack(*row) for row in zip(*columns)))
+            except OSError as e:
+                logger.error(f"删除过期的用量记录失败: {e}")
+                return
+            logger.info(f"已从用量记录文件中删除{self._expired}条{self.retention_days}天之前的记录")
+            self._expired = 0
+
+    def _append(self, row: UsageRow) -> None:
+        """将一条记录追加到内存中的各列"""
+        day, group_id, user_id, model, function, prompt_tokens, completion_tokens = row
+        self.days.append(day)
+        self.groups.append(group_id)
+        self.users.append(user_id)
+        self.models.append(model)
+        self.functions.append(function)
+        self.prompt_tokens.append(prompt_tokens)
+        self.completion_tokens.append(completion_tokens)
+        key = (day, group_id)
+        self._daily[key] = self._daily.get(key, 0) + prompt_tokens + completion_tokens
+
+    def _intern(self, name: str) -> int:
+        """获取名称的序号，新名称先追加写入名称文件"""
+        index = self._name_index.get(name)
+        if index is not None:
+            return index
+        index = len(self.names)
+        self.names.append(name)
+        self._name_index[name] = index
+        try:
+            if self._names_file is None:
+                self._names_file = open(self.names_path, "a", encoding="utf-8")
+            self._names_file.write(name + "\n")
+            self._names_file.flush()
+        except OSError as e:
+            logger.error(f"写入用量记录名称失败: {e}")
+        return index
+
+    def _load(self) -> None:
+        """第一次使用时还没有加载已有的记录，在事件循环中直接加载"""
+        if self._loaded:
+            return
+        try:
+            self._apply(*self._read())
+        except OSError as e:
+            logger.error(f"加载用量记录失败: {e}")
+            self._apply([], [], 0)
+
+    def _read(self) -> Tuple[List[str], List[UsageRow], int]:
+        """
+        读取名称文件和记录文件，截掉末尾不完整的记录，可以在线程中执行
+        返回值：
+            (名称列表, 保留的记录, 过期的记录数)
+        """
+        self.filepath.parent.mkdir(exist_ok=True)
+        names: List[str] = []
+        if self.names_path.exists():
+            names = self.names_path.read_text(encoding="utf-8").split("\n")[:-1]
+        if not self.filepath.exists():
+            return names, [], 0
+
+        start = time.perf_counter()
+        data = self.filepath.read_bytes()
+        complete = len(data) - len(data) % RECORD_FORMAT.size
+        if complete != len(data):
+            logger.warning(f"用量记录文件末尾有不完整的记录，已截断: {self.filepath}")
+            with open(self.filepath, "r+b") as f:
+                # 读取之后已经追加了新记录时不截断
+                if f.seek(0, 2) == len(data):
+                    f.truncate(complete)
+        rows: List[UsageRow] = list(RECORD_FORMAT.iter_unpack(memoryview(data)[:complete]))
+        # 记录按日期有序，二分查找第一条没有过期的记录
+        cutoff = date.today().toordinal() - self.retention_days + 1
+        first = bisect.bisect_left(rows, cutoff, key=lambda row: row[0])
+        logger.info(f"已读取{len(rows)}条用量记录，其中{first}条已过期，耗时{(time.perf_counter() - start) * 1000:.1f}毫秒")
+        return names, rows[first:], first
+
+    def _apply(self, names: List[str], rows: List[UsageRow], expired: int) -> None:
+        """将读取的名称和记录加入内存"""
+        self._loaded = True
+        self.names = names
+        self._name_index = {name: i for i, name in enumerate(names)}
+        for row in rows:
+            self._append(row)
+        self._expired = expired
+
+# 全局唯一的用量账本
+usage_ledger = UsageLedger()
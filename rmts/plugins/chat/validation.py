@@ -0,0 +1,229 @@
+"""
+函数调用参数校验
+每个函数描述编译为一个参数校验器，调用函数前检查并转换模型给出的参数（必需参数、类型、枚举值），
+参数有误时返回简短准确的错误信息，让模型一次就能修正调用
+"""
+
+import re
+import json
+import difflib
+
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Tuple
+
+from .arguments import ArgumentError
+
+if TYPE_CHECKING:
+    from .function_calling import FunctionDescription
+
+# 可以转换为布尔值的字符串
+BOOLEAN_STRINGS = {"true": True, "false": False, "1": True, "0": False, "是": True, "否": False}
+# 参数类型的中文名称，用于错误信息
+TYPE_NAMES = {"string": "字符串", "integer": "整数", "number": "数字", "boolean": "布尔值", "array": "列表", "object": "对象"}
+# 枚举值不超过该数量时，错误信息中列出所有可选值
+MAX_LISTED_ENUM_VALUES = 8
+# 整数字符串
+INTEGER_PATTERN = re.compile(r"\s*-?\d+\s*")
+
+# 参数检查函数，返回转换后的值，参数有误时抛出 InvalidValue
+Checker = Callable[[Any], Any]
+
+class InvalidValue(Exception):
+    """
+    单个参数值有误，消息为不包括参数名的错误描述
+    """
+
+class ValidationError(ArgumentError):
+    """
+    函数参数不符合函数声明，消息可以直接作为函数调用结果返回给模型
+    """
+
+    def __init__(self, name: str, errors: List[str]) -> None:
+        self.errors = errors
+        super().__init__(f"函数 {name} 的参数有误，请修正后重新调用：{'；'.join(errors)}")
+
+class ArgumentValidator:
+    """
+    由函数描述编译得到的参数校验器，方法：
+        validate: 检查并转换参数
+    """
+
+    __slots__ = ("name", "checkers", "declared", "ignored")
+
+    def __init__(self, fd: "FunctionDescription") -> None:
+        """
+        参数：
+            fd: 函数描述，描述被修改后需重新编译
+        """
+        self.name = fd.name
+        # (参数名, 检查函数, 是否必需, 类型名称)
+        self.checkers: Tuple[Tuple[str, Checker, bool, str], ...] = tuple(
+            (name, _compile(info), bool(info.get("required")), TYPE_NAMES.get(info["type"], info["type"]))
+            for name, info in {**fd.str_parameters, **fd.enum_parameters}.items()
+        )
+        self.declared = frozenset(name for name, *_ in self.checkers)
+        self.ignored = frozenset(fd.injection_parameters)  # 注入参数会在调用时被覆盖，不检查
+
+    def validate(self, args: Dict[str, Any]) -> List[str]:
+        """
+        检查并转换参数
+        参数：
+            args: 参数字典，会被直接修改
+        返回：
+            被转换、改名或删除的参数名称列表
+        说明：
+            参数有误时抛出 ValidationError，包含所有参数的错误
+            值为 null 的可选参数被删除；未声明的参数与某个未提供的参数名称相近时改名，否则删除
+        """
+        changed: List[str] = []
+        for key in [key for key in args if key not in self.declared and key not in self.ignored]:
+            value = args.pop(key)
+            changed.append(key)
+            missing = [name for name in self.declared if name not in args]
+            match = difflib.get_close_matches(key, missing, n=1, cutoff=0.6)
+            if match:
+                args[match[0]] = value
+
+        errors: List[str] = []
+        for name, check, required, type_name in self.checkers:
+            value = args.get(name)
+            if value is None:
+                if required:
+                    errors.append(f"缺少必需参数 {name}（{type_name}）")
+                elif name in args:
+                    del args[name]
+                    changed.append(name)
+                continue
+            try:
+                converted = check(value)
+            except InvalidValue as e:
+                errors.append(f"{name}{e}")
+                continue
+            if type(converted) is not type(value) or converted != value:
+                args[name] = converted
+                changed.append(name)
+
+        if errors:
+            raise ValidationError(self.name, errors)
+        return changed
+
+def _compile(info: Dict[str, Any]) -> Checker:
+    """将参数声明编译为检查函数"""
+    expected = info["type"]
+    if "enum" in info:
+        return _compile_enum(_TYPE_CHECKERS.get(expected, _check_any), info["enum"])
+    if expected == "array":
+        return _compile_array(_compile(info["items"]) if info.get("items") else _check_any)
+    if expected == "object":
+        values = info.get("additionalProperties")
+        return _compile_object(_compile(values) if values else _check_any)
+    return _TYPE_CHECKERS.get(expected, _check_any)
+
+def _check_any(value: Any) -> Any:
+    return value
+
+def _check_integer(value: Any) -> int:
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str) and INTEGER_PATTERN.fullmatch(value):
+        return int(value)
+    raise InvalidValue(f" 应为整数，实际为 {_describe(value)}")
+
+def _check_number(value: Any) -> Any:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        try:
+            number = float(value)
+        except ValueError:
+            pass
+        else:
+            return int(number) if number.is_integer() and "." not in value else number
+    raise InvalidValue(f" 应为数字，实际为 {_describe(value)}")
+
+def _check_boolean(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in BOOLEAN_STRINGS:
+        return BOOLEAN_STRINGS[value.strip().lower()]
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    raise InvalidValue(f" 应为布尔值，实际为 {_describe(value)}")
+
+def _check_string(value: Any) -> str:
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    raise InvalidValue(f" 应为字符串，实际为 {_describe(value)}")
+
+_TYPE_CHECKERS: Dict[str, Checker] = {
+    "integer": _check_integer,
+    "number": _check_number,
+    "boolean": _check_boolean,
+    "string": _check_string,
+}
+
+def _compile_array(check_item: Checker) -> Checker:
+    def check(value: Any) -> list:
+        if isinstance(value, str):
+            try:
+                parsed = json.loads(value)
+            except json.JSONDecodeError:
+                parsed = None
+            value = parsed if isinstance(parsed, list) else [value]
+        elif not isinstance(value, list):
+            value = [value]
+        items = []
+        for i, item in enumerate(value):
+            try:
+                items.append(check_item(item))
+            except InvalidValue as e:
+                raise InvalidValue(f"[{i}]{e}") from None
+        return items
+    return check
+
+def _compile_object(check_value: Checker) -> Checker:
+    def check(value: Any) -> dict:
+        if isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except json.JSONDecodeError:
+                pass
+        if not isinstance(value, dict):
+            raise InvalidValue(f" 应为对象，实际为 {_describe(value)}")
+        result = {}
+        for key, item in value.items():
+            try:
+                result[key] = check_value(item)
+            except InvalidValue as e:
+                raise InvalidValue(f".{key}{e}") from None
+        return result
+    return check
+
+def _compile_enum(check_type: Checker, enum_values: List[Any]) -> Checker:
+    allowed = frozenset(enum_values)
+    # 忽略首尾空白和大小写后的枚举值 -> 枚举值
+    normalized = {str(v).strip().casefold(): v for v in enum_values}
+    choices = [str(v) for v in enum_values]
+
+    def check(value: Any) -> Any:
+        value = check_type(value)
+        if value in allowed:
+            return value
+        key = str(value).strip().casefold()
+        if key in normalized:
+            return normalized[key]
+        if len(choices) <= MAX_LISTED_ENUM_VALUES:
+            hint = f"可选值为 {'、'.join(choices)}"
+        else:
+            suggestions = difflib.get_close_matches(str(value), choices, n=3, cutoff=0.3)
+            hint = f"可能是 {'、'.join(suggestions)}" if suggestions else "可选值见函数描述"
+        raise InvalidValue(f" 的值 {_describe(value)} 不是可选值，{hint}")
+    return check
+
+def _describe(value: Any) -> str:
+    """生成错误信息中的参数值，过长时截断"""
+    text = json.dumps(value, ensure_ascii=False, default=str)
+    return text if len(text) <= 30 else f"{text[:27]}..."
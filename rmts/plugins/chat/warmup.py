@@ -0,0 +1,167 @@
+"""
+历史记录预加载
+关闭时记录最近活跃的群组，启动时在收到第一条消息前并发加载这些群组的历史记录，
+避免重启后第一条消息在群组锁内等待加载；同时统计冷启动对话的耗时和事件循环的卡顿时间
+"""
+
+import time
+import asyncio
+
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from nonebot.log import logger
+
+from rmts.utils.codec import CodecError, dumps, loads, write_atomic
+
+from .history import history_dir
+
+# 事件循环卡顿检测的间隔，单位秒
+LOOP_LAG_INTERVAL = 0.05
+# 超过该时间的延迟视为一次卡顿，单位秒
+LOOP_STALL_THRESHOLD = 0.1
+
+class ActiveGroups:
+    """
+    最近活跃的群组，方法：
+        touch: 记录群组活跃
+        recent: 获取最近活跃的群组
+        load: 读取上次关闭时保存的记录
+        save: 保存最近活跃的群组
+    """
+
+    def __init__(self, filename: str = "rosmontis_active_groups.json", directory: Optional[Path] = None) -> None:
+        """
+        参数：
+            filename: 记录文件名
+            directory: 文件所在目录，默认为 history_dir()
+        """
+        self.filepath = (directory or history_dir()) / filename
+        self.last_active: Dict[int, float] = {}  # 群号 -> 最后活跃时间
+
+    def touch(self, group_id: int) -> None:
+        self.last_active[group_id] = time.time()
+
+    def recent(self, limit: int) -> List[int]:
+        """
+        获取最近活跃的 limit 个群组，按活跃时间从近到远排列
+        """
+        return sorted(self.last_active, key=self.last_active.__getitem__, reverse=True)[:limit]
+
+    def load(self) -> None:
+        """
+        读取上次关闭时保存的记录，与本次运行的记录合并
+        """
+        if not self.filepath.exists():
+            return
+        try:
+            data = loads(self.filepath.read_bytes())
+        except (OSError, CodecError) as e:
+            logger.warning(f"读取最近活跃的群组失败: {e}")
+            return
+        for group_id, last_active in data.items():
+            group_id = int(group_id)
+            self.last_active[group_id] = max(self.last_active.get(group_id, 0), last_active)
+
+    def save(self, limit: int) -> None:
+        """
+        保存最近活跃的 limit 个群组
+        """
+        data = {str(group_id): self.last_active[group_id] for group_id in self.recent(limit)}
+        try:
+            self.filepath.parent.mkdir(exist_ok=True)
+            write_atomic(self.filepath, dumps(data))
+        except OSError as e:
+            logger.error(f"保存最近活跃的群组失败: {e}")
+
+@dataclass
+class WarmupStats:
+    """
+    历史记录加载和冷启动对话统计
+    """
+    preloaded: int = 0          # 预加载的群组数量
+    preload_time: float = 0     # 预加载总耗时，单位秒
+    cold_loads: int = 0         # 收到消息时才加载历史记录的次数
+    cold_load_time: float = 0   # 收到消息时加载历史记录的总耗时，单位秒
+    max_cold_load: float = 0    # 收到消息时加载历史记录的最长耗时，单位秒
+    cold_turns: int = 0         # 需要加载历史记录的对话次数
+    cold_turn_time: float = 0   # 需要加载历史记录的对话总耗时，单位秒
+    warm_turns: int = 0         # 历史记录已加载的对话次数
+    warm_turn_time: float = 0   # 历史记录已加载的对话总耗时，单位秒
+
+    def record_cold_load(self, elapsed: float) -> None:
+        self.cold_loads += 1
+        self.cold_load_time += elapsed
+        self.max_cold_load = max(self.max_cold_load, elapsed)
+
+    def record_turn(self, cold: bool, elapsed: float) -> None:
+        if cold:
+            self.cold_turns += 1
+            self.cold_turn_time += elapsed
+        else:
+            self.warm_turns += 1
+            self.warm_turn_time += elapsed
+
+    def report(self) -> str:
+        """
+        生成统计报告
+        """
+        def average(total: float, count: int) -> float:
+            return total / count if count else 0
+
+        return (f"历史记录加载统计：预加载{self.preloaded}个群组，耗时{self.preload_time * 1000:.0f}毫秒；"
+                f"收到消息时加载{self.cold_loads}次，平均{average(self.cold_load_time, self.cold_loads) * 1000:.1f}毫秒，"
+                f"最长{self.max_cold_load * 1000:.1f}毫秒\n"
+                f"冷启动对话{self.cold_turns}次，平均耗时{average(self.cold_turn_time, self.cold_turns):.2f}秒；"
+                f"其他对话{self.warm_turns}次，平均耗时{average(self.warm_turn_time, self.warm_turns):.2f}秒")
+
+class LoopLagMonitor:
+    """
+    事件循环卡顿检测，定时休眠并测量实际唤醒的延迟，方法：
+        start: 开始检测
+        stop: 停止检测
+        report: 生成卡顿统计报告
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, threshold: float = LOOP_STALL_THRESHOLD) -> None:
+        """
+        参数：
+            interval: 检测间隔，单位秒
+            threshold: 延迟超过该时间视为一次卡顿，单位秒
+        """
+        self.interval = interval
+        self.threshold = threshold
+        self.samples = 0         # 检测次数
+        self.stalls = 0          # 卡顿次数
+        self.stall_time = 0.0    # 卡顿的总延迟，单位秒
+        self.max_lag = 0.0       # 最长延迟，单位秒
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def report(self) -> str:
+        """
+        生成卡顿统计报告
+        """
+        return (f"事件循环卡顿统计：检测{self.samples}次，最长延迟{self.max_lag * 1000:.1f}毫秒，"
+                f"超过{self.threshold * 1000:.0f}毫秒的卡顿{self.stalls}次，共{self.stall_time * 1000:.0f}毫秒")
+
+    async def _run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = time.perf_counter() - start - self.interval
+            self.samples += 1
+            self.max_lag = max(self.max_lag, lag)
+            if lag > self.threshold:
+                self.stalls += 1
+                self.stall_time += lag
@@ -7,15 +7,25 @@ from .rate_limiter import TokenBucket
 # 全局限流器
 global_rate_limiter = TokenBucket(capacity=10, rate=0.5)
 
+async def try_acquire_global_token(tokens: float = 1) -> bool:
+    """
+    尝试获取全局令牌，返回是否获取成功，适用于被限流时仍需降级处理的场景
+    """
+
+    if await global_rate_limiter.acquire_async(tokens):
+        return True
+
+    logger.warning(f"Failed to acquire global tokens: {tokens}")
+    return False
+
 async def acquire_global_token(tokens: float = 1) -> None:
     """
     尝试获取全局令牌，如果无法获取则抛出 FinishedException
     """
 
-    if await global_rate_limiter.acquire_async(tokens):
+    if await try_acquire_global_token(tokens):
         return
-    
-    logger.warning(f"Failed to acquire global tokens: {tokens}")
+
     raise FinishedException()
 
 def acquire_global_token_decorator(tokens: float = 1):
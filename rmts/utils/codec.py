@@ -0,0 +1,159 @@
+"""
+JSON 编解码
+所有持久化状态和接口响应的解析共用的编解码层：
+    - 安装了 orjson 时使用 orjson，否则使用标准库 json，两者的输出格式相同
+    - 默认输出紧凑的 UTF-8 字节（不转义中文），可选缩进用于需要人工查看的资源文件
+    - 带版本号的数据格式，读取旧版本的数据时依次执行迁移函数
+    - 原子写入文件，写入过程中崩溃时原文件保持不变
+运行 python -m rmts.utils.codec 可以比较两种实现的编解码耗时
+"""
+
+import os
+import json
+import time
+
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 取决于运行环境
+    orjson = None
+
+# 当前使用的实现名称
+BACKEND = "orjson" if orjson is not None else "json"
+
+# 数据格式版本的迁移函数，版本号 -> 将该版本的数据转换为下一版本的函数
+Migrations = Dict[int, Callable[[Any], Any]]
+
+
+class CodecError(ValueError):
+    """数据无法解码或版本不受支持"""
+
+
+def dumps(obj: Any, *, indent: bool = False, sort_keys: bool = False) -> bytes:
+    """编码为 UTF-8 JSON 字节
+
+    Args:
+        obj: 要编码的对象，只支持 JSON 原生类型（dict 的键需为字符串）
+        indent: 是否使用两个空格缩进，默认输出紧凑格式
+        sort_keys: 是否按键排序
+
+    Returns:
+        bytes: 编码结果，中文等非 ASCII 字符不转义
+    """
+    if orjson is not None:
+        option = (orjson.OPT_INDENT_2 if indent else 0) | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        return orjson.dumps(obj, option=option)
+    text = json.dumps(obj, ensure_ascii=False, sort_keys=sort_keys,
+                      indent=2 if indent else None, separators=None if indent else (",", ":"))
+    return text.encode("utf-8")
+
+
+def dumps_str(obj: Any, *, indent: bool = False, sort_keys: bool = False) -> str:
+    """编码为 JSON 字符串，用于写入文本文件或日志"""
+    return dumps(obj, indent=indent, sort_keys=sort_keys).decode("utf-8")
+
+
+def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+    """解码 JSON，优先传入原始字节，省去一次文本解码
+
+    Raises:
+        CodecError: 数据不是合法的 JSON
+    """
+    try:
+        if orjson is not None:
+            return orjson.loads(data)
+        return json.loads(bytes(data) if isinstance(data, memoryview) else data)
+    except ValueError as e:
+        raise CodecError(str(e)) from e
+
+
+def encode_versioned(obj: Any, version: int, *, indent: bool = False) -> bytes:
+    """编码带版本号的数据，格式为 {"version": 版本号, "data": 数据}"""
+    return dumps({"version": version, "data": obj}, indent=indent)
+
+
+def decode_versioned(data: Union[bytes, str], version: int, migrations: Optional[Migrations] = None) -> Any:
+    """解码带版本号的数据，旧版本的数据依次执行迁移函数转换为当前版本
+
+    Args:
+        data: encode_versioned 的编码结果，没有版本号的旧数据视为版本 0
+        version: 当前版本号
+        migrations: 迁移函数，版本号 -> 将该版本的数据转换为下一版本的函数
+
+    Returns:
+        Any: 当前版本的数据
+
+    Raises:
+        CodecError: 数据不是合法的 JSON、版本比当前版本新或缺少迁移函数
+    """
+    payload = loads(data)
+    if isinstance(payload, dict) and payload.keys() == {"version", "data"}:
+        found, obj = payload["version"], payload["data"]
+    else:
+        found, obj = 0, payload
+
+    if found > version:
+        raise CodecError(f"数据版本 {found} 比当前支持的版本 {version} 新")
+    migrations = migrations or {}
+    while found < version:
+        if found not in migrations:
+            raise CodecError(f"缺少从版本 {found} 迁移的函数")
+        obj = migrations[found](obj)
+        found += 1
+    return obj
+
+
+def write_atomic(path: Path, data: bytes) -> None:
+    """先写入同一目录下的临时文件并刷新到磁盘，再替换目标文件，写入过程中崩溃时目标文件保持原样"""
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def benchmark(obj: Any, rounds: int = 50) -> Dict[str, Dict[str, float]]:
+    """比较 orjson 和标准库 json 的编解码耗时
+
+    Args:
+        obj: 测试数据
+        rounds: 重复次数
+
+    Returns:
+        Dict[str, Dict[str, float]]: 实现名称 -> {"encode": 平均编码毫秒, "decode": 平均解码毫秒, "bytes": 编码后字节数}
+    """
+    def measure(encode: Callable[[Any], bytes], decode: Callable[[bytes], Any]) -> Dict[str, float]:
+        encoded = encode(obj)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            encode(obj)
+        encode_time = (time.perf_counter() - start) / rounds
+        start = time.perf_counter()
+        for _ in range(rounds):
+            decode(encoded)
+        decode_time = (time.perf_counter() - start) / rounds
+        return {"encode": encode_time * 1000, "decode": decode_time * 1000, "bytes": len(encoded)}
+
+    results = {
+        "json(indent=2)": measure(lambda o: json.dumps(o, ensure_ascii=False, indent=2).encode("utf-8"),
+                                  lambda b: json.loads(b.decode("utf-8"))),
+        "json": measure(lambda o: json.dumps(o, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), json.loads),
+    }
+    if orjson is not None:
+        results["orjson"] = measure(orjson.dumps, orjson.loads)
+    return results
+
+
+if __name__ == "__main__":
+    # 模拟一个群组的聊天记录快照：80 条消息，包含函数调用
+    messages = [{"role": "system", "content": "你是迷迭香。" * 200}]
+    for i in range(40):
+        messages.append({"role": "user", "content": f"博士（TA的名字是：博士{i}，TA的ID是{10000 + i}）今天天气怎么样？" * 3})
+        messages.append({"role": "assistant", "content": None, "tool_calls": [
+            {"id": f"call_{i}", "type": "function",
+             "function": {"name": "get_weather", "arguments": "{\"city\": \"北京\"}"}}]})
+    for name, result in benchmark({"version": 1, "data": {"gen": 1, "messages": messages}}).items():
+        print(f"{name:<16} 编码 {result['encode']:.3f} 毫秒  解码 {result['decode']:.3f} 毫秒  {result['bytes']:.0f} 字节")
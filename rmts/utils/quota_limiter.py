@@ -0,0 +1,182 @@
+"""
+LLM 服务商配额限流器
+服务商按每分钟请求数（RPM）和每分钟 token 数（TPM）限流，超出后返回 429。
+发起请求前按估算的 token 数预留配额，请求完成后用实际用量修正，
+配额不足时排队等待而不是直接失败
+"""
+
+import time
+import asyncio
+
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque
+
+
+@dataclass
+class Reservation:
+    """一次请求预留的配额"""
+    time: float            # 预留时间（time.monotonic）
+    tokens: int            # 当前计入窗口的 token 数，修正后为实际用量
+    estimated: int         # 预留时估算的 token 数
+    expired: bool = False  # 是否已经移出统计窗口
+
+
+@dataclass
+class QuotaStats:
+    """配额限流统计"""
+    requests: int = 0          # 获得配额的请求数
+    queued: int = 0            # 需要排队等待的请求数
+    total_wait: float = 0      # 排队等待的总时间，单位秒
+    max_wait: float = 0        # 最长排队等待时间，单位秒
+    settled: int = 0           # 用实际用量修正过的请求数
+    estimated_tokens: int = 0  # 修正过的请求预留的 token 总数
+    actual_tokens: int = 0     # 修正过的请求实际使用的 token 总数
+
+
+class QuotaLimiter:
+    """滑动窗口的 RPM/TPM 配额限流器
+
+    记录窗口内每次请求的预留，请求数和 token 数都不超过配额时才放行，
+    否则按先来后到排队，等待最早的预留移出窗口或被修正为更小的实际用量。
+    只能在同一个事件循环中使用。
+
+    Args:
+        requests_per_minute: 每个窗口最多的请求数，0 表示不限制
+        tokens_per_minute: 每个窗口最多的 token 数，0 表示不限制
+        window: 窗口长度（秒），默认 60 秒
+
+    Example:
+        >>> limiter = QuotaLimiter(requests_per_minute=60, tokens_per_minute=100000)
+        >>> reservation = await limiter.acquire(estimated_tokens)
+        >>> response = await client.chat.completions.create(...)
+        >>> limiter.settle(reservation, response.usage.total_tokens)
+    """
+
+    def __init__(self, requests_per_minute: int = 0, tokens_per_minute: int = 0, window: float = 60.0):
+        """初始化限流器
+
+        Args:
+            requests_per_minute: 每个窗口最多的请求数，0 表示不限制
+            tokens_per_minute: 每个窗口最多的 token 数，0 表示不限制
+            window: 窗口长度（秒）
+        """
+        if requests_per_minute < 0 or tokens_per_minute < 0:
+            raise ValueError("配额不能小于0")
+        if window <= 0:
+            raise ValueError("窗口长度必须大于0")
+
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.window = float(window)
+        self.stats = QuotaStats()
+        self._reservations: Deque[Reservation] = deque()
+        self._used_tokens = 0                # 窗口内预留的 token 总数
+        self._queue = asyncio.Lock()         # 保证排队的请求按先后顺序获得配额
+        self._changed = asyncio.Event()      # 有预留被修正时唤醒排队的请求
+
+    @property
+    def used_requests(self) -> int:
+        """当前窗口内的请求数"""
+        self._expire(time.monotonic())
+        return len(self._reservations)
+
+    @property
+    def used_tokens(self) -> int:
+        """当前窗口内预留的 token 数"""
+        self._expire(time.monotonic())
+        return self._used_tokens
+
+    async def acquire(self, tokens: int) -> Reservation:
+        """预留一次请求的配额，配额不足时排队等待
+
+        Args:
+            tokens: 估算的 token 数（输入加上最大输出），超过 TPM 配额时按配额计算，
+                避免单个大请求永远无法发起
+
+        Returns:
+            Reservation: 本次预留，请求完成后传给 settle 修正
+        """
+        tokens = max(int(tokens), 0)
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute)
+
+        enqueued = time.monotonic()
+        queued = self._queue.locked()
+        async with self._queue:
+            while True:
+                now = time.monotonic()
+                delay = self._delay(tokens, now)
+                if delay <= 0:
+                    break
+                queued = True
+                self._changed.clear()
+                try:
+                    async with asyncio.timeout(delay):
+                        await self._changed.wait()
+                except TimeoutError:
+                    pass
+            reservation = Reservation(time=now, tokens=tokens, estimated=tokens)
+            self._reservations.append(reservation)
+            self._used_tokens += tokens
+
+        self.stats.requests += 1
+        if queued:
+            wait = now - enqueued
+            self.stats.queued += 1
+            self.stats.total_wait += wait
+            self.stats.max_wait = max(self.stats.max_wait, wait)
+        return reservation
+
+    def settle(self, reservation: Reservation, tokens: int) -> None:
+        """用实际使用的 token 数修正预留
+
+        Args:
+            reservation: acquire 返回的预留
+            tokens: 服务商返回的实际 token 数（response.usage.total_tokens）
+        """
+        tokens = max(int(tokens), 0)
+        self.stats.settled += 1
+        self.stats.estimated_tokens += reservation.estimated
+        self.stats.actual_tokens += tokens
+        if not reservation.expired:
+            self._used_tokens += tokens - reservation.tokens
+        reservation.tokens = tokens
+        self._changed.set()
+
+    def report(self) -> str:
+        """生成配额限流统计报告"""
+        s = self.stats
+        average = s.total_wait / s.queued if s.queued else 0
+        lines = [f"LLM 配额限流统计：请求{s.requests}次，排队{s.queued}次，"
+                 f"平均等待{average:.2f}秒，最长等待{s.max_wait:.2f}秒"]
+        if s.settled:
+            ratio = s.actual_tokens / s.estimated_tokens if s.estimated_tokens else 0
+            lines.append(f"预留token{s.estimated_tokens}，实际token{s.actual_tokens}，实际/预留{ratio:.2f}")
+        return "\n".join(lines)
+
+    def _expire(self, now: float) -> None:
+        """移出窗口外的预留"""
+        while self._reservations and self._reservations[0].time <= now - self.window:
+            reservation = self._reservations.popleft()
+            reservation.expired = True
+            self._used_tokens -= reservation.tokens
+
+    def _delay(self, tokens: int, now: float) -> float:
+        """计算预留 tokens 还需等待的时间，小于等于 0 表示可以立即预留"""
+        self._expire(now)
+        delay = 0.0
+        count = len(self._reservations)
+        if self.requests_per_minute and count >= self.requests_per_minute:
+            # 等到足够多的请求移出窗口
+            oldest = self._reservations[count - self.requests_per_minute]
+            delay = max(delay, oldest.time + self.window - now)
+        if self.tokens_per_minute and self._used_tokens + tokens > self.tokens_per_minute:
+            # 等到足够多的 token 移出窗口
+            excess = self._used_tokens + tokens - self.tokens_per_minute
+            for reservation in self._reservations:
+                excess -= reservation.tokens
+                if excess <= 0:
+                    delay = max(delay, reservation.time + self.window - now)
+                    break
+        return delay
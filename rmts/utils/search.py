@@ -0,0 +1,147 @@
+"""
+本地全文检索
+使用 BM25 排序的内存倒排索引，不依赖分词库：
+    - 中文等 CJK 字符按单字和相邻两字（二元组）切分，单字保证只搜一个字时也能命中，二元组让连续的词得分更高
+    - 英文和数字按连续的字母数字切分，转为小写
+适合聊天记录、记忆等短文本的检索
+"""
+
+import re
+import math
+import heapq
+
+from collections import Counter
+from typing import Dict, Generic, Hashable, List, Tuple, TypeVar
+
+# 连续的 CJK 字符（假名、汉字），或连续的英文字母和数字
+TOKEN_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+|[0-9a-z]+")
+
+K = TypeVar("K", bound=Hashable)
+
+
+def tokenize(text: str) -> List[str]:
+    """将文本切分为检索词
+
+    Args:
+        text: 要切分的文本
+
+    Returns:
+        List[str]: 检索词列表，中文为单字和二元组，英文和数字为小写的单词
+    """
+    tokens: List[str] = []
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        run = match.group(0)
+        if run.isascii():
+            tokens.append(run)
+            continue
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class BM25Index(Generic[K]):
+    """BM25 排序的倒排索引
+
+    每篇文档用一个可哈希的键标识，再次添加相同的键时替换原文档。
+
+    Args:
+        k1: 词频饱和参数，越大词频的影响越大
+        b: 文档长度归一化参数，0 表示不考虑文档长度
+
+    Example:
+        >>> index = BM25Index()
+        >>> index.add(1, "博士喜欢吃草莓蛋糕")
+        >>> index.search("蛋糕")  # [(1, 得分)]
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75) -> None:
+        """初始化索引
+
+        Args:
+            k1: 词频饱和参数
+            b: 文档长度归一化参数
+        """
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[K, int]] = {}  # 检索词 -> {文档 -> 词频}
+        self._terms: Dict[K, Tuple[str, ...]] = {}    # 文档 -> 去重后的检索词，用于删除
+        self._lengths: Dict[K, int] = {}              # 文档 -> 检索词数量
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._lengths
+
+    def add(self, key: K, text: str) -> None:
+        """添加文档，键已存在时替换
+
+        Args:
+            key: 文档的键
+            text: 文档内容
+        """
+        if key in self._lengths:
+            self.remove(key)
+        counts = Counter(tokenize(text))
+        for term, count in counts.items():
+            self._postings.setdefault(term, {})[key] = count
+        self._terms[key] = tuple(counts)
+        length = sum(counts.values())
+        self._lengths[key] = length
+        self._total_length += length
+
+    def remove(self, key: K) -> bool:
+        """删除文档
+
+        Args:
+            key: 文档的键
+
+        Returns:
+            bool: 文档存在时返回 True
+        """
+        if key not in self._lengths:
+            return False
+        for term in self._terms.pop(key):
+            postings = self._postings[term]
+            del postings[key]
+            if not postings:
+                del self._postings[term]
+        self._total_length -= self._lengths.pop(key)
+        return True
+
+    def clear(self) -> None:
+        """删除所有文档"""
+        self._postings.clear()
+        self._terms.clear()
+        self._lengths.clear()
+        self._total_length = 0
+
+    def search(self, query: str, limit: int = 5, min_term_length: int = 1) -> List[Tuple[K, float]]:
+        """检索与查询最相关的文档
+
+        Args:
+            query: 查询文本，按与文档相同的方式切分
+            limit: 最多返回的文档数量
+            min_term_length: 只使用不短于该长度的检索词，为 2 时中文只按二元组匹配，
+                避免只因为“的”“了”等常见单字命中
+
+        Returns:
+            List[Tuple[K, float]]: (文档的键, 得分)，按得分从高到低排列，不包含没有命中任何检索词的文档
+        """
+        count = len(self._lengths)
+        if not count or limit <= 0:
+            return []
+        average_length = self._total_length / count or 1
+        scores: Dict[K, float] = {}
+        for term in set(tokenize(query)):
+            if len(term) < min_term_length:
+                continue
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for key, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[key] / average_length)
+                scores[key] = scores.get(key, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
@@ -0,0 +1,51 @@
+"""
+token 数量估算
+不依赖具体模型的分词器，按字符类型粗略估算，用于离线评估和请求前的配额预留
+参考 DeepSeek 的说明：1 个中文字符约 0.6 个 token，1 个英文字符约 0.3 个 token
+"""
+
+import json
+import math
+
+from typing import Any, Iterable, Optional
+
+# 每个中文（及其他非 ASCII）字符的 token 数
+CJK_TOKEN_RATIO = 0.6
+# 每个 ASCII 字符的 token 数
+ASCII_TOKEN_RATIO = 0.3
+# 每条消息的格式开销（角色、分隔符等）
+MESSAGE_TOKEN_OVERHEAD = 4
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """
+    估算一段文本的 token 数
+    """
+    if not text:
+        return 0
+    ascii_count = sum(1 for ch in text if ch.isascii())
+    other_count = len(text) - ascii_count
+    return math.ceil(ascii_count * ASCII_TOKEN_RATIO + other_count * CJK_TOKEN_RATIO)
+
+def estimate_message_tokens(message: Any) -> int:
+    """
+    估算单条消息的 token 数，包括函数调用的名称和参数
+    """
+    tokens = MESSAGE_TOKEN_OVERHEAD
+    content = message.get("content")
+    if isinstance(content, str):
+        tokens += estimate_tokens(content)
+    elif content:
+        tokens += estimate_tokens(json.dumps(content, ensure_ascii=False))
+    for tool_call in message.get("tool_calls") or []:
+        function = tool_call.get("function", {})
+        tokens += estimate_tokens(function.get("name")) + estimate_tokens(function.get("arguments"))
+    return tokens
+
+def estimate_request_tokens(messages: Iterable[Any], tools: Optional[list] = None) -> int:
+    """
+    估算一次聊天请求的输入 token 数，包括所有消息和函数描述
+    """
+    tokens = sum(estimate_message_tokens(msg) for msg in messages)
+    if tools:
+        tokens += estimate_tokens(json.dumps(tools, ensure_ascii=False))
+    return tokens
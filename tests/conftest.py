@@ -13,7 +13,14 @@ def pytest_collection_modifyitems(items: list[pytest.Item]):
         async_test.add_marker(session_scope_marker, append=False)
 
 @pytest.fixture(scope="session", autouse=True)
-async def after_nonebot_init(after_nonebot_init: None):
+async def after_nonebot_init(after_nonebot_init: None, tmp_path_factory: pytest.TempPathFactory):
+    # 将用户目录指向临时目录，插件在加载和关闭时读写的文件（聊天记录、记忆、用量等）不会写入真实的用户目录
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("HOME", str(tmp_path_factory.mktemp("home")))
+        await load_plugins()
+        yield
+
+async def load_plugins():
     # 加载适配器
     driver = nonebot.get_driver()
     driver.register_adapter(ConsoleAdapter)
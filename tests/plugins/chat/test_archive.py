@@ -0,0 +1,54 @@
+"""聊天记录归档测试"""
+
+import gzip
+import asyncio
+
+
+def user(content: str) -> dict:
+    return {"role": "user", "content": content}
+
+
+def assistant(content: str) -> dict:
+    return {"role": "assistant", "content": content}
+
+
+class TestHistoryArchive:
+    """聊天记录归档测试"""
+
+    def test_trimmed_turns_are_searchable(self, tmp_path):
+        """测试被截断的对话加入归档，重新加载后可以检索"""
+        from rmts.plugins.chat.model import Model
+        from rmts.plugins.chat.archive import HistoryArchive
+
+        model = Model(group_id=1, fc=None, key="", max_history=2)  # type: ignore
+        model.archive = HistoryArchive(1, directory=tmp_path)
+        model.clear_history()
+        for question, answer in [("博士喜欢草莓蛋糕", "记住啦"), ("今天会下雨吗", "带伞吧"), ("晚安", "晚安博士")]:
+            model.messages.append(user(question))
+            model._trim_history()
+            model.messages.append(assistant(answer))
+        asyncio.run(model.archive.flush())
+
+        turns = asyncio.run(HistoryArchive(1, directory=tmp_path).search("蛋糕"))
+        assert [(t.user, t.reply) for t in turns] == [("博士喜欢草莓蛋糕", "记住啦")]
+        assert "迷迭香：记住啦" in turns[0].to_text()
+
+    def test_append_and_recovery(self, tmp_path):
+        """测试每次写入追加一个 gzip 成员，末尾不完整时截断，超过保留轮数时删除最旧的对话"""
+        from rmts.plugins.chat.archive import HistoryArchive
+
+        archive = HistoryArchive(1, max_turns=2, directory=tmp_path)
+
+        async def run():
+            for i in range(3):
+                archive.add([user(f"第{i}轮"), assistant("好")])
+                await archive.flush()
+
+        asyncio.run(run())
+        with open(archive.path, "ab") as f:
+            f.write(gzip.compress(b'{"time": 0, "user": "')[:-8])
+
+        restored = HistoryArchive(1, max_turns=2, directory=tmp_path)
+        assert sorted(t.user for t in asyncio.run(restored.search("轮", limit=5))) == ["第1轮", "第2轮"]
+        assert len(gzip.decompress(archive.path.read_bytes()).splitlines()) == 2
+        assert restored.delete() and not archive.path.exists()
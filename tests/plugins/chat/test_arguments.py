@@ -0,0 +1,52 @@
+"""函数参数修复测试"""
+
+import pytest
+
+
+class TestParseArguments:
+    """参数解析和修复测试"""
+
+    @pytest.mark.parametrize("text, expected, repairs", [
+        ('{"doctor_id": 1}', {"doctor_id": 1}, []),
+        ('{"doctor_id": 1,}', {"doctor_id": 1}, ["trailing_comma"]),
+        ("{'name': '澄闪'}", {"name": "澄闪"}, ["single_quotes"]),
+        ('```json\n{"name": "澄闪"}\n```', {"name": "澄闪"}, ["code_fence"]),
+        ('{"info": ["喜欢猫", "生日是1月', {"info": ["喜欢猫", "生日是1月"]}, ["truncated"]),
+        ('{name: "澄闪", "alt": True}', {"name": "澄闪", "alt": True}, ["python_literal", "unquoted_key"]),
+        ("", {}, ["empty"]),
+    ])
+    def test_repair(self, text, expected, repairs):
+        """测试修复常见的格式错误"""
+        from rmts.plugins.chat.arguments import parse_arguments
+
+        assert parse_arguments(text) == (expected, repairs)
+
+    def test_not_object(self):
+        """测试参数不是 JSON 对象"""
+        from rmts.plugins.chat.arguments import ArgumentError, parse_arguments
+
+        with pytest.raises(ArgumentError):
+            parse_arguments("[1, 2]")
+
+
+class TestArgumentStats:
+    """参数解析统计测试"""
+
+    def test_stats(self):
+        """测试按函数记录修复统计"""
+        from rmts.plugins.chat.arguments import ArgumentError
+        from rmts.plugins.chat.function_calling import FunctionCalling, FunctionContainer, FunctionDescription
+
+        container = FunctionContainer()
+        fd = FunctionDescription("get_doctor_all_info", "").add_param("doctor_id", "", "integer", True)
+        container.function_calling(fd)(lambda doctor_id: "")
+        fc = FunctionCalling(container)
+
+        assert fc.parse_arguments("get_doctor_all_info", '{"doctor_id": 1}') == ({"doctor_id": 1}, False)
+        assert fc.parse_arguments("get_doctor_all_info", "{'doctor_id': '1',}") == ({"doctor_id": 1}, True)
+        with pytest.raises(ArgumentError):
+            fc.parse_arguments("get_doctor_all_info", "doctor_id=1")
+
+        counter = fc.argument_stats.get("get_doctor_all_info")
+        assert (counter.calls, counter.repaired, counter.coerced, counter.failed) == (3, 1, 1, 1)
+        assert counter.repairs == {"single_quotes": 1, "trailing_comma": 1}
@@ -0,0 +1,140 @@
+"""函数调用结果缓存测试"""
+
+import asyncio
+
+
+def make_function_calling(scope="global"):
+    """创建只包含一个带缓存函数的函数调用管理器，返回容器和函数被执行的参数列表"""
+    from rmts.plugins.chat.function_calling import FunctionContainer, FunctionDescription, FunctionError
+
+    container = FunctionContainer()
+    executed = []
+
+    fd = FunctionDescription("get_weather", "获取天气信息")
+    fd.add_param("location", "地点", required=True)
+    fd.add_injection_param("group_id")
+    fd.set_cache(ttl=60, scope=scope)
+
+    @container.function_calling(fd)
+    async def get_weather(location: str, group_id: int) -> str:
+        executed.append(location)
+        await asyncio.sleep(0.01)
+        if location == "未知":
+            raise FunctionError("获取天气信息时发生错误")
+        if location == "错误":
+            return "错误岛：多云"
+        return f"{location}：晴"
+
+    return container, executed
+
+
+class TestToolResultCache:
+    """结果缓存测试"""
+
+    def test_singleflight_and_cross_group(self):
+        """测试同时进行的相同调用只执行一次，不同群组共享全局缓存"""
+        from rmts.plugins.chat.function_calling import FunctionCalling
+
+        container, executed = make_function_calling()
+        fc1 = FunctionCalling(container, {"group_id": 1})
+        fc2 = FunctionCalling(container, {"group_id": 2})
+
+        async def run():
+            results = await asyncio.gather(fc1.run("get_weather", {"location": "北京", "group_id": 1}),
+                                           fc2.run("get_weather", {"location": "北京", "group_id": 2}))
+            results.append(await fc2.run("get_weather", {"location": "北京", "group_id": 2}))
+            return results
+
+        assert asyncio.run(run()) == ["北京：晴"] * 3
+        assert executed == ["北京"]
+        counter = container.result_cache.get_counter("get_weather")
+        assert (counter.misses, counter.joined, counter.hits) == (1, 1, 1)
+
+    def test_group_scope_and_errors(self):
+        """测试群组范围的缓存，失败的结果不被缓存，成功的结果即使包含"错误"也会被缓存"""
+        from rmts.plugins.chat.function_calling import FunctionCalling
+
+        container, executed = make_function_calling(scope="group")
+        fc1 = FunctionCalling(container, {"group_id": 1})
+        fc2 = FunctionCalling(container, {"group_id": 2})
+
+        async def run():
+            for fc in (fc1, fc2, fc1):
+                await fc.run("get_weather", {"location": "北京", "group_id": 0})
+            for location in ("未知", "未知", "错误", "错误"):
+                await fc1.run("get_weather", {"location": location, "group_id": 0})
+
+        asyncio.run(run())
+        assert executed == ["北京", "北京", "未知", "未知", "错误"]
+
+    def test_invalidate_inflight(self):
+        """测试 invalidate 之前开始的调用完成后不缓存结果，之后的相同调用重新执行"""
+        from rmts.plugins.chat.function_calling import FunctionCalling
+
+        container, executed = make_function_calling()
+        container.result_cache.entries.clear()
+        fc = FunctionCalling(container, {"group_id": 1})
+        args = {"location": "北京", "group_id": 1}
+
+        async def run():
+            first = asyncio.create_task(fc.run("get_weather", dict(args)))
+            await asyncio.sleep(0)
+            container.result_cache.invalidate("get_weather")
+            second = asyncio.create_task(fc.run("get_weather", dict(args)))
+            results = await asyncio.gather(first, second)
+            results.append(await fc.run("get_weather", dict(args)))
+            return results
+
+        assert asyncio.run(run()) == ["北京：晴"] * 3
+        assert executed == ["北京", "北京"]
+        assert len(container.result_cache.entries) == 1
+
+    def test_repeat_in_turn(self):
+        """测试同一轮对话中的重复调用直接返回之前的结果"""
+        from rmts.plugins.chat.function_calling import FunctionCalling
+
+        container, executed = make_function_calling()
+        container.result_cache.entries.clear()
+        fc = FunctionCalling(container, {"group_id": 1})
+
+        async def run():
+            fc.begin_turn("")
+            first = await fc.call("get_weather", {"location": "北京"})
+            second = await fc.call("get_weather", {"location": "北京"})
+            fc.end_turn()
+            return first, second
+
+        first, second = asyncio.run(run())
+        assert first == "北京：晴"
+        assert second.startswith("北京：晴") and second != first
+        assert container.result_cache.get_counter("get_weather").repeats == 1
+
+    def test_repeat_after_write(self):
+        """测试没有设置缓存的函数不被同轮重复调用拦截，有副作用的函数执行后清空本轮记录的结果"""
+        from rmts.plugins.chat.function_calling import FunctionCalling, FunctionDescription
+
+        container, executed = make_function_calling()
+        container.result_cache.entries.clear()
+        memories = []
+
+        @container.function_calling(FunctionDescription("query_info", "查询记忆"))
+        async def query_info() -> str:
+            return "、".join(memories) or "没有记忆"
+
+        @container.function_calling(FunctionDescription("add_info", "添加记忆").add_param("info", "").mark_side_effect())
+        async def add_info(info: str) -> str:
+            memories.append(info)
+            return "已记住"
+
+        fc = FunctionCalling(container, {"group_id": 1})
+
+        async def run():
+            fc.begin_turn("")
+            results = [await fc.call("query_info", {}), await fc.call("get_weather", {"location": "北京"})]
+            await fc.call("add_info", {"info": "喜欢猫"})
+            results += [await fc.call("query_info", {}), await fc.call("get_weather", {"location": "北京"})]
+            fc.end_turn()
+            return results
+
+        assert asyncio.run(run()) == ["没有记忆", "北京：晴", "喜欢猫", "北京：晴"]
+        assert container.result_cache.get_counter("get_weather").repeats == 0
@@ -0,0 +1,82 @@
+"""自动注入背景信息测试"""
+
+import asyncio
+
+from types import SimpleNamespace
+
+
+class RecordingClient:
+    """第一次请求要求调用函数、第二次直接回答的桩模型，记录每次请求的消息"""
+
+    def __init__(self):
+        self.chat = self
+        self.completions = self
+        self.requests = []
+
+    async def create(self, **kwargs):
+        from openai.types.chat import ChatCompletionMessage, ChatCompletionMessageFunctionToolCall
+
+        self.requests.append(kwargs["messages"])
+        if len(self.requests) == 1:
+            tool_call = ChatCompletionMessageFunctionToolCall.model_validate(
+                {"id": "call_1", "type": "function", "function": {"name": "get_time", "arguments": "{}"}})
+            message = ChatCompletionMessage(role="assistant", content=None, tool_calls=[tool_call])
+        else:
+            message = ChatCompletionMessage(role="assistant", content="博士在龙门呢")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+
+class TestContext:
+    """背景信息测试"""
+
+    def test_build_context(self):
+        """测试合并各提供器的结果，出错的提供器被忽略，没有博士说的话时不注入"""
+        from rmts.plugins.chat.context import CONTEXT_BEGIN, CONTEXT_END
+        from rmts.plugins.chat.function_calling import FunctionCalling, FunctionContainer
+
+        container = FunctionContainer()
+
+        @container.context_provider("echo")
+        async def echo(text, params):
+            return f"{params['user_id']}说了{text}"
+
+        @container.context_provider("broken")
+        async def broken(text, params):
+            raise RuntimeError("出错了")
+
+        @container.context_provider("empty")
+        async def empty(text, params):
+            return None
+
+        fc = FunctionCalling(container, {"group_id": 1, "user_id": 2})
+        context = asyncio.run(fc.build_context("博士（TA的名字是：a，TA的ID是2），对你说：你好"))
+        assert context is not None
+        assert context.endswith(f"{CONTEXT_BEGIN}\n2说了你好\n{CONTEXT_END}")
+        assert asyncio.run(fc.build_context("博士（TA的名字是：a，TA的ID是2）戳了戳你")) is None
+        # 超过最大长度时截断
+        assert "2说…" in asyncio.run(fc.build_context("博士，对你说：你好", max_length=2))
+
+    def test_injected_into_turn_requests(self):
+        """测试背景信息出现在本轮每次请求的用户消息之前，但不写入历史记录"""
+        from rmts.plugins.chat.model import Model
+        from rmts.plugins.chat.function_calling import FunctionCalling, FunctionContainer, FunctionDescription
+
+        container = FunctionContainer()
+
+        @container.function_calling(FunctionDescription("get_time", "获取当前时间"))
+        async def get_time() -> str:
+            return "12:00"
+
+        model = Model(group_id=1, fc=FunctionCalling(container), key="")
+        model.client = RecordingClient()  # type: ignore
+        model.clear_history()
+
+        assert asyncio.run(model.chat("我在哪", context="博士住在龙门")) == "博士在龙门呢"
+        assert model.last_turn_stats.context_length == len("博士住在龙门")
+        for messages in model.client.requests:
+            assert messages[1] == {"role": "system", "content": "博士住在龙门"}
+            assert messages[2]["content"] == "我在哪"
+        assert all(msg.content != "博士住在龙门" for msg in model.messages)
+        # 下一轮没有背景信息时不再注入
+        asyncio.run(model.chat("谢谢"))
+        assert all(msg["content"] != "博士住在龙门" for msg in model.client.requests[-1])
@@ -0,0 +1,67 @@
+"""函数执行器测试"""
+
+import time
+import asyncio
+
+import pytest
+
+
+def blocking_lookup(key: str) -> str:
+    """模拟阻塞的同步函数"""
+    time.sleep(0.05)
+    return f"{key}: ok"
+
+
+class TestFunctionExecutors:
+    """函数执行器测试"""
+
+    def test_thread_pool(self):
+        """测试同步函数在线程池中执行，不阻塞事件循环，超出并发数量的调用排队"""
+        from rmts.plugins.chat.executor import FunctionExecutors
+        from rmts.plugins.chat.function_calling import FunctionCalling, FunctionContainer, FunctionDescription
+
+        container = FunctionContainer()
+        container.executors = FunctionExecutors(thread_workers=1)
+        container.function_calling(FunctionDescription("lookup", "").add_param("key", ""))(blocking_lookup)
+        fc = FunctionCalling(container)
+
+        async def run():
+            ticks = 0
+
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+
+            task = asyncio.create_task(ticker())
+            results = await asyncio.gather(*(fc.execute("lookup", {"key": k}) for k in "abc"))
+            task.cancel()
+            return results, ticks
+
+        results, ticks = asyncio.run(run())
+        assert results == [("a: ok", True), ("b: ok", True), ("c: ok", True)]
+        assert ticks >= 5
+        stats = container.executors.pools["thread"].stats
+        assert (stats.submitted, stats.completed, stats.max_queued) == (3, 3, 2)
+        assert stats.max_wait >= 0.05
+        container.executors.shutdown()
+
+    def test_modes(self):
+        """测试 inline、process 执行方式和异步函数不能使用线程池"""
+        from rmts.plugins.chat.function_calling import FunctionCalling, FunctionContainer, FunctionDescription
+
+        container = FunctionContainer()
+        container.function_calling(FunctionDescription("inline", "").set_executor("inline"))(lambda: "inline")
+        container.function_calling(
+            FunctionDescription("process", "").add_param("key", "").set_executor("process")
+        )(blocking_lookup)
+        with pytest.raises(ValueError):
+            container.function_calling(FunctionDescription("async", "").set_executor("thread"))(asyncio.sleep)
+        fc = FunctionCalling(container)
+
+        assert container.executor_for("inline") is None
+        assert asyncio.run(fc.execute("inline", {})) == ("inline", True)
+        assert asyncio.run(fc.execute("process", {"key": "a"})) == ("a: ok", True)
+        assert container.executors.pools["process"].stats.completed == 1
+        container.executors.shutdown()
@@ -0,0 +1,110 @@
+"""本地兜底回复测试"""
+
+import asyncio
+
+
+class TestFallbackResponder:
+    """兜底回复器测试"""
+
+    def test_classify_text(self):
+        """测试识别博士说的话"""
+        from rmts.plugins.chat.fallback import FallbackResponder
+
+        responder = FallbackResponder()
+        assert responder.classify("博士（TA的名字是：a，TA的ID是1），对你说：早安") == "morning"
+        assert responder.classify("博士（TA的名字是：a，TA的ID是1），对你说：今天天气怎么样") == "query"
+        assert responder.classify("博士（TA的名字是：a，TA的ID是1），对你说：……") == "default"
+
+    def test_classify_poke(self):
+        """测试识别戳一戳事件"""
+        from rmts.plugins.chat.fallback import FallbackResponder
+
+        responder = FallbackResponder()
+        assert responder.classify("博士（TA的名字是：a，TA的ID是1）戳了戳你") == "poke"
+        # 博士说的话中包含戳一戳关键词时不视为戳一戳事件
+        assert responder.classify("博士（TA的名字是：a，TA的ID是1），对你说：我戳了戳你") != "poke"
+
+    def test_classify_image(self):
+        """测试识别图片消息"""
+        from rmts.plugins.chat.fallback import FallbackResponder
+
+        responder = FallbackResponder()
+        message = "博士（TA的名字是：a，TA的ID是1），发送了图片：第1张图片的链接是：x，对你说：嗯"
+        assert responder.classify(message) == "image"
+
+    def test_respond(self):
+        """测试生成回复"""
+        from rmts.plugins.chat.fallback import FallbackResponder
+
+        responder = FallbackResponder()
+        message = "博士（TA的名字是：a，TA的ID是1），对你说：晚安"
+        assert responder.respond(message) in responder.responses["night"]
+
+
+class TestRecordFallback:
+    """兜底回复写入历史测试"""
+
+    def _make_model(self):
+        from rmts.plugins.chat.model import Model
+
+        model = Model(group_id=1, fc=None, key="", max_history=10)  # type: ignore
+        model.clear_history()
+        return model
+
+    async def test_record_interrupted_turn(self):
+        """测试中断的对话只保留用户消息和兜底回复"""
+        model = self._make_model()
+
+        async def hang():
+            await asyncio.sleep(10)
+
+        async def fake_completion(**kwargs):
+            # 模拟函数调用进行到一半时超时
+            model._add_assistant_message_with_tool_calls(type("M", (), {"content": None, "tool_calls": []})())
+            await hang()
+
+        model._create_chat_completion = fake_completion  # type: ignore
+        try:
+            async with asyncio.timeout(0.01):
+                await model.chat("hello")
+        except TimeoutError:
+            pass
+
+        model.record_fallback("hello", "fallback")
+        assert [m["role"] for m in model.messages] == ["system", "user", "assistant"]
+        assert model.messages[-1]["content"] == "fallback"
+
+    def test_record_without_turn(self):
+        """测试未开始的对话追加用户消息和兜底回复"""
+        model = self._make_model()
+        model.record_fallback("hello", "fallback")
+        assert [m["role"] for m in model.messages] == ["system", "user", "assistant"]
+        assert model.messages[1]["content"] == "hello"
+
+    async def test_save_failure_keeps_reply(self, monkeypatch, tmp_path):
+        """测试得到回复后保存聊天记录出错时，仍然返回模型的回复，不重复记录本轮对话"""
+        from pathlib import Path
+        from types import SimpleNamespace
+        from rmts.plugins.chat import model_pool
+
+        monkeypatch.setattr(Path, "home", lambda: tmp_path)
+        group_id = 9101
+
+        async def create(**kwargs):
+            message = SimpleNamespace(content="博士，我在呢", tool_calls=None)
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+        async def broken_save():
+            raise OSError("磁盘已满")
+
+        monkeypatch.setattr(model_pool, "client", SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create))))
+        model = await model_pool._get_model(group_id)
+        try:
+            monkeypatch.setattr(model, "save_messages", broken_save)
+            reply = await model_pool.chat(group_id, 1, "博士（TA的名字是：a，TA的ID是1），对你说：在吗")
+            assert reply == "博士，我在呢"
+            assert [m["role"] for m in model.messages] == ["system", "user", "assistant"]
+            assert not model_pool._get_lock(group_id).locked()
+        finally:
+            model_pool.pool.pop(group_id, None)
+            model_pool.locks.pop(group_id, None)
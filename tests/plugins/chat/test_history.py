@@ -0,0 +1,94 @@
+"""聊天记录快照和日志测试"""
+
+import json
+import asyncio
+
+
+def user(content: str) -> dict:
+    return {"role": "user", "content": content}
+
+
+def assistant(content: str) -> dict:
+    return {"role": "assistant", "content": content}
+
+
+class TestHistoryJournal:
+    """聊天记录快照和日志测试"""
+
+    def test_journal_and_compaction(self, tmp_path):
+        """测试每轮对话追加日志，截断表示为删除开头的消息，累计到上限后合并为快照"""
+        from rmts.plugins.chat.history import HistoryJournal
+        from rmts.plugins.chat.message_store import MessageStore, StoredMessage
+
+        journal = HistoryJournal(1, compact_entries=3, directory=tmp_path)
+        store = MessageStore([{"role": "system", "content": "提示"}])
+
+        async def run():
+            await journal.record(store.records)  # 第一次记录写入快照
+            store.extend([user("你好"), assistant("博士好")])
+            await journal.record(store.records)
+            store.replace(store.records[:1] + store.records[2:] + [StoredMessage.from_param(user("在吗"))])
+            await journal.record(store.records)
+
+        asyncio.run(run())
+        lines = journal.journal_path.read_text(encoding="utf-8").splitlines()
+        assert [json.loads(line)["drop"] for line in lines] == [0, 1]
+
+        expected = [m.to_param() for m in store.records]
+        assert [m.to_param() for m in asyncio.run(HistoryJournal(1, directory=tmp_path).load())] == expected
+
+        store.append(assistant("在的"))
+        asyncio.run(journal.record(store.records))
+        assert not journal.journal_path.exists()
+        assert journal.generation == 2
+        assert [m.to_param() for m in asyncio.run(HistoryJournal(1, directory=tmp_path).load())] == \
+            [m.to_param() for m in store.records]
+
+    def test_recovery(self, tmp_path):
+        """测试兼容旧版本的快照，忽略旧代数的日志，截掉末尾不完整的日志"""
+        from rmts.plugins.chat.history import HistoryJournal
+
+        journal = HistoryJournal(1, compress=True, directory=tmp_path)
+        journal.snapshot_path.write_text(json.dumps([{"role": "system", "content": "提示"}, user("旧消息")]))
+        with open(journal.journal_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"gen": 1, "drop": 1, "append": []}) + "\n")
+            f.write(json.dumps({"gen": 0, "drop": 0, "append": [assistant("回复")]}) + "\n")
+            f.write('{"gen": 0, "drop": 1, "app')
+
+        data = journal.read()
+        assert [m["content"] for m in data] == ["提示", "旧消息", "回复"]
+        assert journal.journal_path.read_text(encoding="utf-8").count("\n") == 2
+
+        asyncio.run(journal.compact([]))
+        assert journal.compressed_path.exists() and not journal.snapshot_path.exists()
+        assert HistoryJournal(1, directory=tmp_path).read() == []
+        assert journal.delete() and not journal.compressed_path.exists()
+
+    def test_prompt_reference(self, tmp_path):
+        """测试登记过的系统提示只保存内容哈希，加载后共享同一个字符串"""
+        from rmts.plugins.chat.history import HistoryJournal
+        from rmts.plugins.chat.message_store import MessageStore, intern_prompt
+
+        prompt = intern_prompt("你是迷迭香。" * 100)
+        journal = HistoryJournal(1, directory=tmp_path)
+        asyncio.run(journal.compact(MessageStore([{"role": "system", "content": "你是迷迭香。" * 100}]).records))
+        assert "迷迭香" not in journal.snapshot_path.read_text(encoding="utf-8")
+
+        records = asyncio.run(HistoryJournal(1, directory=tmp_path).load())
+        assert records[0].content is prompt
+
+    def test_prompt_upgrade(self, tmp_path, monkeypatch):
+        """测试加载时将旧的系统提示替换为当前的系统提示，并立即写入新的快照"""
+        from pathlib import Path
+        from rmts.plugins.chat.model import Model
+
+        monkeypatch.setattr(Path, "home", lambda: tmp_path)
+        model = Model(group_id=1, fc=None, key="", prompt="新的提示")  # type: ignore
+        model.journal.snapshot_path.parent.mkdir(exist_ok=True)
+        model.journal.snapshot_path.write_text(json.dumps([{"role": "system", "content": "旧的提示"}, user("你好")]))
+
+        asyncio.run(model.init_model(client=object()))  # type: ignore
+        assert model.messages[0].content is model.prompt
+        assert model.messages[1].content == "你好"
+        snapshot = json.loads(model.journal.snapshot_path.read_text(encoding="utf-8"))
+        assert "prompt" in snapshot["data"]["messages"][0]
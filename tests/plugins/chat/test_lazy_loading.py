@@ -0,0 +1,37 @@
+"""函数延迟加载测试"""
+
+import sys
+import asyncio
+
+
+def test_declare_function(tmp_path, monkeypatch):
+    """测试声明的函数在第一次调用时才导入实现模块，之后直接调用注册的函数"""
+    from rmts.plugins.chat import function_calling
+    from rmts.plugins.chat.function_calling import FunctionCalling, FunctionContainer, FunctionDescription
+
+    (tmp_path / "lazy_impl.py").write_text(
+        "from rmts.plugins.chat.function_calling import function_container\n"
+        "fd = function_container.function_descriptions['get_current_time']\n"
+        "@function_container.function_calling(fd)\n"
+        "def get_current_time():\n"
+        "    return '12:00'\n"
+    )
+    (tmp_path / "lazy_empty.py").write_text("")
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    container = FunctionContainer()
+    monkeypatch.setattr(function_calling, "function_container", container)
+    container.declare_function(FunctionDescription("get_current_time", "获取当前时间"), "lazy_impl")
+    container.declare_function(FunctionDescription("missing", "没有实现的函数"), "lazy_empty")
+
+    fc = FunctionCalling(container)
+    assert [schema["function"]["name"] for schema in fc.to_schemas()] == ["get_current_time", "missing"]
+    assert "lazy_impl" not in sys.modules
+
+    assert asyncio.run(fc.call("get_current_time", {})) == "12:00"
+    assert container.functions["get_current_time"] is sys.modules["lazy_impl"].get_current_time
+    # 实现模块没有注册函数时返回错误信息
+    assert asyncio.run(fc.call("missing", {})).startswith("函数调用出错")
+
+    for module in ("lazy_impl", "lazy_empty"):
+        monkeypatch.delitem(sys.modules, module)
@@ -0,0 +1,145 @@
+"""记忆单元测试"""
+
+import json
+import asyncio
+from pathlib import Path
+
+
+class TestMemoryUnit:
+    """记忆单元测试"""
+
+    def test_fifo_without_reads(self):
+        """测试都没有被读取过时先淘汰最早添加的记忆，总长度增量维护"""
+        from rmts.plugins.chat.functions.memory.memory_manager import Memory, MemoryUnit
+
+        unit = MemoryUnit(max_length=6)
+        for i, text in enumerate(["一二", "三四", "五六", "七八"]):
+            unit.add_memory(Memory(text, created=i), now=10)
+        assert unit.get_all_memory() == "三四\n五六\n七八"
+        assert unit.length == 6
+
+    def test_frequently_read_memory_survives(self):
+        """测试经常被读取的记忆不会被之后添加的零碎信息挤掉"""
+        from rmts.plugins.chat.functions.memory.memory_manager import Memory, MemoryUnit, MEMORY_HALF_LIFE
+
+        unit = MemoryUnit(max_length=10)
+        unit.add_memory(Memory("博士住在龙门", created=0), now=0)
+        for day in range(3):
+            unit.read(now=day * 86400)
+        for i in range(3):
+            unit.add_memory(Memory(f"零碎{i}", created=MEMORY_HALF_LIFE), now=MEMORY_HALF_LIFE)
+        assert unit.get_all_memory() == "博士住在龙门\n零碎2"
+
+        # 新记忆本身超过上限时只淘汰它
+        evicted = unit.add_memory(Memory("很长很长很长很长很长的记忆"), now=MEMORY_HALF_LIFE)
+        assert [mem.memory for mem in evicted] == ["很长很长很长很长很长的记忆"]
+        assert unit.get_all_memory() == "博士住在龙门\n零碎2" and unit.length == 9
+
+    def test_load_legacy_file(self, tmp_path, monkeypatch):
+        """测试读取旧版本的记忆文件，保存时记录读取次数"""
+        from rmts.plugins.chat.functions.memory.memory_manager import MemoryManager
+
+        monkeypatch.setattr(Path, "home", lambda: tmp_path)
+        (tmp_path / ".rmts_chat").mkdir()
+        filepath = tmp_path / ".rmts_chat" / "rosmontis_memory_group_1.json"
+        filepath.write_text(json.dumps({"2": {"max_length": 300, "memories": ["喜欢猫"]}}), encoding="utf-8")
+
+        manager = MemoryManager()
+        assert asyncio.run(manager.load_memories_from_file())
+        assert asyncio.run(manager.read_memories("1", "2")) == "喜欢猫"
+        assert asyncio.run(manager.read_memories("1", "3")) is None
+        assert asyncio.run(manager.save_memories_to_file())
+        saved = json.loads(filepath.read_text(encoding="utf-8"))
+        assert saved["version"] == 2 and saved["data"]["2"]["memories"][0]["hits"] == 1
+
+    def test_debounced_flush(self, tmp_path, monkeypatch):
+        """测试添加记忆后在后台合并写入，只写入有变化的群组"""
+        from rmts.plugins.chat.functions.memory.memory_manager import Memory, MemoryManager
+
+        monkeypatch.setattr(Path, "home", lambda: tmp_path)
+        manager = MemoryManager(flush_delay=0.05)
+        group_1 = tmp_path / ".rmts_chat" / "rosmontis_memory_group_1.json"
+        group_2 = tmp_path / ".rmts_chat" / "rosmontis_memory_group_2.json"
+
+        async def run():
+            await manager.add_memories("1", "10", [Memory("喜欢猫")])
+            await manager.add_memories("1", "11", [Memory("喜欢狗")])
+            await manager.add_memories("2", "20", [Memory("住在龙门")])
+            assert not group_1.exists()
+            await asyncio.sleep(0.1)
+            assert group_1.exists() and group_2.exists()
+
+            # 只有第一个群组有变化时，第二个群组的文件不会被重写
+            group_2.unlink()
+            await manager.add_memories("1", "10", [Memory("喜欢草莓")])
+            await asyncio.sleep(0.1)
+            assert not group_2.exists()
+            assert await manager.save_memories_to_file() and not group_2.exists()
+
+        asyncio.run(run())
+        saved = json.loads(group_1.read_text(encoding="utf-8"))["data"]
+        assert [mem["text"] for mem in saved["10"]["memories"]] == ["喜欢猫", "喜欢草莓"]
+        assert list(saved) == ["10", "11"]
+
+    def test_query(self):
+        """测试只返回与查询相关的记忆，并只记录返回的记忆被读取"""
+        from rmts.plugins.chat.functions.memory.memory_manager import Memory, MemoryUnit
+
+        unit = MemoryUnit(max_length=1000)
+        for text in ["博士住在龙门", "博士喜欢草莓蛋糕", "博士的生日是1月1日", "博士养了一只猫"]:
+            unit.add_memory(Memory(text, created=0), now=0)
+        found = unit.query("住在哪个城市 龙门", limit=2, now=10)
+        assert found[0].memory == "博士住在龙门"
+        assert [mem.hits for mem in unit.memory] == [1 if mem in found else 0 for mem in unit.memory]
+        assert unit.query("天气", now=10) == []
+
+        # 被淘汰的记忆不再被检索到
+        unit.max_length = 20
+        unit.add_memory(Memory("博士最近在学做饭", created=10), now=10)
+        assert [mem.memory for mem in unit.query("蛋糕")] == []
+
+    def test_query_pipeline(self, monkeypatch, tmp_path):
+        """测试同时检索个人和全局记忆的组合函数"""
+        from rmts.plugins.chat.function_calling import FunctionCalling, function_container
+        from rmts.plugins.chat.functions import memory
+        from rmts.plugins.chat.functions.memory.memory_manager import Memory, MemoryManager
+
+        monkeypatch.setattr(Path, "home", lambda: tmp_path)
+        mem_manager = MemoryManager()
+        monkeypatch.setattr(memory, "mem_manager", mem_manager)
+
+        async def run():
+            await mem_manager.add_memories("9001", "2", [Memory("博士住在龙门"), Memory("博士喜欢猫")])
+            await mem_manager.add_memories("9001", "9001", [Memory("龙门下周有庆典")])
+            fc = FunctionCalling(function_container, {"group_id": 9001, "user_id": 2, "read_only": False})
+            return await fc.call("query_doctor_and_global_info", {"query": "龙门", "doctor_id": 2})
+
+        result = asyncio.run(run())
+        assert "- 博士住在龙门" in result and "- 龙门下周有庆典" in result
+        assert "猫" not in result
+
+    def test_memory_context(self, monkeypatch, tmp_path):
+        """测试自动注入的记忆只包含相关的个人和全局记忆"""
+        from rmts.plugins.chat.functions import memory
+        from rmts.plugins.chat.functions.memory import memory_context
+        from rmts.plugins.chat.functions.memory.memory_manager import Memory, MemoryManager
+
+        monkeypatch.setattr(Path, "home", lambda: tmp_path)
+        mem_manager = MemoryManager()
+        monkeypatch.setattr(memory, "mem_manager", mem_manager)
+
+        async def run():
+            await mem_manager.add_memories("9002", "3", [Memory("博士住在龙门"), Memory("博士喜欢猫")])
+            await mem_manager.add_memories("9002", "9002", [Memory("龙门下周有庆典"), Memory("博士们都喜欢喝茶")])
+            await mem_manager.save_memories_to_file()
+            result = (await memory_context("博士，龙门今天天气怎么样", {"group_id": 9002, "user_id": 3}),
+                      await memory_context("博士你好呀", {"group_id": 9002, "user_id": 3}))
+            assert not mem_manager._dirty
+            return result
+
+        context, unrelated = asyncio.run(run())
+        assert context == "ID为3的博士的相关信息：\n- 博士住在龙门\n相关的全局信息：\n- 龙门下周有庆典"
+        # 自动注入是只读的，不改变记忆的热度，也不需要保存
+        assert all(mem.hits == 0 for unit in mem_manager.memories["9002"].values() for mem in unit.memory)
+        # 只有“博士”等称呼或单字相同时不注入
+        assert unrelated is None
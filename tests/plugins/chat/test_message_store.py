@@ -0,0 +1,54 @@
+"""紧凑消息存储测试"""
+
+
+MESSAGES = [
+    {"role": "system", "content": "你是迷迭香"},
+    {"role": "user", "content": "博士（TA的名字是：a，TA的ID是1），对你说：今天天气怎么样"},
+    {"role": "assistant", "content": None, "tool_calls": [
+        {"id": "call_1", "type": "function", "function": {"name": "get_weather", "arguments": "{\"city\": \"北京\"}"}}
+    ]},
+    {"role": "tool", "tool_call_id": "call_1", "content": "北京：晴"},
+    {"role": "assistant", "content": "博士，北京今天是晴天哦"},
+    {"role": "user", "content": "博士（TA的名字是：a，TA的ID是1）戳了戳你"},
+]
+
+
+class TestMessageStore:
+    """消息存储测试"""
+
+    def test_round_trip(self):
+        """测试转换回消息参数字典后内容不变"""
+        from rmts.plugins.chat.message_store import MessageStore
+
+        store = MessageStore(MESSAGES)
+        assert len(store) == len(MESSAGES)
+        assert store.to_params() == MESSAGES
+
+    def test_interned_speaker(self):
+        """测试同一位博士的身份前缀共享同一个字符串"""
+        from rmts.plugins.chat.message_store import MessageStore
+
+        store = MessageStore(MESSAGES)
+        assert store[1].speaker is not None
+        assert store[1].speaker is store[5].speaker
+        assert store[1].content == "，对你说：今天天气怎么样"
+
+    def test_mapping_access(self):
+        """测试消息记录的字典式访问"""
+        from rmts.plugins.chat.message_store import MessageStore
+
+        store = MessageStore(MESSAGES)
+        assert store[1]["content"] == MESSAGES[1]["content"]
+        assert "tool_calls" in store[2]
+        assert "tool_calls" not in store[4]
+        assert store[3]["tool_call_id"] == "call_1"
+        assert store[4].get("tool_call_id") is None
+
+    def test_trim(self):
+        """测试截断历史时删除开头的孤立 tool 消息"""
+        from rmts.plugins.chat.model import trim_messages
+        from rmts.plugins.chat.message_store import MessageStore
+
+        store = MessageStore(MESSAGES)
+        store.replace(trim_messages(store.records, 3))
+        assert [msg["role"] for msg in store] == ["system", "assistant", "user"]
@@ -0,0 +1,74 @@
+"""组合函数测试"""
+
+import asyncio
+
+import pytest
+
+
+def make_container():
+    """创建包含三个基础函数的函数容器，返回容器和函数执行的顺序记录"""
+    from rmts.plugins.chat.function_calling import FunctionContainer, FunctionDescription
+
+    container = FunctionContainer()
+    events = []
+
+    @container.function_calling(FunctionDescription("get_time", "获取时间"))
+    async def get_time() -> str:
+        events.append("time")
+        await asyncio.sleep(0.01)
+        return "1月7日"
+
+    fd_birth = FunctionDescription("get_birth", "获取生日").add_param("date", "日期", required=True)
+
+    @container.function_calling(fd_birth)
+    def get_birth(date: str) -> str:
+        events.append("birth")
+        return f"{date}过生日的干员有: 澄闪"
+
+    fd_memory = FunctionDescription("get_memory", "获取记忆").add_injection_param("group_id")
+
+    @container.function_calling(fd_memory)
+    async def get_memory(group_id: int) -> str:
+        events.append("memory")
+        return f"群{group_id}的记忆"
+
+    return container, events
+
+
+class TestFunctionPipeline:
+    """组合函数测试"""
+
+    def test_run(self):
+        """测试按依赖顺序执行步骤，并获得步骤的注入参数"""
+        from rmts.plugins.chat.function_calling import FunctionCalling, FunctionDescription, FunctionPipeline
+
+        container, events = make_container()
+        container.function_pipeline(
+            FunctionPipeline(FunctionDescription("get_today", "获取今天的信息"))
+            .add_step("time", "get_time")
+            .add_step("birth", "get_birth", args=lambda params, results: {"date": results["time"]}, depends=["time"])
+            .add_step("memory", "get_memory")
+        )
+        assert "group_id" in container.function_descriptions["get_today"].injection_parameters
+
+        fc = FunctionCalling(container, {"group_id": 1})
+        result = asyncio.run(fc.call("get_today", {}))
+        assert result == "1月7日\n1月7日过生日的干员有: 澄闪\n群1的记忆"
+        # 没有依赖关系的步骤并发执行，依赖 time 的步骤在 time 完成后执行
+        assert events == ["time", "memory", "birth"]
+
+    def test_invalid(self):
+        """测试未注册的函数和循环依赖"""
+        from rmts.plugins.chat.function_calling import FunctionDescription, FunctionPipeline
+
+        container, _ = make_container()
+        with pytest.raises(ValueError):
+            container.function_pipeline(
+                FunctionPipeline(FunctionDescription("bad", "")).add_step("a", "not_exist")
+            )
+        with pytest.raises(ValueError):
+            container.function_pipeline(
+                FunctionPipeline(FunctionDescription("bad", ""))
+                .add_step("a", "get_time", depends=["b"])
+                .add_step("b", "get_time", depends=["a"])
+            )
@@ -0,0 +1,71 @@
+"""函数调用预取测试"""
+
+import asyncio
+
+
+def make_function_calling():
+    """创建只包含一个可预取函数的函数调用管理器，返回管理器和函数被执行的参数列表"""
+    from rmts.plugins.chat.function_calling import FunctionCalling, FunctionContainer, FunctionDescription
+    from rmts.plugins.chat.prefetch import PrefetchStats, ToolPrefetcher
+
+    container = FunctionContainer()
+    executed = []
+
+    fd = FunctionDescription("get_operator_info", "获取干员信息")
+    fd.add_param("name", "干员名字", required=True)
+    fd.add_injection_param("group_id")
+    fd.set_prefetch(lambda text, _: [{"name": "澄闪"}] if "澄闪" in text else [])
+
+    @container.function_calling(fd)
+    async def get_operator_info(name: str, group_id: int) -> str:
+        executed.append(name)
+        return f"{name}的干员信息"
+
+    fc = FunctionCalling(container, {"group_id": 1, "user_id": 2})
+    fc.prefetcher = ToolPrefetcher(fc, PrefetchStats())
+    return fc, executed
+
+
+class TestToolPrefetcher:
+    """预取器测试"""
+
+    def test_hit(self):
+        """测试模型发起相同的函数调用时使用预取结果"""
+        fc, executed = make_function_calling()
+
+        async def run():
+            fc.begin_turn("博士（TA的名字是：a，TA的ID是2），对你说：澄闪是谁")
+            await asyncio.sleep(0)  # 模拟等待 LLM 请求，预取在此期间执行
+            result = await fc.call("get_operator_info", {"name": "澄闪"})
+            fc.end_turn()
+            return result
+
+        assert asyncio.run(run()) == "澄闪的干员信息"
+        assert executed == ["澄闪"]
+        counter = fc.prefetcher.stats.get("get_operator_info")
+        assert (counter.started, counter.hits, counter.wasted, counter.misses) == (1, 1, 0, 0)
+
+    def test_wasted_and_miss(self):
+        """测试没有被使用的预取和参数不同的函数调用"""
+        fc, executed = make_function_calling()
+
+        async def run():
+            fc.begin_turn("博士（TA的名字是：a，TA的ID是2），对你说：澄闪和黑键")
+            await fc.call("get_operator_info", {"name": "黑键"})
+            fc.end_turn()
+
+        asyncio.run(run())
+        counter = fc.prefetcher.stats.get("get_operator_info")
+        assert (counter.started, counter.hits, counter.wasted, counter.misses) == (1, 0, 1, 1)
+        assert fc.prefetcher.tasks == {}
+
+    def test_no_prefetch_for_events(self):
+        """测试戳一戳等没有对话内容的消息不预取"""
+        fc, executed = make_function_calling()
+
+        async def run():
+            fc.begin_turn("博士（TA的名字是：澄闪，TA的ID是2）戳了戳你")
+            fc.end_turn()
+
+        asyncio.run(run())
+        assert fc.prefetcher.stats.counters == {}
@@ -0,0 +1,44 @@
+"""函数模块重载测试"""
+
+import pytest
+
+
+class TestReload:
+    """函数模块重载测试"""
+
+    def test_reload_package(self):
+        """测试重载后函数被原地替换，顺序不变，原来的函数调用者可以看到新的函数"""
+        from rmts.plugins.chat.function_calling import FunctionCalling, function_container
+
+        fc = FunctionCalling(function_container, {"group_id": 1})
+        order = list(function_container.function_descriptions)
+        old_fd = function_container.function_descriptions["get_weather"]
+
+        names = function_container.reload_package("info")
+        assert "get_weather" in names and "get_today_birthday" in names
+        assert list(function_container.function_descriptions) == order
+        assert fc.function_descriptions["get_weather"] is not old_fd
+        assert function_container.packages["get_weather"] == "info"
+
+    def test_reload_failure(self, monkeypatch):
+        """测试导入出错时保留原来的函数"""
+        from rmts.plugins.chat.function_calling import FunctionDescription, function_container
+
+        old_fd = function_container.function_descriptions["get_weather"]
+
+        def broken(self, *args, **kwargs):
+            raise RuntimeError("broken")
+
+        monkeypatch.setattr(FunctionDescription, "set_selection", broken)
+        assert function_container.reload(["info"])[0].startswith("函数模块 info 重载失败")
+        assert function_container.function_descriptions["get_weather"] is old_fd
+
+    def test_not_reloadable(self):
+        """测试没有 manifest.py 的函数模块和不存在的函数模块不能重载"""
+        from rmts.plugins.chat.function_calling import function_container
+
+        with pytest.raises(ValueError):
+            function_container.reload_package("memory")
+        with pytest.raises(ValueError):
+            function_container.reload_package("unknown")
+        assert function_container.reload() == ["没有源文件有改动的函数模块"]
@@ -0,0 +1,107 @@
+"""离线回放评估测试"""
+
+import json
+import asyncio
+
+import pytest
+
+
+TOOL_CALL = {"id": "call_1", "type": "function", "function": {"name": "get_current_time", "arguments": "{}"}}
+
+
+def write_history(directory):
+    """写入只有日志（没有快照）的聊天记录：第一条用户消息之前有一条被截断留下的回复，之后是两轮对话"""
+    entries = [
+        {"gen": 0, "reset": [{"role": "system", "content": "你是迷迭香"},
+                             {"role": "assistant", "content": "截断留下的回复"}]},
+        {"gen": 0, "drop": 0, "append": [
+            {"role": "user", "content": "几点了"},
+            {"role": "assistant", "content": None, "tool_calls": [TOOL_CALL]},
+            {"role": "tool", "tool_call_id": "call_1", "content": "12:00"},
+            {"role": "assistant", "content": "十二点啦"},
+        ]},
+        {"gen": 0, "drop": 0, "append": [
+            {"role": "user", "content": "谢谢"},
+            {"role": "assistant", "content": "不客气"},
+        ]},
+    ]
+    with open(directory / "rosmontis_chat_group_5.journal.jsonl", "w", encoding="utf-8") as f:
+        for entry in entries:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    return directory / "rosmontis_chat_group_5.json"
+
+
+class TestReplay:
+    """离线回放测试"""
+
+    def test_load_turns(self, tmp_path):
+        """测试从日志格式的聊天记录按轮次还原对话，跳过第一条用户消息之前的回复"""
+        from rmts.plugins.chat.replay import load_turns
+
+        prompt, turns = load_turns(write_history(tmp_path))
+        assert prompt == "你是迷迭香"
+        assert [turn.user_message for turn in turns] == ["几点了", "谢谢"]
+        first = turns[0].responses
+        assert [r.content for r in first] == [None, "十二点啦"]
+        assert first[0].tool_calls == [TOOL_CALL]
+        assert first[0].tool_results == {"call_1": "12:00"}
+        assert [r.content for r in turns[1].responses] == ["不客气"]
+
+        with pytest.raises(ValueError):
+            load_turns(tmp_path / "history.json")
+
+    def test_cached_prefix(self):
+        """测试可命中缓存的前缀只在函数描述相同时计算，到第一条不同的消息为止"""
+        from rmts.utils.tokens import estimate_tokens, estimate_message_tokens
+        from rmts.plugins.chat.replay import ReplayClient, ReplayFunctionCalling
+
+        client = ReplayClient(ReplayFunctionCalling([]), "test")
+        a, b, c = ({"role": "user", "content": text} for text in ("你好", "在吗", "几点了"))
+        tools = [{"type": "function", "function": {"name": "get_current_time"}}]
+        tools_tokens = estimate_tokens(json.dumps(tools, ensure_ascii=False))
+
+        for messages, request_tools in (([a, b], tools), ([a, b, c], tools), ([a, c], tools), ([a, c], None)):
+            client._record_metrics({"model": "m", "messages": messages, "tools": request_tools})
+
+        assert [m.cached_tokens for m in client.metrics] == [
+            0,
+            tools_tokens + estimate_message_tokens(a) + estimate_message_tokens(b),
+            tools_tokens + estimate_message_tokens(a),
+            0,
+        ]
+        assert client.metrics[1].prompt_tokens == tools_tokens + sum(estimate_message_tokens(m) for m in (a, b, c))
+        assert client.metrics[1].request_bytes == len(json.dumps(
+            {"model": "m", "messages": [a, b, c], "tools": tools}, ensure_ascii=False).encode("utf-8"))
+
+    def test_recorded_response(self):
+        """测试按记录返回回复，返回的用量与请求统计一致，函数调用按记录返回结果"""
+        from rmts.utils.tokens import estimate_message_tokens
+        from rmts.plugins.chat.replay import RecordedResponse, RecordedTurn, ReplayClient, ReplayFunctionCalling
+
+        fc = ReplayFunctionCalling([])
+        client = ReplayClient(fc, "test")
+        client.start_turn(RecordedTurn("几点了", [RecordedResponse(None, [TOOL_CALL], {"call_1": "12:00"})]))
+
+        async def run():
+            completion = await client.create(model="m", messages=[{"role": "user", "content": "几点了"}])
+            return completion, await fc.call("get_current_time", {}), await fc.call("get_current_time", {})
+
+        completion, result, repeated = asyncio.run(run())
+        message = completion.choices[0].message
+        assert message.tool_calls[0].id == "call_1"
+        assert completion.usage.prompt_tokens == client.metrics[-1].prompt_tokens
+        assert completion.usage.completion_tokens == estimate_message_tokens(message.model_dump())
+        assert (result, repeated) == ("12:00", "")
+
+    def test_replay_file(self, tmp_path):
+        """测试按轮次回放整个聊天记录，历史消息只在末尾追加时之前的请求全部可命中缓存"""
+        from rmts.plugins.chat.replay import ReplayStrategy, replay_file
+
+        metrics = asyncio.run(replay_file(write_history(tmp_path), ReplayStrategy(max_history=80), []))
+        assert [(m.source, m.turn, m.request) for m in metrics] == \
+            [("rosmontis_chat_group_5.json", 1, 1), ("rosmontis_chat_group_5.json", 1, 2),
+             ("rosmontis_chat_group_5.json", 2, 1)]
+        assert metrics[0].cached_tokens == 0
+        for previous, current in zip(metrics, metrics[1:]):
+            assert current.prompt_tokens > previous.prompt_tokens
+            assert current.cached_tokens == previous.prompt_tokens
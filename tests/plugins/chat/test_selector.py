@@ -0,0 +1,75 @@
+"""按消息选择函数测试"""
+
+import asyncio
+
+
+def make_function_calling():
+    """创建包含一个总是提供的函数和两个按条件提供的函数的函数调用管理器"""
+    from rmts.plugins.chat.function_calling import FunctionCalling, FunctionContainer, FunctionDescription
+    from rmts.plugins.chat.selector import SelectionStats, ToolSelector
+
+    container = FunctionContainer()
+    container.function_calling(FunctionDescription("get_current_time", "获取当前时间"))(lambda: "12:00")
+    container.function_calling(
+        FunctionDescription("get_weather", "获取天气信息").set_selection(keywords=["天气"])
+    )(lambda: "晴")
+    container.function_calling(
+        FunctionDescription("analyze_image", "分析图片").set_selection(image=True)
+    )(lambda: "一只猫")
+
+    fc = FunctionCalling(container, {"group_id": 1})
+    stats = SelectionStats()
+    fc.selector = ToolSelector(fc, stats, recent_turns=1, sticky_turns=1)
+    return fc, stats
+
+
+def offered(fc):
+    return [schema["function"]["name"] for schema in fc.to_schemas()]
+
+
+class TestToolSelector:
+    """函数选择测试"""
+
+    def test_select(self):
+        """测试按关键词、图片选择函数，最近调用过的函数继续提供"""
+        from rmts.plugins.chat.message import USER_IMAGE_MARKER, USER_TEXT_MARKER
+
+        fc, stats = make_function_calling()
+
+        fc.begin_turn(f"{USER_TEXT_MARKER}早上好")
+        assert offered(fc) == ["get_current_time", "request_more_functions"]
+        fc.end_turn()
+
+        fc.begin_turn(f"{USER_TEXT_MARKER}今天天气怎么样")
+        assert offered(fc) == ["get_current_time", "get_weather", "request_more_functions"]
+        asyncio.run(fc.call("get_weather", {}))
+        fc.end_turn()
+
+        # 上一轮调用过的函数继续提供
+        fc.begin_turn(f"博士{USER_IMAGE_MARKER}http://example.com/a.png{USER_TEXT_MARKER}那明天呢")
+        assert offered(fc) == ["get_current_time", "get_weather", "analyze_image", "request_more_functions"]
+        fc.end_turn()
+
+        assert (stats.turns, stats.offered, stats.widened) == (3, 6, 0)
+
+    def test_widen(self):
+        """测试模型需要的函数没有提供时扩展到全部函数，并记录没有提供的函数"""
+        from rmts.plugins.chat.message import USER_TEXT_MARKER
+
+        fc, stats = make_function_calling()
+
+        fc.begin_turn(f"{USER_TEXT_MARKER}帮我看看这个")
+        assert asyncio.run(fc.call("request_more_functions", {})).startswith("已提供全部函数")
+        assert offered(fc) == ["get_current_time", "get_weather", "analyze_image"]
+        asyncio.run(fc.call("analyze_image", {}))
+        fc.end_turn()
+
+        # 直接调用了没有提供的函数
+        fc.begin_turn(f"{USER_TEXT_MARKER}下雨吗")
+        assert "get_weather" not in offered(fc)
+        assert asyncio.run(fc.call("get_weather", {})) == "晴"
+        assert "get_weather" in offered(fc)
+        fc.end_turn()
+
+        assert stats.widened == 2
+        assert stats.not_offered == {"analyze_image": 1, "get_weather": 1}
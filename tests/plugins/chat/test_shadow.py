@@ -0,0 +1,171 @@
+"""影子模式测试"""
+
+import json
+import asyncio
+
+from types import SimpleNamespace
+
+
+class ToolCallingClient:
+    """第一次请求要求同时调用几个函数、第二次直接回答的桩模型，记录每次请求的消息"""
+
+    def __init__(self, calls=(("send_message", {}), ("get_time", {}))):
+        self.chat = self
+        self.completions = self
+        self.calls = calls
+        self.requests = []
+
+    async def create(self, **kwargs):
+        from openai.types.chat import ChatCompletionMessage, ChatCompletionMessageFunctionToolCall
+
+        self.requests.append(list(kwargs["messages"]))
+        if len(self.requests) == 1:
+            tool_calls = [ChatCompletionMessageFunctionToolCall.model_validate(
+                {"id": f"call_{name}", "type": "function",
+                 "function": {"name": name, "arguments": json.dumps(args, ensure_ascii=False)}})
+                for name, args in self.calls]
+            message = ChatCompletionMessage(role="assistant", content=None, tool_calls=tool_calls)
+        else:
+            message = ChatCompletionMessage(role="assistant", content="博士，已经告诉大家了")
+        usage = SimpleNamespace(prompt_tokens=100, completion_tokens=10, prompt_tokens_details=None)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+    async def close(self):
+        pass
+
+
+def make_evaluator(container, sample_rate=1.0, model="candidate"):
+    from rmts.plugins.chat.shadow import ShadowEvaluator
+
+    return ShadowEvaluator(function_container=container, key="", base_url="", model=model,
+                           sample_rate=sample_rate, max_history=10)
+
+
+class TestShadowEvaluator:
+    """影子模式评估器测试"""
+
+    async def test_side_effect_not_executed(self, monkeypatch, tmp_path):
+        """测试候选模型调用有副作用的函数时只得到模拟结果，没有副作用的函数正常执行，对比记录写入文件"""
+        from pathlib import Path
+        from rmts.plugins.chat.model import TurnStats
+        from rmts.plugins.chat.function_calling import FunctionContainer, FunctionDescription
+
+        monkeypatch.setattr(Path, "home", lambda: tmp_path)
+        container = FunctionContainer()
+        called = []
+
+        @container.function_calling(FunctionDescription("send_message", "发送消息").mark_side_effect())
+        async def send_message() -> str:
+            called.append("send_message")
+            return "消息已发送"
+
+        @container.function_calling(FunctionDescription("get_time", "获取当前时间"))
+        async def get_time() -> str:
+            called.append("get_time")
+            return "12:00"
+
+        evaluator = make_evaluator(container)
+        evaluator.client = ToolCallingClient()  # type: ignore
+        production = TurnStats(latency=1.0, rounds=1, response_length=5)
+        history = [{"role": "system", "content": "你是迷迭香"}]
+        evaluator.submit(group_id=1, user_id=2, messages=history, user_message="告诉大家现在几点",
+                         production_model="production", production=production)
+        await asyncio.gather(*evaluator._tasks)
+
+        assert called == ["get_time"]
+        tool_results = {m["tool_call_id"]: m["content"] for m in evaluator.client.requests[-1] if m.get("role") == "tool"}
+        assert tool_results == {"call_send_message": "已执行函数 send_message", "call_get_time": "12:00"}
+        # 正式模型的历史消息不会被修改
+        assert history == [{"role": "system", "content": "你是迷迭香"}]
+
+        record = evaluator.records[0]
+        assert record.error is None and record.shadow is not None
+        assert (record.shadow.rounds, record.shadow.tool_calls) == (2, 2)
+        lines = evaluator.filepath.read_text(encoding="utf-8").splitlines()
+        assert len(lines) == 1
+        saved = json.loads(lines[0])
+        assert (saved["production_model"], saved["shadow_model"]) == ("production", "candidate")
+        assert saved["shadow"]["response_length"] == len("博士，已经告诉大家了")
+        await evaluator.close()
+
+    async def test_no_production_state_change(self, monkeypatch, tmp_path):
+        """测试影子模式不调用计费的函数、不写入用量账本，读取记忆时不改变记忆的热度"""
+        from pathlib import Path
+        from rmts.plugins.chat.model import TurnStats
+        from rmts.plugins.chat.usage import usage_ledger
+        from rmts.plugins.chat.functions import memory
+        from rmts.plugins.chat.function_calling import function_container
+        from rmts.plugins.chat.functions.memory.memory_manager import Memory, MemoryManager
+
+        monkeypatch.setattr(Path, "home", lambda: tmp_path)
+        mem_manager = MemoryManager()
+        monkeypatch.setattr(memory, "mem_manager", mem_manager)
+        recorded = []
+        monkeypatch.setattr(usage_ledger, "record", lambda *args: recorded.append(args))
+        await mem_manager.add_memories("9201", "2", [Memory("博士住在龙门")])
+        await mem_manager.save_memories_to_file()
+
+        evaluator = make_evaluator(function_container)
+        evaluator.client = ToolCallingClient((
+            ("analyze_image", {"image_url": "https://multimedia.nt.qq.com.cn/download?appid=1"}),
+            ("query_doctor_info", {"query": "龙门", "doctor_id": 2}),
+            ("get_doctor_all_info", {"doctor_id": 2}),
+        ))  # type: ignore
+        evaluator.submit(group_id=9201, user_id=2, messages=[{"role": "system", "content": "你是迷迭香"}],
+                         user_message="看看这张图", production_model="production", production=TurnStats())
+        await asyncio.gather(*evaluator._tasks)
+
+        tool_results = {m["tool_call_id"]: m["content"] for m in evaluator.client.requests[-1] if m.get("role") == "tool"}
+        assert "暂时不可用" in tool_results["call_analyze_image"]
+        assert "博士住在龙门" in tool_results["call_query_doctor_info"]
+        assert "博士住在龙门" in tool_results["call_get_doctor_all_info"]
+        assert recorded == []
+        assert all(mem.hits == 0 for mem in mem_manager.memories["9201"]["2"].memory)
+        assert not mem_manager._dirty
+        await evaluator.close()
+
+    def test_sample_rate(self, monkeypatch):
+        """测试采样比例，没有设置候选模型或比例为 0 时不采样"""
+        import random
+        from rmts.plugins.chat.function_calling import FunctionContainer
+
+        container = FunctionContainer()
+        evaluator = make_evaluator(container, sample_rate=0.3)
+        values = iter([0.1, 0.29, 0.3, 0.9])
+        monkeypatch.setattr(random, "random", lambda: next(values))
+        assert [evaluator.sample() for _ in range(4)] == [True, True, False, False]
+        monkeypatch.undo()
+
+        random.seed(0)
+        ratio = sum(evaluator.sample() for _ in range(10000)) / 10000
+        assert abs(ratio - 0.3) < 0.02
+        assert not any(make_evaluator(container, sample_rate=0).sample() for _ in range(100))
+        assert not any(make_evaluator(container, model="").sample() for _ in range(100))
+
+    def test_report(self):
+        """测试对比报告只统计成功的记录，并给出失败的记录数"""
+        from rmts.plugins.chat.model import TurnStats
+        from rmts.plugins.chat.shadow import ShadowRecord
+        from rmts.plugins.chat.function_calling import FunctionContainer
+
+        evaluator = make_evaluator(FunctionContainer())
+        assert evaluator.report() == "影子模式暂无对比记录"
+
+        def record(production, shadow, error=None):
+            return ShadowRecord(time=0, group_id=1, production_model="production", shadow_model="candidate",
+                                production=production, shadow=shadow, error=error)
+
+        evaluator.records.append(record(TurnStats(), None, "超时"))
+        assert evaluator.report() == "影子模式对比报告（candidate），共1条记录，失败1条"
+
+        evaluator.records.append(record(TurnStats(1.0, 1, 0, 100, 10, 20), TurnStats(2.0, 2, 1, 300, 30, 40)))
+        evaluator.records.append(record(TurnStats(3.0, 3, 2, 300, 30, 40), TurnStats(1.0, 1, 0, 100, 10, 20)))
+        assert evaluator.report().splitlines() == [
+            "影子模式对比报告（candidate），共3条记录，失败1条",
+            "平均耗时(秒): 正式 2.00，候选 1.50",
+            "平均请求次数: 正式 2.00，候选 1.50",
+            "平均函数调用次数: 正式 1.00，候选 0.50",
+            "平均输入token: 正式 200.00，候选 200.00",
+            "平均输出token: 正式 20.00，候选 20.00",
+            "平均回复长度: 正式 30.00，候选 30.00",
+        ]
@@ -0,0 +1,129 @@
+"""函数超时和单轮对话时间预算测试"""
+
+import json
+import asyncio
+
+from types import SimpleNamespace
+
+
+def make_function_calling():
+    """创建包含一个慢函数的函数调用管理器"""
+    from rmts.plugins.chat.function_calling import FunctionCalling, FunctionContainer, FunctionDescription
+
+    container = FunctionContainer()
+
+    @container.function_calling(FunctionDescription("get_weather", "获取天气信息").set_timeout(0.05))
+    async def get_weather() -> str:
+        await asyncio.sleep(1)
+        return "晴"
+
+    return FunctionCalling(container)
+
+
+class SlowClient:
+    """每次都较慢地要求调用函数的桩模型，记录每次请求的 tool_choice"""
+
+    def __init__(self):
+        self.chat = self
+        self.completions = self
+        self.tool_choices = []
+
+    async def create(self, **kwargs):
+        from openai.types.chat import ChatCompletionMessage, ChatCompletionMessageFunctionToolCall
+
+        self.tool_choices.append(kwargs["tool_choice"])
+        if kwargs["tool_choice"] == "none":
+            message = ChatCompletionMessage(role="assistant", content="博士，我不太清楚呢")
+        else:
+            await asyncio.sleep(0.06)
+            tool_call = ChatCompletionMessageFunctionToolCall.model_validate(
+                {"id": f"call_{len(self.tool_choices)}", "type": "function",
+                 "function": {"name": "get_weather", "arguments": "{}"}})
+            message = ChatCompletionMessage(role="assistant", content=None, tool_calls=[tool_call])
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+
+class IgnoringClient(SlowClient):
+    """忽略 tool_choice="none"、总是要求调用函数的桩模型"""
+
+    async def create(self, **kwargs):
+        from openai.types.chat import ChatCompletionMessage, ChatCompletionMessageFunctionToolCall
+
+        self.tool_choices.append(kwargs["tool_choice"])
+        await asyncio.sleep(0.06)
+        tool_call = ChatCompletionMessageFunctionToolCall.model_validate(
+            {"id": f"call_{len(self.tool_choices)}", "type": "function",
+             "function": {"name": "get_weather", "arguments": "{}"}})
+        message = ChatCompletionMessage(role="assistant", content=None, tool_calls=[tool_call])
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+
+class TestTimeout:
+    """超时测试"""
+
+    def test_function_timeout(self):
+        """测试函数超时后返回结构化的超时结果"""
+        fc = make_function_calling()
+        result = json.loads(asyncio.run(fc.call("get_weather", {})))
+        assert result["status"] == "timeout"
+        assert result["function"] == "get_weather"
+
+    def test_retry_after_timeout(self):
+        """测试超时的调用不被记录为本轮的结果，同一轮中可以重试"""
+        from rmts.plugins.chat.function_calling import FunctionCalling, FunctionContainer, FunctionDescription
+
+        container = FunctionContainer()
+        delays = [1, 0]
+
+        @container.function_calling(FunctionDescription("get_weather", "获取天气信息").set_timeout(0.05).set_cache(ttl=60))
+        async def get_weather() -> str:
+            await asyncio.sleep(delays.pop(0))
+            return "晴"
+
+        fc = FunctionCalling(container)
+
+        async def run():
+            fc.begin_turn("")
+            first = await fc.call("get_weather", {})
+            container.result_cache.invalidate("get_weather")
+            second = await fc.call("get_weather", {})
+            fc.end_turn()
+            return first, second
+
+        first, second = asyncio.run(run())
+        assert json.loads(first)["status"] == "timeout"
+        assert second == "晴"
+
+    def test_turn_budget(self, monkeypatch):
+        """测试时间预算用完后禁止函数调用并要求模型直接回答"""
+        from rmts.plugins.chat import model as model_module
+
+        monkeypatch.setattr(model_module, "FINAL_ANSWER_RESERVE", 0.05)
+        model = model_module.Model(group_id=1, fc=make_function_calling(), key="", turn_budget=0.2)
+        model.client = SlowClient()  # type: ignore
+        model.clear_history()
+
+        reply = asyncio.run(model.chat("今天天气怎么样"))
+        assert reply == "博士，我不太清楚呢"
+        assert model.last_turn_stats.forced_final
+        assert model.client.tool_choices[-1] == "none"
+        assert model.client.tool_choices.count("none") == 1
+        # 时间提示不会写入历史记录
+        assert all(msg["role"] != "system" for msg in model.messages[1:])
+
+    def test_forced_final_without_reply(self, monkeypatch):
+        """测试要求直接回答时模型仍然只发起函数调用，抛出异常交给兜底回复，不把空回复写入历史记录"""
+        import pytest
+        from rmts.plugins.chat import model as model_module
+
+        monkeypatch.setattr(model_module, "FINAL_ANSWER_RESERVE", 0.1)
+        model = model_module.Model(group_id=1, fc=make_function_calling(), key="", turn_budget=0.2)
+        model.client = IgnoringClient()  # type: ignore
+        model.clear_history()
+
+        with pytest.raises(model_module.EmptyReplyError):
+            asyncio.run(model.chat("今天天气怎么样"))
+        assert model.client.tool_choices[-1] == "none"
+        model.record_fallback("今天天气怎么样", "博士，我不太清楚呢")
+        assert [m["role"] for m in model.messages] == ["system", "user", "assistant"]
+        assert model.messages[-1]["content"] == "博士，我不太清楚呢"
@@ -0,0 +1,71 @@
+"""token 用量账本测试"""
+
+import asyncio
+
+from datetime import date, timedelta
+from pathlib import Path
+
+
+class TestUsageLedger:
+    """token 用量账本测试"""
+
+    def test_record_and_rollup(self, tmp_path, monkeypatch):
+        """测试记录后按维度汇总，重新加载后结果不变"""
+        from rmts.plugins.chat.usage import UsageLedger, CHAT_FUNCTION
+
+        monkeypatch.setattr(Path, "home", lambda: tmp_path)
+        ledger = UsageLedger()
+        ledger.record(1, 10, "deepseek-chat", CHAT_FUNCTION, 100, 20)
+        ledger.record(1, 11, "deepseek-chat", CHAT_FUNCTION, 200, 30)
+        ledger.record(2, 10, "vision", "analyze_image", 500, 50)
+        ledger.close()
+
+        reloaded = UsageLedger()
+        assert len(reloaded) == 3
+        groups = reloaded.rollup("group")
+        assert (groups[1].calls, groups[1].total_tokens) == (2, 350)
+        assert groups[2].total_tokens == 550
+        assert reloaded.rollup("user", group_id=1)[11].prompt_tokens == 200
+        assert list(reloaded.rollup("function")) == [CHAT_FUNCTION, "analyze_image"]
+        assert list(reloaded.rollup("day")) == [date.today()]
+        assert reloaded.rollup("group", since=date.today() + timedelta(days=1)) == {}
+        assert reloaded.group_tokens(1) == 350
+        assert "群2: 请求1次" in reloaded.report()
+
+    def test_truncated_record(self, tmp_path, monkeypatch):
+        """测试加载时截掉末尾不完整的记录"""
+        from rmts.plugins.chat.usage import UsageLedger, RECORD_FORMAT
+
+        monkeypatch.setattr(Path, "home", lambda: tmp_path)
+        ledger = UsageLedger()
+        ledger.record(1, 10, "deepseek-chat", "", 100, 20)
+        ledger.close()
+        with open(ledger.filepath, "ab") as f:
+            f.write(b"\x00" * 5)
+
+        reloaded = UsageLedger()
+        assert len(reloaded) == 1
+        assert ledger.filepath.stat().st_size == RECORD_FORMAT.size
+
+    def test_load_and_retention(self, tmp_path, monkeypatch):
+        """测试在线程中加载时丢弃过期的记录，关闭时从文件中删除"""
+        from rmts.plugins.chat.usage import UsageLedger, RECORD_FORMAT
+
+        monkeypatch.setattr(Path, "home", lambda: tmp_path)
+        ledger = UsageLedger()
+        ledger.record(1, 10, "deepseek-chat", "", 100, 20)
+        ledger.close()
+        # 在今天的记录之前插入两条 10 天前的记录
+        old_day = date.today().toordinal() - 10
+        old = b"".join(RECORD_FORMAT.pack(old_day, 2, 10, 0, 0, 50, 5) for _ in range(2))
+        ledger.filepath.write_bytes(old + ledger.filepath.read_bytes())
+
+        reloaded = UsageLedger(retention_days=7)
+        asyncio.run(reloaded.load())
+        assert len(reloaded) == 1 and list(reloaded.rollup("group")) == [1]
+        reloaded.record(1, 11, "deepseek-chat", "", 1, 1)
+        reloaded.close()
+        assert ledger.filepath.stat().st_size == 2 * RECORD_FORMAT.size
+
+        # 保留天数足够长时所有记录都被加载
+        assert len(UsageLedger(retention_days=30)) == 2
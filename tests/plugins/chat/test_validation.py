@@ -0,0 +1,73 @@
+"""函数参数校验测试"""
+
+import pytest
+
+
+def make_description():
+    from rmts.plugins.chat.function_calling import FunctionDescription
+
+    return (FunctionDescription("f", "")
+            .add_param("doctor_id", "", "integer", required=True)
+            .add_param("name", "", "string")
+            .add_param("ok", "", "boolean")
+            .add_list_param("info", "", "string")
+            .add_enum_param("type", "", ["开心", "难过", "生气", "疑惑", "晚安", "早安", "抱抱", "谢谢", "再见"])
+            .add_injection_param("group_id"))
+
+
+class TestArgumentValidator:
+    """参数校验器测试"""
+
+    def test_coerce(self):
+        """测试按声明的类型转换参数，删除值为 null 的可选参数，修正相近的参数名"""
+        fd = make_description()
+        args = {"doctor_id": "123", "name": 7, "ok": "true", "info": "喜欢猫", "type": " 开心", "group_id": 1}
+        assert sorted(fd.validator.validate(args)) == ["doctor_id", "info", "name", "ok", "type"]
+        assert args == {"doctor_id": 123, "name": "7", "ok": True, "info": ["喜欢猫"], "type": "开心", "group_id": 1}
+        # 已经是正确类型的参数不被转换
+        assert fd.validator.validate(args) == []
+
+        args = {"doctorId": 1, "name": None, "unknown": 2}
+        assert fd.validator.validate(args) == ["doctorId", "unknown", "name"]
+        assert args == {"doctor_id": 1}
+
+    def test_errors(self):
+        """测试参数错误时一次返回所有错误，枚举值给出相近的可选值"""
+        from rmts.plugins.chat.validation import ValidationError
+
+        fd = make_description()
+        with pytest.raises(ValidationError) as e:
+            fd.validator.validate({"ok": "也许", "info": ["a", {"b": 1}], "type": "开心呀"})
+        assert e.value.errors == [
+            "缺少必需参数 doctor_id（整数）",
+            'ok 应为布尔值，实际为 "也许"',
+            'info[1] 应为字符串，实际为 {"b": 1}',
+            'type 的值 "开心呀" 不是可选值，可能是 开心',
+        ]
+        assert str(e.value).startswith("函数 f 的参数有误，请修正后重新调用：缺少必需参数")
+
+    def test_recompile(self):
+        """测试添加参数后重新编译校验器"""
+        from rmts.plugins.chat.validation import ValidationError
+
+        fd = make_description()
+        assert fd.validator.validate({"doctor_id": 1}) == []
+        fd.add_param("date", "", required=True)
+        with pytest.raises(ValidationError):
+            fd.validator.validate({"doctor_id": 1})
+
+    def test_lazy_enum(self):
+        """测试延迟计算的枚举值在第一次生成描述或校验参数时才计算，且只计算一次"""
+        from rmts.plugins.chat.function_calling import FunctionDescription
+
+        calls = []
+
+        def stickers():
+            calls.append(1)
+            return ["开心", "难过"]
+
+        fd = FunctionDescription("f", "").add_enum_param("type", "", stickers, required=True)
+        assert calls == []
+        assert fd.validator.validate({"type": " 开心"}) == ["type"]
+        assert fd.to_schema()["function"]["parameters"]["properties"]["type"]["enum"] == ["开心", "难过"]
+        assert calls == [1]
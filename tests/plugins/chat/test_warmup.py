@@ -0,0 +1,41 @@
+"""历史记录预加载测试"""
+
+import time
+import asyncio
+from pathlib import Path
+
+
+class TestWarmup:
+    """历史记录预加载测试"""
+
+    def test_active_groups(self, tmp_path):
+        """测试只保存最近活跃的群组，读取时与本次运行的记录合并"""
+        from rmts.plugins.chat.warmup import ActiveGroups
+
+        groups = ActiveGroups(directory=tmp_path)
+        for group_id in (1, 2, 3):
+            groups.touch(group_id)
+            time.sleep(0.001)
+        groups.save(limit=2)
+
+        restored = ActiveGroups(directory=tmp_path)
+        restored.last_active[4] = time.time() + 1
+        restored.load()
+        assert restored.recent(10) == [4, 3, 2]
+
+    def test_loop_lag_monitor(self):
+        """测试阻塞事件循环的同步调用被记录为卡顿"""
+        from rmts.plugins.chat.warmup import LoopLagMonitor
+
+        monitor = LoopLagMonitor(interval=0.01, threshold=0.05)
+
+        async def run():
+            monitor.start()
+            await asyncio.sleep(0.03)
+            time.sleep(0.1)
+            await asyncio.sleep(0.03)
+            await monitor.stop()
+
+        asyncio.run(run())
+        assert monitor.stalls == 1
+        assert monitor.max_lag >= 0.08
@@ -0,0 +1,58 @@
+"""JSON 编解码测试"""
+
+import json
+
+import pytest
+
+from rmts.utils import codec
+from rmts.utils.codec import CodecError, decode_versioned, dumps, encode_versioned, loads, write_atomic
+
+
+class TestCodec:
+    """JSON 编解码测试"""
+
+    def test_round_trip(self):
+        """测试编码为紧凑的 UTF-8 字节且不转义中文，与标准库 json 兼容"""
+        data = {"role": "user", "content": "博士，今天天气怎么样？", "n": [1, 2.5, None, True]}
+        encoded = dumps(data)
+        assert isinstance(encoded, bytes)
+        assert "博士".encode("utf-8") in encoded
+        assert b": " not in encoded
+        assert loads(encoded) == data
+        assert loads(encoded.decode("utf-8")) == data
+        assert json.loads(encoded) == data
+
+    def test_stdlib_fallback_same_output(self, monkeypatch):
+        """测试未安装 orjson 时输出相同"""
+        data = {"a": ["迷迭香", {"b": 1}]}
+        expected = dumps(data)
+        monkeypatch.setattr(codec, "orjson", None)
+        assert dumps(data) == expected
+        assert loads(expected) == data
+
+    def test_invalid(self):
+        """测试非法数据抛出 CodecError"""
+        with pytest.raises(CodecError):
+            loads(b'{"a": ')
+
+    def test_versioned_migration(self):
+        """测试没有版本号的旧数据依次迁移到当前版本"""
+        migrations = {0: lambda old: {"items": old}, 1: lambda old: {**old, "count": len(old["items"])}}
+        assert decode_versioned(json.dumps([1, 2]), 2, migrations) == {"items": [1, 2], "count": 2}
+        assert decode_versioned(encode_versioned({"items": [3]}, 1), 2, migrations) == {"items": [3], "count": 1}
+        assert decode_versioned(encode_versioned("x", 2), 2, migrations) == "x"
+
+    def test_versioned_errors(self):
+        """测试版本比当前新或缺少迁移函数时抛出 CodecError"""
+        with pytest.raises(CodecError, match="新"):
+            decode_versioned(encode_versioned({}, 3), 2)
+        with pytest.raises(CodecError, match="缺少"):
+            decode_versioned(encode_versioned({}, 1), 2)
+
+    def test_write_atomic(self, tmp_path):
+        """测试原子写入覆盖原文件且不留下临时文件"""
+        path = tmp_path / "data.json"
+        path.write_bytes(b"old")
+        write_atomic(path, dumps({"a": 1}))
+        assert loads(path.read_bytes()) == {"a": 1}
+        assert list(tmp_path.iterdir()) == [path]
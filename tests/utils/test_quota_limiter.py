@@ -0,0 +1,64 @@
+"""配额限流器测试"""
+
+import time
+import asyncio
+
+import pytest
+
+from rmts.utils.quota_limiter import QuotaLimiter
+
+
+class TestQuotaLimiter:
+    """配额限流器测试"""
+
+    def test_init_invalid_params(self):
+        """测试无效参数"""
+        with pytest.raises(ValueError, match="配额不能小于0"):
+            QuotaLimiter(requests_per_minute=-1)
+        with pytest.raises(ValueError, match="窗口长度必须大于0"):
+            QuotaLimiter(window=0)
+
+    def test_requests_queue(self):
+        """测试请求数达到配额时排队，窗口滑过后按顺序放行"""
+        limiter = QuotaLimiter(requests_per_minute=2, window=0.2)
+        order = []
+
+        async def request(i: int):
+            await limiter.acquire(0)
+            order.append(i)
+
+        async def run():
+            start = time.monotonic()
+            await asyncio.gather(*(request(i) for i in range(4)))
+            return time.monotonic() - start
+
+        elapsed = asyncio.run(run())
+        assert order == [0, 1, 2, 3]
+        assert elapsed >= 0.2
+        assert limiter.stats.requests == 4
+        assert limiter.stats.queued == 2
+
+    def test_settle_releases_tokens(self):
+        """测试实际用量小于预留时，修正后排队的请求立即放行"""
+        limiter = QuotaLimiter(tokens_per_minute=1000, window=10)
+
+        async def run():
+            reservation = await limiter.acquire(800)
+            waiting = asyncio.create_task(limiter.acquire(500))
+            await asyncio.sleep(0.05)
+            assert not waiting.done()
+            limiter.settle(reservation, 300)
+            async with asyncio.timeout(1):
+                await waiting
+
+        asyncio.run(run())
+        assert limiter.used_tokens == 800
+        assert limiter.stats.actual_tokens == 300
+        assert limiter.stats.estimated_tokens == 800
+
+    def test_oversized_request(self):
+        """测试超过 TPM 配额的请求按配额预留，不会永远等待"""
+        limiter = QuotaLimiter(tokens_per_minute=100, window=10)
+        reservation = asyncio.run(limiter.acquire(500))
+        assert reservation.tokens == 100
+        assert limiter.used_tokens == 100
@@ -0,0 +1,34 @@
+"""全文检索测试"""
+
+from rmts.utils.search import BM25Index, tokenize
+
+
+class TestSearch:
+    """全文检索测试"""
+
+    def test_tokenize(self):
+        """测试中文切分为单字和二元组，英文和数字转为小写的单词"""
+        assert tokenize("草莓蛋糕 Cake2") == ["草", "莓", "蛋", "糕", "草莓", "莓蛋", "蛋糕", "cake2"]
+        assert tokenize("，！") == []
+
+    def test_ranking(self):
+        """测试连续的词得分更高，没有命中的文档不返回"""
+        index = BM25Index()
+        index.add(1, "博士喜欢吃草莓蛋糕")
+        index.add(2, "今天的草莓很甜，蛋也很好吃")
+        index.add(3, "明天要下雨")
+        assert [key for key, _ in index.search("草莓蛋糕")] == [1, 2]
+        assert index.search("打游戏") == []
+        assert [key for key, _ in index.search("雨", limit=1)] == [3]
+        # 只按二元组匹配时，只有单字相同的文档不再命中
+        assert [key for key, _ in index.search("蛋糕", min_term_length=2)] == [1]
+        assert index.search("明白", min_term_length=2) == []
+
+    def test_replace_and_remove(self):
+        """测试替换和删除文档后不再命中旧内容"""
+        index = BM25Index()
+        index.add("a", "草莓")
+        index.add("a", "蓝莓")
+        assert not index.search("草")
+        assert index.remove("a") and not index.remove("a")
+        assert len(index) == 0 and index.search("蓝莓") == []